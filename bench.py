@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for trees, acceptors and transducers.
+
+Usage examples:
+
+  python bench.py                      # run everything, print a table
+  python bench.py --quick -o run.json  # small workloads, save results
+  python bench.py --compare old.json   # compare with an earlier run
+
+Every benchmark runs a function over a workload of generated trees and
+reports the best time over several repetitions as nodes per second,
+together with the peak memory allocated during one separate run.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from prettytable import PrettyTable
+
+from tree import Tree, sn
+from treearena import TreeArena
+from grammars import ss_grammar, gb_grammar, minimalist_grammar
+from transducer_v1 import gb_to_min as gb_to_min_v1
+from transducer_v2 import gb_to_min as gb_to_min_v2
+
+
+#
+# workloads
+#
+
+def wide_tree(width):
+    """Return a tree whose root has the given number of leaf children."""
+    return Tree('S', [Tree('a') for _ in range(width)])
+
+
+def random_gb_tree(rng, depth, categories="NAVPDIC", p=0.5):
+    """Return a random GB-style X-bar tree of at most the given depth in
+    phrases, accepted by grammars.gb_grammar. Specifiers and complements
+    are each present with probability p."""
+    z = rng.choice(categories)
+    head = [z + "'", z]
+    if depth > 0 and rng.random() < p:
+        head.append(random_gb_tree(rng, depth - 1, categories, p))
+    phrase = [z + 'P']
+    if depth > 0 and rng.random() < p:
+        phrase.append(random_gb_tree(rng, depth - 1, categories, p))
+    phrase.append(head)
+    return phrase
+
+
+def random_min_tree(rng, depth, categories="NAVPDTC", p=0.5):
+    """Return a random bare phrase structure tree of at most the given
+    depth in phrases, accepted by grammars.minimalist_grammar."""
+    z = rng.choice(categories)
+    if depth == 0 or rng.random() >= p:
+        return z + 'P'
+    comp = random_min_tree(rng, depth - 1, categories, p)
+    if rng.random() < p:
+        spec = random_min_tree(rng, depth - 1, categories, p)
+        return [z + 'P', spec, [z + "'", z, comp]]
+    return [z + 'P', z, comp]
+
+
+def workloads(scale):
+    """Return a dictionary from workload names to lists of trees, whose
+    sizes grow linearly with scale."""
+    rng = random.Random(637)
+    return {
+        'sn_ladder': [sn(100 * scale)],
+        'wide_flat': [wide_tree(1000 * scale)],
+        'random_gb': [Tree.from_list(random_gb_tree(rng, 6))
+                      for _ in range(100 * scale)],
+        'random_min': [Tree.from_list(random_min_tree(rng, 6))
+                       for _ in range(100 * scale)],
+    }
+
+
+def to_list(tree):
+    """Return the nested list form of a tree accepted by Tree.from_list."""
+    lists = []
+    for node in tree.postorder():
+        n = len(node.children)
+        if n == 0:
+            lists.append(node.data)
+        else:
+            children = lists[-n:]
+            del lists[-n:]
+            lists.append([node.data] + children)
+    return lists.pop()
+
+
+#
+# benchmarks
+#
+
+def _copy(tree):
+    """Return a copy of a tree without any cached statistics."""
+    return TreeArena.from_tree(tree).to_tree()
+
+
+def _bench_from_list(trees, runs):
+    lists = [to_list(t) for t in trees]
+
+    def run():
+        for nodes in lists:
+            Tree.from_list(nodes)
+    return run
+
+
+def _bench_stats(trees, runs):
+    # statistics are cached, so every run gets fresh copies of the trees
+    copies = [[_copy(t) for t in trees] for _ in range(runs)]
+
+    def run():
+        for t in copies.pop():
+            t.size(), t.depth(), t.width(), t.yld()
+    return run
+
+
+def _bench_recognizes(bdfa):
+    def setup(trees, runs):
+        return lambda: [bdfa.recognizes(t) for t in trees]
+    return setup
+
+
+def _bench_recognizes_compiled(bdfa):
+    def setup(trees, runs):
+        compiled = bdfa.compile()
+        return lambda: [compiled.recognizes(t) for t in trees]
+    return setup
+
+
+def _bench_recognizes_many(bdfa):
+    def setup(trees, runs):
+        compiled = bdfa.compile()
+        return lambda: compiled.recognizes_many(trees)
+    return setup
+
+
+def _bench_transform(bdft):
+    def setup(trees, runs):
+        return lambda: [bdft.transform(t) for t in trees]
+    return setup
+
+
+ALL_WORKLOADS = ['sn_ladder', 'wide_flat', 'random_gb', 'random_min']
+XBAR_WORKLOADS = ['random_gb', 'random_min']
+
+# (name, setup function, workload names); the setup function takes the trees
+# of a workload and the number of runs, and returns the function to time
+BENCHMARKS = [
+    ('Tree.from_list', _bench_from_list, ALL_WORKLOADS),
+    ('Tree statistics', _bench_stats, ALL_WORKLOADS),
+    ('ss_grammar.recognizes', _bench_recognizes(ss_grammar), XBAR_WORKLOADS),
+    ('gb_grammar.recognizes', _bench_recognizes(gb_grammar), XBAR_WORKLOADS),
+    ('minimalist_grammar.recognizes', _bench_recognizes(minimalist_grammar),
+     XBAR_WORKLOADS),
+    ('gb_grammar compiled', _bench_recognizes_compiled(gb_grammar), XBAR_WORKLOADS),
+    ('gb_grammar recognizes_many', _bench_recognizes_many(gb_grammar), XBAR_WORKLOADS),
+    ('transducer_v1.transform', _bench_transform(gb_to_min_v1), ['random_gb']),
+    ('transducer_v2.transform', _bench_transform(gb_to_min_v2), ['random_gb']),
+]
+
+
+def measure(run, repeat):
+    """Return the best wall time of repeat calls of run, and the peak memory
+    allocated during one more call, in bytes."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(scale=10, repeat=3, select=None, out=sys.stdout):
+    """Run all benchmarks whose name contains select, if given, and return
+    the results as a JSON-serializable dictionary."""
+    loads = workloads(scale)
+    results = []
+    for name, setup, workload_names in BENCHMARKS:
+        if select is not None and select not in name:
+            continue
+        for workload in workload_names:
+            trees = loads[workload]
+            nodes = sum(t.size() for t in trees)
+            seconds, peak = measure(setup(trees, repeat + 1), repeat)
+            # too fast to time on coarse clocks: the rate is unknown
+            rate = nodes / seconds if seconds > 0 else None
+            results.append({'benchmark': name,
+                            'workload': workload,
+                            'trees': len(trees),
+                            'nodes': nodes,
+                            'seconds': seconds,
+                            'nodes_per_second': rate,
+                            'peak_bytes': peak})
+            if out is not None:
+                out.write(f"{name} on {workload}: {_format_rate(rate)} nodes/s\n")
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'repeat': repeat,
+            'results': results}
+
+
+def _format_rate(rate):
+    """Format a number of nodes per second, "-" if it is unknown."""
+    return "-" if rate is None else f"{rate:,.0f}"
+
+
+def table(run, baseline=None):
+    """Return a PrettyTable of a benchmark run, with speedups relative to a
+    baseline run if given."""
+    columns = ["Benchmark", "Workload", "Nodes", "Nodes/s", "Peak KiB"]
+    if baseline is not None:
+        columns.append("Speedup")
+        before = {(r['benchmark'], r['workload']): r for r in baseline['results']}
+    t = PrettyTable(columns, align='l')
+    for r in run['results']:
+        row = [r['benchmark'], r['workload'], r['nodes'],
+               _format_rate(r['nodes_per_second']), f"{r['peak_bytes'] / 1024:,.0f}"]
+        if baseline is not None:
+            old = before.get((r['benchmark'], r['workload']))
+            if old is None or not old['nodes_per_second'] or not r['nodes_per_second']:
+                row.append("-")
+            else:
+                row.append(f"{r['nodes_per_second'] / old['nodes_per_second']:.2f}x")
+        t.add_row(row)
+    return t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('-s', '--scale', type=int, default=10,
+                        help="workload size multiplier (default: 10)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="timed repetitions per benchmark (default: 3)")
+    parser.add_argument('--quick', action='store_true',
+                        help="shorthand for --scale 1 --repeat 1")
+    parser.add_argument('-k', '--select',
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument('-o', '--output', help="save results as JSON")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.scale, args.repeat = 1, 1
+    run = run_benchmarks(args.scale, args.repeat, args.select, out=sys.stderr)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(table(run, baseline))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TreeBDFAs compiled to integer transition tables.
+"""
+
+import numpy as np
+
+from treearena import TreeArena
+
+
+class CompiledTreeBDFA:
+    """TreeBDFA with interned states and symbols and dense transition tables.
+
+    States and symbols are numbered with small integers. State 0 stands for
+    "no state", i.e. the None reached after a missing transition, so it can
+    be used as a table index like any other state and always leads back to
+    state 0. Transitions are numbered from 1 in the same way, transition 0
+    being the missing one.
+
+    Parameters
+    ----------
+    bdfa: the TreeBDFA to compile
+    max_dense: largest number of cells allowed in the dense table of a
+      single arity; arities whose table would be larger are stored sparsely
+
+    Attributes
+    ----------
+    states: list of states, indexed by state ID (states[0] is None)
+    symbols: list of symbols, indexed by symbol ID
+    keys: list of original transition keys, indexed by transition ID
+      (keys[0] is None)
+    targets: array mapping transition IDs to the IDs of the states reached
+    finals: boolean array, True at the IDs of final states
+    tables: dictionary from arity k to either an array of shape
+      (len(symbols),) + (len(states),) * k, whose entry
+      [symbol, child_1, ..., child_k] is a transition ID, or, for sparse
+      arities, a dictionary {(symbol, child_1, ..., child_k): transition ID}
+    """
+
+    def __init__(self, bdfa, max_dense=1 << 20):
+        self.states = [None]
+        self.state_ids = {None: 0}
+        self.symbols = []
+        self.symbol_ids = {}
+
+        for state in sorted(bdfa.states, key=str):
+            self._state_id(state)
+        for symbol in sorted(bdfa.alphabet, key=str):
+            self._symbol_id(symbol)
+
+        self.keys = [None]
+        targets = [0]
+        by_arity = {}
+        for (statelist, symbol), nextstate in bdfa.transitions.items():
+            row = (self._symbol_id(symbol),) + tuple(self._state_id(q) for q in statelist)
+            targets.append(self._state_id(nextstate))
+            by_arity.setdefault(len(statelist), []).append((row, len(self.keys)))
+            self.keys.append((statelist, symbol))
+
+        self.targets = np.array(targets, dtype=np.int32)
+        # final states missing from the states and transitions are
+        # interned too, before the finals array is sized
+        final_ids = [self._state_id(state) for state in bdfa.finals]
+        self.finals = np.zeros(len(self.states), dtype=bool)
+        self.finals[final_ids] = True
+
+        nstates = len(self.states)
+        nsymbols = len(self.symbols)
+        self.tables = {}
+        for k, rows in by_arity.items():
+            if nsymbols * nstates ** k <= max_dense:
+                table = np.zeros((nsymbols,) + (nstates,) * k, dtype=np.int32)
+                for row, tid in rows:
+                    table[row] = tid
+            else:
+                table = dict(rows)
+            self.tables[k] = table
+
+        # nested lists of target states mirroring the tables, which are
+        # much faster than NumPy arrays to index one element at a time
+        self._rows = {}
+        for k, table in self.tables.items():
+            if isinstance(table, dict):
+                self._rows[k] = {row: targets[tid] for row, tid in table.items()}
+            else:
+                self._rows[k] = self.targets[table].tolist()
+        self._finals = self.finals.tolist()
+        self._leaf = self._dense_rows(0)
+        self._unary = self._dense_rows(1)
+        self._binary = self._dense_rows(2)
+        # (symbols list, symbol IDs of its labels), see _arena_symbol_ids
+        self._arena_symbols = None
+
+    def _dense_rows(self, k):
+        rows = self._rows.get(k)
+        return rows if isinstance(rows, list) else None
+
+    def __str__(self):
+        dense = sorted(k for k, t in self.tables.items() if not isinstance(t, dict))
+        sparse = sorted(k for k, t in self.tables.items() if isinstance(t, dict))
+        return ("<CompiledTreeBDFA>\n"
+                f"states: {len(self.states) - 1}\n"
+                f"symbols: {len(self.symbols)}\n"
+                f"transitions: {len(self.keys) - 1}\n"
+                f"dense arities: {dense}\n"
+                f"sparse arities: {sparse}")
+
+    def _state_id(self, state):
+        i = self.state_ids.get(state)
+        if i is None:
+            i = self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return i
+
+    def _symbol_id(self, symbol):
+        i = self.symbol_ids.get(symbol)
+        if i is None:
+            i = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return i
+
+    def _arena_symbol_ids(self, arena):
+        """Return the list of the symbol IDs of the labels of an arena,
+        None for symbols outside the alphabet, indexed by label ID.
+
+        The translation of the last symbols list seen is kept, so arenas
+        sharing one, such as those of a treebin.BinaryCorpus, only pay for
+        it once rather than on every call, however many labels it holds.
+        Labels appended to the list since are translated when first seen."""
+        symbols = arena.symbols
+        cached = self._arena_symbols
+        if cached is None or cached[0] is not symbols:
+            cached = self._arena_symbols = (symbols, [])
+        translated = cached[1]
+        if len(translated) < len(symbols):
+            symbol_ids = self.symbol_ids
+            translated.extend(symbol_ids.get(s)
+                              for s in symbols[len(translated):])
+        return translated
+
+    def _step(self, symbol, children):
+        """Return the ID of the state reached from a node with the given
+        symbol ID and list of child state IDs."""
+        rows = self._rows.get(len(children))
+        if rows is None or symbol is None:
+            return 0
+        if isinstance(rows, dict):
+            return rows.get((symbol,) + tuple(children), 0)
+        row = rows[symbol]
+        for c in children:
+            row = row[c]
+        return row
+
+    def _process(self, tree):
+        """Return the ID of the state reached by processing the given tree,
+        given as a Tree or a TreeArena; 0 if no state is reached."""
+        if isinstance(tree, TreeArena):
+            return self._process_arena(tree)
+        symbol_ids = self.symbol_ids
+        leaf = self._leaf
+        unary = self._unary
+        binary = self._binary
+        states = []
+        for node in tree.postorder():
+            n = len(node.children)
+            symbol = symbol_ids.get(node.data)
+            if symbol is None:
+                q = 0
+            elif n == 0 and leaf is not None:
+                states.append(leaf[symbol])
+                continue
+            elif n == 2 and binary is not None:
+                q = binary[symbol][states[-2]][states[-1]]
+                del states[-1]
+                states[-1] = q
+                continue
+            elif n == 1 and unary is not None:
+                states[-1] = unary[symbol][states[-1]]
+                continue
+            else:
+                q = self._step(symbol, states[len(states) - n:])
+            if n > 0:
+                del states[-n:]
+            states.append(q)
+        return states.pop()
+
+    def _process_arena(self, arena):
+        """Return the ID of the state reached by processing the tree stored
+        in the given arena; 0 if no state is reached."""
+        symbol_ids = self._arena_symbol_ids(arena)
+        labels = arena.labels
+        arity = arena.arity
+        leaf = self._leaf
+        unary = self._unary
+        binary = self._binary
+        states = []
+        # the reverse scan leaves child states on the stack right to left
+        for i in range(len(labels) - 1, -1, -1):
+            n = arity[i]
+            symbol = symbol_ids[labels[i]]
+            if symbol is None:
+                q = 0
+            elif n == 0 and leaf is not None:
+                states.append(leaf[symbol])
+                continue
+            elif n == 2 and binary is not None:
+                q = binary[symbol][states[-1]][states[-2]]
+                del states[-1]
+                states[-1] = q
+                continue
+            elif n == 1 and unary is not None:
+                states[-1] = unary[symbol][states[-1]]
+                continue
+            else:
+                q = self._step(symbol, states[:-n - 1:-1])
+            if n > 0:
+                del states[-n:]
+            states.append(q)
+        return states.pop()
+
+    def _pack(self, trees):
+        """Flatten a sequence of trees, given as Trees or TreeArenas, into
+        arrays holding the nodes of the whole batch level by level.
+
+        Return (levels, order). levels[d] is a pair of arrays (symbols,
+        arity) with the symbol ID (-1 for symbols outside the alphabet) and
+        number of children of every node at distance d from its root. Within
+        a level, nodes are grouped by tree and listed left to right, so the
+        children of the nodes of level d are consecutive in level d + 1 and
+        in the same order as their parents. Level 0 holds the roots, the
+        root of trees[order[i]] being the i-th."""
+        symbol_ids = self.symbol_ids
+        plain = [i for i, t in enumerate(trees) if not isinstance(t, TreeArena)]
+        arenas = [i for i, t in enumerate(trees) if isinstance(t, TreeArena)]
+
+        # all plain trees are walked breadth first at once
+        levels = []
+        nodes = [trees[i] for i in plain]
+        while nodes:
+            levels.append(([symbol_ids.get(node.data, -1) for node in nodes],
+                           [len(node.children) for node in nodes]))
+            nodes = [c for node in nodes for c in node.children]
+
+        # arena nodes are bucketed by depth, preorder being kept within a level
+        for i in arenas:
+            arena = trees[i]
+            labels = self._arena_symbol_ids(arena)
+            depth = [-1] * len(arena)
+            for j, (p, label, n) in enumerate(zip(arena.parent, arena.labels,
+                                                  arena.arity)):
+                d = depth[j] = depth[p] + 1 if p >= 0 else 0
+                if d == len(levels):
+                    levels.append(([], []))
+                level_symbols, level_arity = levels[d]
+                symbol = labels[label]
+                level_symbols.append(-1 if symbol is None else symbol)
+                level_arity.append(n)
+
+        levels = [(np.array(symbols, dtype=np.int64), np.array(arity, dtype=np.int64))
+                  for symbols, arity in levels]
+        return levels, plain + arenas
+
+    def _transitions_many(self, levels):
+        """Return, for every level of a packed batch, the array of
+        transition IDs fired at its nodes (0 where no transition applies).
+
+        Levels are processed from the deepest up; the nodes of each level
+        and arity are resolved with a single vectorized table lookup."""
+        result = [None] * len(levels)
+        below = np.zeros(0, dtype=np.int32)
+        for d in range(len(levels) - 1, -1, -1):
+            symbols, arity = levels[d]
+            tids = np.zeros(len(symbols), dtype=np.int32)
+            first = np.cumsum(arity) - arity
+            for k in np.unique(arity):
+                table = self.tables.get(int(k))
+                if table is None:
+                    continue
+                nodes = np.flatnonzero((arity == k) & (symbols >= 0))
+                index = (symbols[nodes],) + tuple(below[first[nodes] + j]
+                                                 for j in range(k))
+                if isinstance(table, dict):
+                    rows = zip(*(a.tolist() for a in index))
+                    tids[nodes] = [table.get(row, 0) for row in rows]
+                else:
+                    tids[nodes] = table[index]
+            result[d] = tids
+            below = self.targets[tids]
+        return result
+
+    def recognizes_many(self, trees):
+        """Processes a sequence of trees, given as Trees or TreeArenas, and
+        returns a boolean array that is True where a final state is reached.
+
+        The whole batch is flattened into one set of node arrays and
+        evaluated level by level, from the deepest nodes up, so that each
+        level needs only a few vectorized table lookups. This is a
+        convenience for getting the results of a batch as an array: the
+        trees are flattened node by node in Python, which costs more than
+        the lookups save, so calling recognizes on each tree is faster."""
+        trees = list(trees)
+        result = np.zeros(len(trees), dtype=bool)
+        if len(trees) == 0:
+            return result
+        levels, order = self._pack(trees)
+        tids = self._transitions_many(levels)
+        result[order] = self.finals[self.targets[tids[0]]]
+        return result
+
+    def run(self, tree):
+        """Return the state reached by processing the given tree, if any,
+        None otherwise."""
+        return self.states[self._process(tree)]
+
+    def recognizes(self, tree):
+        """Processes a tree and returns True if a final state is reached,
+        False otherwise."""
+        return self._finals[self._process(tree)]
+
+
+def test():
+    from timeit import timeit
+
+    from grammars import gb_grammar, minimalist_grammar, ss_grammar
+    import test_trees as tts
+
+    for name, bdfa, t in [("ss_grammar", ss_grammar, None),
+                          ("gb_grammar", gb_grammar, tts.gb_pp_comp_cp_comp),
+                          ("minimalist_grammar", minimalist_grammar,
+                           tts.min_pp_comp_cp_comp)]:
+        compiled = bdfa.compile()
+        print(f"{name}:\n{compiled}")
+        if t is not None:
+            n = 2000
+            slow = timeit(lambda: bdfa.recognizes(t), number=n)
+            fast = timeit(lambda: compiled.recognizes(t), number=n)
+            print(f"recognizes: {compiled.recognizes(t)} "
+                  f"(dict {slow / n * 1e6:.1f} us, compiled {fast / n * 1e6:.1f} us)")
+        print()
+
+
+if __name__ == "__main__":
+    test()
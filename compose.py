@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Composition of a TreeBDFT with a TreeBDFA reading its output, deciding in a
+single pass over the input tree whether the output tree will be accepted.
+"""
+
+from treebdfa import TreeBDFA
+from treebdft import _VAR, _CONST
+from treearena import TreeArena
+from product import reachable_product
+
+
+class FusedTransducer:
+    """A TreeBDFT fused with a TreeBDFA that checks its output trees.
+
+    The states of the fused automaton are pairs (transducer state, acceptor
+    state), where the acceptor state is the one the acceptor would reach on
+    the output tree of the node. It is computed by running the acceptor over
+    the compiled output template of each transducer transition, with the
+    variables standing for the acceptor states of the children's outputs,
+    so the output tree itself never has to be built. Either state of a pair
+    may be None. Fused transitions are computed on first use and cached.
+
+    Parameters
+    ----------
+    bdft: the TreeBDFT
+    bdfa: the TreeBDFA run on the output trees of bdft
+    """
+
+    def __init__(self, bdft, bdfa):
+        self.bdft = bdft
+        self.bdfa = bdfa
+        # cache of {(children_state_pair_list, parent_symbol): state_pair}
+        self.transitions = {}
+        # acceptor states of the constant fragments of the output templates
+        self._const_states = {}
+
+    def __str__(self):
+        return (f"<FusedTransducer, "
+                f"{len(self.transitions)} cached transitions>")
+
+    def _output_state(self, plan, states):
+        """Return the acceptor state reached on the output of a compiled
+        template, given the acceptor states of the children's outputs."""
+        transitions = self.bdfa.transitions
+        outputs = []
+        for op, arg, n in plan:
+            if op == _VAR:
+                outputs.append(states[arg])
+            elif op == _CONST:
+                state = self._const_states.get(id(arg))
+                if state is None and id(arg) not in self._const_states:
+                    state = self._const_states[id(arg)] = self.bdfa._process(arg)
+                outputs.append(state)
+            elif n == 0:
+                outputs.append(transitions.get(((), arg), None))
+            else:
+                statelist = tuple(outputs[-n:])
+                del outputs[-n:]
+                outputs.append(transitions.get((statelist, arg), None))
+        return outputs.pop()
+
+    def _step(self, statelist, symbol):
+        """Compute, cache and return the fused transition for the given
+        child state pairs and symbol."""
+        try:
+            next_state, plan = self.bdft._plans[
+                (tuple([q for q, _ in statelist]), symbol)]
+        except KeyError:
+            state = (None, None)
+        else:
+            state = (next_state,
+                     self._output_state(plan, [p for _, p in statelist]))
+        self.transitions[(statelist, symbol)] = state
+        return state
+
+    def _process(self, intree):
+        """Return the state pair reached by processing the given tree, given
+        as a Tree or a TreeArena."""
+        transitions = self.transitions
+        step = self._step
+        states = []
+        if isinstance(intree, TreeArena):
+            labels = intree.labels
+            arity = intree.arity
+            symbols = intree.symbols
+            nodes = ((arity[i], symbols[labels[i]])
+                     for i in range(len(labels) - 1, -1, -1))
+        else:
+            nodes = ((len(node.children), node.data) for node in intree.postorder())
+            arity = None
+        for n, symbol in nodes:
+            if n == 0:
+                statelist = ()
+            elif arity is None:
+                statelist = tuple(states[-n:])
+                del states[-n:]
+            else:
+                # reverse preorder, see TreeBDFA._process_arena
+                statelist = tuple(states[:-n - 1:-1])
+                del states[-n:]
+            key = (statelist, symbol)
+            state = transitions.get(key)
+            states.append(state if state is not None else step(*key))
+        return states.pop()
+
+    def _accepts(self, state):
+        q, p = state
+        return q in self.bdft.finals and p in self.bdfa.finals
+
+    def recognizes(self, intree):
+        """Processes an input tree and returns True if the transducer
+        transforms it into a tree accepted by the acceptor, False otherwise,
+        without building the output tree."""
+        return self._accepts(self._process(intree))
+
+    def transform(self, intree):
+        """Return the output of the transducer for an input tree if it is
+        accepted by the acceptor, else None. The output tree is only built
+        once the input is known to be accepted."""
+        if not self.recognizes(intree):
+            return None
+        return self.bdft.transform(intree)
+
+    def to_bdfa(self):
+        """Return a TreeBDFA over the reachable state pairs, built eagerly,
+        accepting the input trees whose output is accepted."""
+        # driven by the transducer transitions on the first component
+        reachable, transitions = reachable_product([self.bdft.transitions],
+                                                   self._step)
+        finals = {state for state in reachable if self._accepts(state)}
+        return TreeBDFA(reachable, self.bdft.alph, finals, transitions)
+
+
+def compose(bdft, bdfa):
+    """Return a FusedTransducer running bdfa on the output of bdft."""
+    return FusedTransducer(bdft, bdfa)
+
+
+def test():
+    from grammars import minimalist_grammar
+    from transducer_v2 import gb_to_min
+    import test_trees as tts
+
+    fused = compose(gb_to_min, minimalist_grammar)
+    for t in [tts.gb_np_n, tts.gb_np_d_n, tts.gb_simple_trans_clause,
+              tts.gb_pp_comp_cp_comp]:
+        print(t, fused.recognizes(t), fused.transform(t))
+    acceptor = fused.to_bdfa()
+    print(f"as a TreeBDFA: {len(acceptor.states)} states, "
+          f"{len(acceptor.transitions)} transitions")
+
+
+if __name__ == "__main__":
+    test()
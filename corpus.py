@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Run a tree acceptor or transducer over a whole corpus on several cores.
+
+Usage examples:
+
+  python corpus.py recognize grammars:gb_grammar corpus.txt
+  python corpus.py transform transducer_v2:gb_to_min corpus.txt -o out.txt -j 8
+
+The automaton is given as module:attribute and is imported once in every
+worker process. The corpus is split into chunks of whole trees, which are
+sent to the workers as text; results are written in input order, one line
+per tree: True or False when recognizing, the output tree when
+transforming, or [] if there is none, which treeio.read_trees reads back as
+None. Missing trees in the input are rejected, so the output of a transducer
+can be fed back in.
+"""
+
+import argparse
+import importlib
+import itertools
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from treebdfa import TreeBDFA
+from treeio import parse_trees, _EMPTY
+
+_OPENERS = {'bracket': '[', 'penn': '('}
+_CLOSERS = {'bracket': ']', 'penn': ')'}
+
+# automaton loaded by _init_worker in each worker process
+_worker = None
+
+
+def load(spec):
+    """Return the object named by a module:attribute specification."""
+    module, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f"Expected module:attribute, got {spec!r}")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def _init_worker(mode, spec):
+    global _worker
+    automaton = load(spec)
+    if mode == 'recognize' and isinstance(automaton, TreeBDFA):
+        automaton = automaton.compile()
+    _worker = (mode, automaton)
+
+
+def _run_chunk(text, fmt):
+    """Process the trees stored in a chunk of text and return the list of
+    result lines."""
+    mode, automaton = _worker
+    # missing trees, as written for rejected inputs, are rejected in turn
+    trees = parse_trees(text, fmt)
+    if mode == 'recognize':
+        # one tree at a time, which is faster than recognizes_many
+        return [str(t is not None and automaton.recognizes(t)) for t in trees]
+    outputs = (None if t is None else automaton.transform(t) for t in trees)
+    return [_EMPTY['bracket'] if out is None else str(out) for out in outputs]
+
+
+def _detect_format(f):
+    """Return the format of a corpus and the lines read while detecting it."""
+    lines = []
+    for line in f:
+        lines.append(line)
+        if line.strip():
+            return ('penn' if line.lstrip().startswith('(') else 'bracket'), lines
+    return 'bracket', lines
+
+
+def _chunks(lines, fmt, chunk_size):
+    """Group lines into chunks of about chunk_size lines each, never
+    splitting a tree. Brackets are only counted, not parsed."""
+    opener = _OPENERS[fmt]
+    closer = _CLOSERS[fmt]
+    chunk = []
+    balance = 0
+    for line in lines:
+        chunk.append(line)
+        balance += line.count(opener) - line.count(closer)
+        if balance == 0 and len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def run_corpus(mode, spec, source, sink, workers=None, chunk_size=1000,
+               fmt='auto', progress=None):
+    """Process every tree of a corpus file and write one result line per
+    tree to sink, in input order.
+
+    mode is 'recognize' or 'transform', spec the module:attribute of the
+    automaton, source and sink text file objects. workers is the number
+    of worker processes (None for one per core, 0 to run in this process)
+    and chunk_size the number of lines sent to a worker at a time. If
+    progress is a file object, throughput is reported to it as chunks
+    complete. Return a dictionary of run statistics."""
+    if mode not in ('recognize', 'transform'):
+        raise ValueError(f"Unknown mode: {mode}")
+    start = time.perf_counter()
+    if fmt == 'auto':
+        fmt, head = _detect_format(source)
+    else:
+        head = []
+    chunks = _chunks(itertools.chain(head, source), fmt, chunk_size)
+    n = 0
+
+    def emit(lines):
+        nonlocal n
+        for line in lines:
+            sink.write(line)
+            sink.write("\n")
+        n += len(lines)
+        if progress is not None:
+            elapsed = time.perf_counter() - start
+            progress.write(f"\r{n} trees, {n / elapsed:.0f} trees/s")
+            progress.flush()
+
+    if workers == 0:
+        _init_worker(mode, spec)
+        for chunk in chunks:
+            emit(_run_chunk(chunk, fmt))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(mode, spec)) as executor:
+            # keep a bounded number of chunks in flight so that the corpus
+            # is never read into memory as a whole
+            window = 4 * (workers or os.cpu_count() or 1)
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_run_chunk, chunk, fmt))
+                if len(pending) >= window:
+                    emit(pending.popleft().result())
+            while pending:
+                emit(pending.popleft().result())
+
+    elapsed = time.perf_counter() - start
+    if progress is not None:
+        progress.write("\n")
+    return {'trees': n,
+            'seconds': elapsed,
+            'trees_per_second': n / elapsed if elapsed > 0 else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a TreeBDFA or TreeBDFT over a corpus of trees.")
+    parser.add_argument('mode', choices=['recognize', 'transform'])
+    parser.add_argument('automaton',
+                        help="module:attribute, e.g. grammars:gb_grammar")
+    parser.add_argument('input', help="corpus file, - for standard input")
+    parser.add_argument('-o', '--output', default='-',
+                        help="result file, - for standard output (default)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes, 0 to run in-process "
+                             "(default: one per core)")
+    parser.add_argument('-c', '--chunk-size', type=int, default=1000,
+                        help="lines of input per task (default: 1000)")
+    parser.add_argument('-f', '--format', default='auto',
+                        choices=['auto', 'bracket', 'penn'])
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="do not report progress")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        stats = run_corpus(args.mode, args.automaton, source, sink,
+                           workers=args.workers, chunk_size=args.chunk_size,
+                           fmt=args.format,
+                           progress=None if args.quiet else sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    if not args.quiet:
+        print(f"{stats['trees']} trees in {stats['seconds']:.2f}s "
+              f"({stats['trees_per_second']:.0f} trees/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
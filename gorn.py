@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Precomputed Gorn address index of a tree.
+"""
+
+from array import array
+
+import numpy as np
+
+
+class GornIndex:
+    """Index of the nodes of a tree by Gorn address and preorder rank.
+
+    Nodes are numbered by their rank in preorder, so every subtree occupies
+    a contiguous range of ranks, and are stored in flat arrays of parent
+    ranks, depths, subtree ends and child ranks. Addresses are tuples of
+    child positions counted from 0, the root having the empty address, and
+    may be given as any sequence of integers, which is never modified.
+    Lowest common ancestors are found in constant time with a sparse table
+    over the Euler tour of the tree.
+
+    Parameters
+    ----------
+    tree: the tree to index; it should not be modified afterwards
+
+    Attributes
+    ----------
+    nodes: list of the nodes of the tree in preorder
+    parent: rank of the parent of each node, -1 for the root
+    depth: depth of each node, 0 for the root
+    end: rank one past the last node of each node's subtree
+    position: position of each node among its siblings, -1 for the root
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.nodes = []
+        self.parent = array('i')
+        self.depth = array('i')
+        self.position = array('i')
+        # the ranks of the children of node r are child_ranks[offset[r]:offset[r + 1]]
+        self.offset = array('i')
+        self.child_ranks = array('i')
+        self._ranks = {}  # node id -> rank of its first occurrence
+
+        stack = [(tree, -1, 0, -1)]
+        while stack:
+            node, parent, depth, position = stack.pop()
+            rank = len(self.nodes)
+            self.nodes.append(node)
+            self._ranks.setdefault(id(node), rank)
+            self.parent.append(parent)
+            self.depth.append(depth)
+            self.position.append(position)
+            stack.extend((c, rank, depth + 1, i)
+                         for i, c in reversed(list(enumerate(node.children))))
+
+        n = len(self.nodes)
+        self.end = array('i', range(1, n + 1))
+        arity = array('i', [0]) * n
+        for rank in range(n - 1, 0, -1):
+            p = self.parent[rank]
+            arity[p] += 1
+            if self.end[rank] > self.end[p]:
+                self.end[p] = self.end[rank]
+        total = 0
+        for rank in range(n):
+            self.offset.append(total)
+            total += arity[rank]
+        self.offset.append(total)
+        self.child_ranks = array('i', [0]) * total
+        for rank in range(1, n):
+            self.child_ranks[self.offset[self.parent[rank]] + self.position[rank]] = rank
+
+        self._build_lca()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _build_lca(self):
+        """Build the Euler tour of the tree and a sparse table of range
+        minima over it. Between the first visits of two nodes, the tour
+        only passes through nodes below their lowest common ancestor, and
+        the ancestor itself, which has the smallest rank of them all."""
+        n = len(self.nodes)
+        tour = array('i')
+        self._first = array('i', [0]) * n
+        stack = [(0, False)]
+        while stack:
+            rank, revisit = stack.pop()
+            if not revisit:
+                self._first[rank] = len(tour)
+            tour.append(rank)
+            if not revisit:
+                children = self.child_ranks[self.offset[rank]:self.offset[rank + 1]]
+                for c in reversed(children):
+                    stack.append((rank, True))
+                    stack.append((c, False))
+        # table[k][i] is the smallest rank in tour[i:i + 2 ** k]
+        level = np.frombuffer(tour, dtype=np.int32).copy()
+        self._table = [level]
+        width = 1
+        while 2 * width <= len(tour):
+            level = np.minimum(level[:-width], level[width:])
+            self._table.append(level)
+            width *= 2
+
+    #
+    # single lookups
+    #
+
+    def rank(self, addr):
+        """Return the preorder rank of the node at a Gorn address, or None if
+        there is no such node."""
+        offset = self.offset
+        child_ranks = self.child_ranks
+        rank = 0
+        for i in addr:
+            start = offset[rank]
+            if not 0 <= i < offset[rank + 1] - start:
+                return None
+            rank = child_ranks[start + i]
+        return rank
+
+    def node(self, addr):
+        """Return the node at a Gorn address, or None if there is none."""
+        rank = self.rank(addr)
+        return None if rank is None else self.nodes[rank]
+
+    def address(self, rank):
+        """Return the Gorn address of the node with the given rank."""
+        addr = []
+        while rank > 0:
+            addr.append(self.position[rank])
+            rank = self.parent[rank]
+        return tuple(reversed(addr))
+
+    def address_of(self, node):
+        """Return the Gorn address of a node of the tree, or of its first
+        occurrence in preorder if it is shared, or None if it is not part of
+        the tree."""
+        rank = self._ranks.get(id(node))
+        return None if rank is None else self.address(rank)
+
+    def parent_address(self, addr):
+        """Return the Gorn address of the parent of the node at a Gorn
+        address, or None for the root."""
+        return tuple(addr[:-1]) if len(addr) > 0 else None
+
+    def subtree_range(self, addr):
+        """Return the range of preorder ranks of the subtree at a Gorn
+        address, as a pair (start, end)."""
+        rank = self._checked_rank(addr)
+        return rank, self.end[rank]
+
+    def is_ancestor(self, addr1, addr2):
+        """Return True if the node at addr1 dominates (or is) the node at
+        addr2, False otherwise."""
+        rank1 = self._checked_rank(addr1)
+        rank2 = self._checked_rank(addr2)
+        return rank1 <= rank2 < self.end[rank1]
+
+    def _checked_rank(self, addr):
+        rank = self.rank(addr)
+        if rank is None:
+            raise ValueError(f"No node at address {tuple(addr)}.")
+        return rank
+
+    def lca_rank(self, rank1, rank2):
+        """Return the rank of the lowest common ancestor of the nodes with
+        the given ranks."""
+        i = self._first[rank1]
+        j = self._first[rank2]
+        if i > j:
+            i, j = j, i
+        k = (j - i + 1).bit_length() - 1
+        level = self._table[k]
+        return int(min(level[i], level[j - (1 << k) + 1]))
+
+    def lca(self, addr1, addr2):
+        """Return the Gorn address of the lowest common ancestor of the nodes
+        at two Gorn addresses."""
+        return self.address(self.lca_rank(self._checked_rank(addr1),
+                                          self._checked_rank(addr2)))
+
+    #
+    # batch lookups
+    #
+
+    def ranks(self, addrs):
+        """Return the list of preorder ranks of the nodes at a sequence of
+        Gorn addresses, with None for missing nodes."""
+        rank = self.rank
+        return [rank(addr) for addr in addrs]
+
+    def nodes_at(self, addrs):
+        """Return the list of nodes at a sequence of Gorn addresses, with
+        None for missing nodes."""
+        nodes = self.nodes
+        return [None if r is None else nodes[r] for r in self.ranks(addrs)]
+
+    def lca_ranks(self, ranks1, ranks2):
+        """Return a NumPy array of the ranks of the lowest common ancestors
+        of two equally long sequences of ranks, computed all at once."""
+        first = np.frombuffer(self._first, dtype=np.int32)
+        i = first[np.asarray(ranks1, dtype=np.int64)]
+        j = first[np.asarray(ranks2, dtype=np.int64)]
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        k = np.zeros(len(i), dtype=np.int64)
+        length = j - i + 1
+        # k = floor(log2(length)), found level by level
+        for level in range(1, len(self._table)):
+            k[length >= (1 << level)] = level
+        result = np.empty(len(i), dtype=np.int32)
+        for level in np.unique(k):
+            at = k == level
+            table = self._table[level]
+            result[at] = np.minimum(table[i[at]], table[j[at] - (1 << int(level)) + 1])
+        return result
+
+
+def test():
+    from tree import sn
+    import test_trees as tts
+
+    index = GornIndex(tts.gb_pp_comp_cp_comp)
+    print(tts.gb_pp_comp_cp_comp)
+    for addr in [(), (0,), (1, 1, 0), (1, 1, 0, 1, 0, 1), (3,)]:
+        print(addr, index.node(addr), index.rank(addr))
+    print(index.lca((0, 1, 1), (0, 0, 0)), index.lca((1, 1, 0), (1, 0)))
+    print(index.subtree_range((0,)), index.is_ancestor((1,), (1, 1, 0)))
+
+    index = GornIndex(sn(20000))
+    deep = (1,) * 10000 + (0,)
+    print(index.node(deep), index.address(index.rank(deep)) == deep,
+          len(index.lca(deep, (1,) * 15000 + (2,))))
+
+
+if __name__ == "__main__":
+    test()
@@ -6,6 +6,7 @@ Definitions of GB and Minimalist tree grammars and transducers.
 
 from tree import Tree
 from treebdfa import TreeBDFA
+from schema import RuleSchema, RuleTable
 import test_trees
 
 #
@@ -91,6 +92,38 @@ for z in "NAVPDTC":
 minimalist_grammar = TreeBDFA(qs, xs, fs, ts)
 
 
+#
+# Schematic variants
+#
+# The same grammars, with the rules written once as schemas over a set of
+#   categories instead of once per category. Transitions are matched when
+#   first used, and all schemas are only expanded when the whole table is
+#   needed, e.g. by minimize or compile; see schema.RuleTable. Only the
+#   states and symbols that do not depend on a category are listed, the
+#   others being derived from the schemas when first needed.
+#
+
+gb_categories = frozenset("NAVPDIC")
+gb_grammar_schematic = TreeBDFA(
+    ["qXP"], [], ["qXP"],
+    RuleTable({}, [
+        RuleSchema([], "{z}", "q{z}", z=gb_categories),
+        RuleSchema(["q{z}"], "{z}'", "q{z}bar", z=gb_categories),
+        RuleSchema(["q{z}", "qXP"], "{z}'", "q{z}bar", z=gb_categories),
+        RuleSchema(["q{z}bar"], "{z}P", "qXP", z=gb_categories),
+        RuleSchema(["qXP", "q{z}bar"], "{z}P", "qXP", z=gb_categories)]))
+
+minimalist_categories = frozenset("NAVPDTC")
+minimalist_grammar_schematic = TreeBDFA(
+    ["qXP"], [], ["qXP"],
+    RuleTable({}, [
+        RuleSchema([], "{z}P", "qXP", z=minimalist_categories),
+        RuleSchema([], "{z}", "q{z}", z=minimalist_categories),
+        RuleSchema(["q{z}", "qXP"], "{z}P", "qXP", z=minimalist_categories),
+        RuleSchema(["q{z}", "qXP"], "{z}'", "q{z}bar", z=minimalist_categories),
+        RuleSchema(["qXP", "q{z}bar"], "{z}P", "qXP", z=minimalist_categories)]))
+
+
 def test_simple():
     t1 = Tree.from_list(['S', ['NP', ['Det'], ['N']],
                          ['VP', ['V'], ['NP', ['Det'], ['N']]]])
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Incremental runs of tree automata over trees that are edited one node at a
+time.
+"""
+
+from tree import Tree
+from treebdft import TreeBDFT
+
+
+class TreeRun:
+    """Run of a TreeBDFA or TreeBDFT over a tree, kept up to date as the
+    tree is edited.
+
+    The state reached at every node, and for a TreeBDFT its output tree, is
+    recorded in a memo dictionary keyed by node id, as used by the automata's
+    _process_shared. Edits never modify nodes: the nodes on the path from
+    the root to the edited node are copied, sharing all other subtrees with
+    the previous version of the tree, so that only the copied path has to
+    be evaluated again, in O(depth) steps instead of O(size). Trees passed
+    to or obtained from a run must therefore not be modified directly.
+
+    Parameters
+    ----------
+    automaton: TreeBDFA or TreeBDFT
+    tree: the initial tree
+    """
+
+    def __init__(self, automaton, tree):
+        self.automaton = automaton
+        self.tree = tree
+        self.memo = {}
+        self.automaton._process_shared(tree, memo=self.memo)
+
+    def _result(self, node):
+        result = self.memo[id(node)]
+        return result[0] if isinstance(self.automaton, TreeBDFT) else result
+
+    def state(self):
+        """Return the state reached at the root of the tree."""
+        return self._result(self.tree)
+
+    def state_at(self, addr):
+        """Return the state reached at the node at the given Gorn address."""
+        return self._result(self._path(addr)[-1])
+
+    def accepted(self):
+        """Return True if the root state is a final state, False otherwise."""
+        return self.state() in self.automaton.finals
+
+    def output(self):
+        """Return the output tree of a TreeBDFT for the current tree if its
+        root state is a final state, else None."""
+        state, outtree = self.memo[id(self.tree)]
+        return outtree if state in self.automaton.finals else None
+
+    def _path(self, addr):
+        """Return the list of nodes from the root to the node at the given
+        Gorn address."""
+        path = [self.tree]
+        for i in addr:
+            children = path[-1].children
+            if not 0 <= i < len(children):
+                raise ValueError(f"No node at address {list(addr)}.")
+            path.append(children[i])
+        return path
+
+    def _edit(self, addr, new, removed):
+        """Replace the node at the given address by new, copying the path
+        above it, and evaluate the new nodes. removed lists the nodes of the
+        replaced subtree that are not part of new."""
+        path = self._path(addr)
+        for node, i in zip(reversed(path[:-1]), reversed(addr)):
+            children = list(node.children)
+            children[i] = new
+            new = Tree(node.data, children)
+        # forget the results of the replaced nodes, since their ids may be
+        # reused once they are freed; should any of them still be in use
+        # elsewhere in the tree, they are evaluated again when needed
+        for node in path[:-1] + removed:
+            self.memo.pop(id(node), None)
+        self.tree = new
+        self.automaton._process_shared(new, memo=self.memo)
+
+    def replace(self, addr, subtree):
+        """Replace the subtree at the given Gorn address by another tree.
+        Return the new root state."""
+        old = self._path(addr)[-1]
+        kept = {id(node) for node in subtree.dag_postorder()}
+        self._edit(addr, subtree, old.dag_postorder(done=kept))
+        return self.state()
+
+    def relabel(self, addr, label):
+        """Change the label of the node at the given Gorn address. Return the
+        new root state."""
+        old = self._path(addr)[-1]
+        self._edit(addr, Tree(label, list(old.children)), [old])
+        return self.state()
+
+
+def test():
+    from grammars import gb_grammar
+    from transducer_v2 import gb_to_min
+    import test_trees as tts
+
+    run = TreeRun(gb_grammar, tts.gb_simple_trans_clause)
+    print(run.tree, run.accepted())
+    run.relabel([1, 1, 0, 1], "VP")
+    print(run.tree, run.accepted())
+    run.relabel([1, 1, 0, 1], "NP")
+    print(run.tree, run.accepted())
+
+    run = TreeRun(gb_to_min, tts.gb_np_n)
+    print(run.tree, run.output())
+    run.replace([0, 0], Tree('D'))
+    print(run.tree, run.output())
+
+
+if __name__ == "__main__":
+    test()
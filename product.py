@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Product constructions of TreeBDFAs: run several acceptors over a tree in a
+single bottom-up pass, or combine them into their intersection or union.
+"""
+
+from itertools import product
+
+from treebdfa import TreeBDFA
+from treearena import TreeArena
+
+
+class ProductBDFA:
+    """Product of several TreeBDFAs, reporting the verdict of each of them.
+
+    The states of the product are tuples of component states, where a
+    component that has no transition is in state None. Product transitions
+    are computed on first use and cached, so only the state tuples that
+    actually occur in the processed trees are ever built.
+
+    Parameters
+    ----------
+    bdfas: sequence of TreeBDFAs
+    """
+
+    def __init__(self, bdfas):
+        self.bdfas = list(bdfas)
+        self.dead = (None,) * len(self.bdfas)
+        # cache of {(children_state_tuple_list, parent_symbol): state_tuple}
+        self.transitions = {}
+
+    def __str__(self):
+        return (f"<ProductBDFA of {len(self.bdfas)} TreeBDFAs, "
+                f"{len(self.transitions)} cached transitions>")
+
+    def _step(self, statelist, symbol):
+        """Compute, cache and return the product transition for the given
+        child state tuples and symbol."""
+        state = tuple(bdfa.transitions.get(
+                          (tuple([states[i] for states in statelist]), symbol), None)
+                      for i, bdfa in enumerate(self.bdfas))
+        self.transitions[(statelist, symbol)] = state
+        return state
+
+    def _process(self, subtree):
+        """Return the state tuple reached by processing the given tree,
+        given as a Tree or a TreeArena."""
+        if isinstance(subtree, TreeArena):
+            return self._process_arena(subtree)
+        transitions = self.transitions
+        step = self._step
+        states = []
+        for node in subtree.postorder():
+            n = len(node.children)
+            if n == 0:
+                statelist = ()
+            else:
+                statelist = tuple(states[-n:])
+                del states[-n:]
+            key = (statelist, node.data)
+            state = transitions.get(key)
+            states.append(state if state is not None else step(*key))
+        return states.pop()
+
+    def _process_arena(self, arena):
+        """Return the state tuple reached by processing the tree stored in
+        the given arena; see TreeBDFA._process_arena."""
+        transitions = self.transitions
+        step = self._step
+        labels = arena.labels
+        arity = arena.arity
+        symbols = arena.symbols
+        states = []
+        for i in range(len(labels) - 1, -1, -1):
+            n = arity[i]
+            if n == 0:
+                statelist = ()
+            else:
+                statelist = tuple(states[:-n - 1:-1])
+                del states[-n:]
+            key = (statelist, symbols[labels[i]])
+            state = transitions.get(key)
+            states.append(state if state is not None else step(*key))
+        return states.pop()
+
+    def verdicts(self, tree):
+        """Processes a tree once and returns a tuple holding, for each
+        component, True if it reaches a final state, False otherwise."""
+        state = self._process(tree)
+        return tuple(q in bdfa.finals for q, bdfa in zip(state, self.bdfas))
+
+    def recognizes(self, tree):
+        """Processes a tree and returns True if every component reaches a
+        final state, False otherwise."""
+        return all(self.verdicts(tree))
+
+    def _reachable_transitions(self):
+        """Return the product transitions between all reachable state tuples,
+        other than the dead one; see reachable_product."""
+        return reachable_product([bdfa.transitions for bdfa in self.bdfas],
+                                 self._step)
+
+    def to_bdfa(self, accept=all):
+        """Return a TreeBDFA over the reachable state tuples of the product,
+        built eagerly. A state tuple is final if accept, applied to the
+        tuple of component verdicts, returns True."""
+        states, transitions = self._reachable_transitions()
+        finals = {state for state in states
+                  if accept(q in bdfa.finals for q, bdfa in zip(state, self.bdfas))}
+        alphabet = set().union(*(bdfa.alphabet for bdfa in self.bdfas))
+        return TreeBDFA(states, alphabet, finals, transitions)
+
+
+class ProductIndex:
+    """Index of the state tuples found so far while exploring the product
+    of several transition tables, listing the product transitions that
+    become possible as tuples are added.
+
+    Component i of a state tuple is a state of the i-th table, or None.
+    The tables drive the exploration: a transition of table i is only
+    combined with child tuples whose component i are its child states, so
+    only child tuples that some component can move on are tried.
+
+    Parameters
+    ----------
+    tables: sequence of transition dictionaries, keyed by
+      (children_state_list, parent_symbol); state tuples may have more
+      components than there are tables, the others being ignored
+    """
+
+    def __init__(self, tables):
+        self.tables = list(tables)
+        # occurrences[i][q]: (statelist, symbol, position) for every
+        # transition of table i with q among its children
+        self._occurrences = [{} for _ in self.tables]
+        for i, table in enumerate(self.tables):
+            for (statelist, symbol) in table:
+                for j, q in enumerate(statelist):
+                    self._occurrences[i].setdefault(q, []).append((statelist, symbol, j))
+        # by_component[i][q]: added state tuples with q as component i
+        self._by_component = [{} for _ in self.tables]
+
+    def leaves(self):
+        """Return the list of the keys (children, symbol) of the product
+        transitions without children."""
+        return [((), symbol) for table in self.tables
+                for (statelist, symbol) in table if not statelist]
+
+    def add(self, state):
+        """Add a state tuple and return the list of the keys (children,
+        symbol) of the product transitions with it among their children,
+        the other children being tuples added before. A key may be listed
+        more than once."""
+        keys = []
+        for i, q in enumerate(state[:len(self.tables)]):
+            if q is not None:
+                self._by_component[i].setdefault(q, []).append(state)
+        for i, q in enumerate(state[:len(self.tables)]):
+            if q is None:
+                continue
+            by_state = self._by_component[i]
+            for statelist, symbol, j in self._occurrences[i].get(q, ()):
+                candidates = [by_state.get(c, ()) if k != j else (state,)
+                              for k, c in enumerate(statelist)]
+                keys.extend((children, symbol) for children in product(*candidates))
+        return keys
+
+
+def reachable_product(tables, step):
+    """Return the set of reachable state tuples of the product of several
+    transition tables, and the dictionary of the product transitions
+    between them, {(children_state_tuple_list, parent_symbol): state_tuple}.
+
+    step computes the state tuple of a product transition from its children
+    and symbol. Each new tuple is added to a ProductIndex once, and only
+    the transitions it makes possible are computed."""
+    index = ProductIndex(tables)
+    reachable = set()
+    transitions = {}
+    pending = []
+    keys = index.leaves()
+    while True:
+        for key in keys:
+            if key not in transitions:
+                state = transitions[key] = step(*key)
+                if state not in reachable:
+                    reachable.add(state)
+                    pending.append(state)
+        if not pending:
+            return reachable, transitions
+        keys = index.add(pending.pop())
+
+
+def intersection(*bdfas):
+    """Return a TreeBDFA accepting the trees accepted by all given
+    TreeBDFAs."""
+    return ProductBDFA(bdfas).to_bdfa(all)
+
+
+def union(*bdfas):
+    """Return a TreeBDFA accepting the trees accepted by any of the given
+    TreeBDFAs."""
+    return ProductBDFA(bdfas).to_bdfa(any)
+
+
+def test():
+    from grammars import ss_grammar, gb_grammar, minimalist_grammar
+    import test_trees as tts
+
+    grammars = ProductBDFA([ss_grammar, gb_grammar, minimalist_grammar])
+    for t in [tts.gb_np_n, tts.gb_simple_trans_clause, tts.min_dp_d_n,
+              tts.min_xp_w_spec_no_comp]:
+        print(t, grammars.verdicts(t))
+    print(grammars)
+
+    either = union(gb_grammar, minimalist_grammar)
+    print(f"union of gb_grammar and minimalist_grammar: "
+          f"{len(either.states)} states, {len(either.transitions)} transitions")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Counting, uniform sampling and enumeration of the trees accepted by a
+TreeBDFA.
+"""
+
+import random
+
+from tree import Tree
+
+
+class TreeSampler:
+    """Count and sample the trees accepted by a TreeBDFA.
+
+    The number of trees of each size (number of nodes) and depth reaching
+    each state is computed by dynamic programming over the transitions and
+    cached, so that once the tables reach the requested size, every sampled
+    tree only costs the choices made at its own nodes.
+
+    Parameters
+    ----------
+    bdfa: the TreeBDFA whose accepted trees are counted
+    seed: seed, or random.Random instance, used for sampling
+    """
+
+    def __init__(self, bdfa, seed=None):
+        self.bdfa = bdfa
+        self.rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+        # rules as (children states, symbol, state) and the rules by state
+        self.rules = [(statelist, symbol, nextstate)
+                      for (statelist, symbol), nextstate in bdfa.transitions.items()]
+        self.rules_to = {}
+        for r, (statelist, symbol, nextstate) in enumerate(self.rules):
+            self.rules_to.setdefault(nextstate, []).append(r)
+
+        # _sizes[q][n]: number of trees with n nodes reaching state q
+        self._sizes = {q: [0] for q in self.rules_to}
+        self._max_size = 0
+        # _suffixes[r][j][m]: number of ways for the children j, j+1, ...
+        # of rule r to have m nodes in total
+        self._suffixes = [[[] for _ in range(len(statelist) + 1)]
+                          for statelist, _, _ in self.rules]
+        # _depths[q][d]: number of trees of depth at most d reaching state q
+        self._depths = {q: [] for q in self.rules_to}
+        self._max_depth = -1
+
+    #
+    # counting
+    #
+
+    def _size(self, q, n):
+        counts = self._sizes.get(q)
+        return counts[n] if counts is not None and n < len(counts) else 0
+
+    def _extend_sizes(self, size):
+        """Extend the size tables to trees of up to the given size."""
+        for n in range(self._max_size + 1, size + 1):
+            m = n - 1
+            # first extend every suffix table to m nodes, which only needs
+            # counts of trees smaller than n
+            for (statelist, _, _), suffix in zip(self.rules, self._suffixes):
+                suffix[-1].append(1 if m == 0 else 0)
+                for j in range(len(statelist) - 1, -1, -1):
+                    c = statelist[j]
+                    below = suffix[j + 1]
+                    suffix[j].append(sum(self._size(c, a) * below[m - a]
+                                         for a in range(1, m + 1)))
+            for q, rules in self.rules_to.items():
+                self._sizes[q].append(sum(self._suffixes[r][0][m] for r in rules))
+            self._max_size = n
+
+    def _depth(self, q, d):
+        if d < 0:
+            return 0
+        counts = self._depths.get(q)
+        return counts[d] if counts is not None else 0
+
+    def _extend_depths(self, depth):
+        """Extend the depth tables to trees of depth up to the given depth."""
+        for d in range(self._max_depth + 1, depth + 1):
+            for q, rules in self.rules_to.items():
+                total = 0
+                for r in rules:
+                    product = 1
+                    for c in self.rules[r][0]:
+                        product *= self._depth(c, d - 1)
+                    total += product
+                self._depths[q].append(total)
+            self._max_depth = d
+
+    def _finals(self):
+        return [q for q in self.bdfa.finals if q in self.rules_to]
+
+    def count(self, size, max_size=None):
+        """Return the number of accepted trees with the given number of
+        nodes, or with between size and max_size nodes."""
+        if max_size is None:
+            max_size = size
+        self._extend_sizes(max_size)
+        return sum(self._size(q, n) for q in self._finals()
+                   for n in range(max(size, 1), max_size + 1))
+
+    def count_depth(self, depth, max_depth=None):
+        """Return the number of accepted trees of the given depth, or of
+        depth between depth and max_depth."""
+        if max_depth is None:
+            max_depth = depth
+        self._extend_depths(max_depth)
+        return sum(self._depth(q, max_depth) - self._depth(q, depth - 1)
+                   for q in self._finals())
+
+    #
+    # sampling
+    #
+
+    def _choose(self, weights):
+        """Return an index chosen with probability proportional to the given
+        (integer) weights."""
+        weights = list(weights)
+        r = self.rng.randrange(sum(weights))
+        for i, w in enumerate(weights):
+            if r < w:
+                return i
+            r -= w
+        raise AssertionError("weights changed during choice")
+
+    def _build(self, tasks, expand):
+        """Build a tree top-down from a root task. expand(task) returns the
+        symbol of the node and the tasks of its children."""
+        root = Tree(None)
+        stack = [(tasks, root)]
+        while stack:
+            task, node = stack.pop()
+            symbol, child_tasks = expand(task)
+            node.data = symbol
+            node.children = [Tree(None) for _ in child_tasks]
+            stack.extend(zip(reversed(child_tasks), reversed(node.children)))
+        return root
+
+    def _expand_size(self, task):
+        q, n = task
+        rules = self.rules_to[q]
+        m = n - 1
+        r = rules[self._choose(self._suffixes[r][0][m] for r in rules)]
+        statelist, symbol, _ = self.rules[r]
+        suffix = self._suffixes[r]
+        child_tasks = []
+        for j, c in enumerate(statelist):
+            a = self._split(self._sizes[c], suffix[j + 1], m, suffix[j][m])
+            child_tasks.append((c, a))
+            m -= a
+        return symbol, child_tasks
+
+    def _split(self, sizes, below, m, total):
+        """Return the size a of a child, chosen with probability proportional
+        to sizes[a] * below[m - a] among 1 <= a <= m, given the total of
+        these weights. Sizes are tried from both ends alternately, so that
+        lopsided splits, which are the most common, are found quickly and
+        sampling a tree costs O(n log n) choices on average."""
+        r = self.rng.randrange(total)
+        lo, hi = 1, m
+        while lo <= hi:
+            w = sizes[lo] * below[m - lo]
+            if r < w:
+                return lo
+            r -= w
+            if lo == hi:
+                break
+            w = sizes[hi] * below[m - hi]
+            if r < w:
+                return hi
+            r -= w
+            lo += 1
+            hi -= 1
+        raise AssertionError("inconsistent count tables")
+
+    def sample(self, size, max_size=None):
+        """Return an accepted tree drawn uniformly at random among those
+        with the given number of nodes, or with between size and max_size
+        nodes. Raise ValueError if there is none."""
+        if max_size is None:
+            max_size = size
+        if self.count(size, max_size) == 0:
+            raise ValueError(f"No accepted tree of size {size} to {max_size}.")
+        finals = self._finals()
+        sizes = range(max(size, 1), max_size + 1)
+        pairs = [(q, n) for q in finals for n in sizes]
+        root = pairs[self._choose(self._size(q, n) for q, n in pairs)]
+        return self._build(root, self._expand_size)
+
+    def _expand_depth(self, task):
+        q, d, exact = task
+        weights = []
+        for r in self.rules_to[q]:
+            statelist = self.rules[r][0]
+            if exact:
+                # choose the first child of depth exactly d - 1: the ones
+                # before it are shallower, the ones after it no deeper
+                for i in range(len(statelist)):
+                    w = self._depth(statelist[i], d - 1) - self._depth(statelist[i], d - 2)
+                    for j, c in enumerate(statelist):
+                        if j != i:
+                            w *= self._depth(c, d - 2 if j < i else d - 1)
+                    weights.append(((r, i), w))
+                if len(statelist) == 0 and d == 0:
+                    weights.append(((r, None), 1))
+            else:
+                w = 1
+                for c in statelist:
+                    w *= self._depth(c, d - 1)
+                weights.append(((r, None), w))
+        (r, i), _ = weights[self._choose(w for _, w in weights)]
+        statelist, symbol, _ = self.rules[r]
+        if i is None:
+            return symbol, [(c, d - 1, False) for c in statelist]
+        return symbol, [(c, d - 2, False) if j < i else
+                        (c, d - 1, j == i) for j, c in enumerate(statelist)]
+
+    def sample_depth(self, depth, max_depth=None):
+        """Return an accepted tree drawn uniformly at random among those of
+        the given depth, or of depth between depth and max_depth. Raise
+        ValueError if there is none."""
+        if max_depth is None:
+            max_depth = depth
+        if self.count_depth(depth, max_depth) == 0:
+            raise ValueError(f"No accepted tree of depth {depth} to {max_depth}.")
+        pairs = [(q, d) for q in self._finals() for d in range(max(depth, 0), max_depth + 1)]
+        q, d = pairs[self._choose(self._depth(q, d) - self._depth(q, d - 1)
+                                  for q, d in pairs)]
+        return self._build((q, d, True), self._expand_depth)
+
+    def sample_many(self, k, size, max_size=None):
+        """Return a list of k trees sampled independently as by sample."""
+        return [self.sample(size, max_size) for _ in range(k)]
+
+    #
+    # enumeration
+    #
+
+    def _trees(self, q, n):
+        for r in self.rules_to.get(q, []):
+            statelist, symbol, _ = self.rules[r]
+            if self._suffixes[r][0][n - 1] == 0:
+                continue
+            for children in self._sequences(r, 0, n - 1):
+                yield Tree(symbol, children)
+
+    def _sequences(self, r, j, m):
+        statelist = self.rules[r][0]
+        if j == len(statelist):
+            if m == 0:
+                yield []
+            return
+        below = self._suffixes[r][j + 1]
+        for a in range(1, m + 1):
+            if self._size(statelist[j], a) == 0 or below[m - a] == 0:
+                continue
+            for child in self._trees(statelist[j], a):
+                for rest in self._sequences(r, j + 1, m - a):
+                    yield [child] + rest
+
+    def enumerate_trees(self, size):
+        """Lazily yield every accepted tree with the given number of nodes."""
+        self._extend_sizes(size)
+        for q in sorted(self._finals(), key=str):
+            if self._size(q, size) > 0:
+                yield from self._trees(q, size)
+
+
+def test():
+    from itertools import islice
+    from grammars import gb_grammar, minimalist_grammar
+
+    for name, bdfa in [("gb_grammar", gb_grammar),
+                       ("minimalist_grammar", minimalist_grammar)]:
+        sampler = TreeSampler(bdfa, seed=637)
+        print(f"{name}: accepted trees by size "
+              f"{[sampler.count(n) for n in range(1, 13)]}")
+        print(f"  of size 9: {list(islice(sampler.enumerate_trees(9), 3))} ...")
+        print(f"  sample of size 20 to 30: {sampler.sample(20, 30)}")
+        print(f"  sample of depth 4: {sampler.sample_depth(4)}")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Transition schemas with category variables, matched on demand.
+
+A schema such as
+
+    RuleSchema(['q{z}', 'qXP'], "{z}'", 'q{z}bar', z="NAVPDIC")
+
+stands for one transition per value of z, without listing them. A
+RuleTable holds concrete transitions together with schemas, and is used in
+place of the transition dictionary of a TreeBDFA or TreeBDFT: a key that is
+not in the table is matched against the schemas the first time it is looked
+up and the result is memoized, so the table only ever holds the transitions
+that are actually used, whatever the number of categories.
+"""
+
+from itertools import product
+from string import Formatter
+
+from tree import Tree
+
+# token ending each string pattern of a schema, see RuleSchema._bindings
+_END = (False, None)
+
+
+def _parse_pattern(pattern):
+    """Return the list of tokens of a string pattern: pairs (False, text)
+    for literal text and (True, name) for variables."""
+    tokens = []
+    for literal, name, spec, conversion in Formatter().parse(pattern):
+        if literal:
+            tokens.append((False, literal))
+        if name is None:
+            continue
+        if spec or conversion or not name.isidentifier():
+            raise ValueError(f"Invalid variable {{{name}}} in pattern {pattern!r}")
+        tokens.append((True, name))
+    return tokens
+
+
+def _instantiate(value, bindings):
+    """Return a copy of a pattern, or of a tuple or Tree of patterns, with
+    its variables replaced by their values."""
+    if isinstance(value, str):
+        return value.format(**bindings) if '{' in value else value
+    if isinstance(value, tuple):
+        return tuple(_instantiate(v, bindings) for v in value)
+    if isinstance(value, Tree):
+        copies = {}
+        for node in value.postorder():
+            copies[id(node)] = Tree(_instantiate(node.data, bindings),
+                                    [copies[id(c)] for c in node.children])
+        return copies[id(value)]
+    return value
+
+
+def _template_variables(value):
+    """Return the set of variables occurring in a result pattern."""
+    if isinstance(value, tuple):
+        return set().union(*(_template_variables(v) for v in value))
+    if isinstance(value, Tree):
+        return set().union(*(_template_variables(node.data)
+                             for node in value.postorder()))
+    if isinstance(value, str):
+        return {name for is_variable, name in _parse_pattern(value) if is_variable}
+    return set()
+
+
+class RuleSchema:
+    """Transition schema with category variables.
+
+    The child states, the symbol and the result are patterns: strings in
+    which {name} stands for the value of the variable name, which ranges
+    over the given domain, or other values, which stand for
+    themselves. All occurrences of a variable in a schema take the same
+    value.
+
+    Parameters
+    ----------
+    children: list of child state patterns
+    symbol: symbol pattern
+    result: for a TreeBDFA, a state pattern; for a TreeBDFT, a pair of a
+      state pattern and a variably leafed tree whose labels are patterns
+    domains: keyword arguments giving the set of strings each variable
+      ranges over
+
+    Every variable of the result must occur in the children or symbol.
+    """
+
+    def __init__(self, children, symbol, result, **domains):
+        self.children = tuple(children)
+        self.symbol = symbol
+        self.result = result
+        # sets are used as they are, so that schemas can share a tagset
+        self.domains = {name: values if isinstance(values, (set, frozenset))
+                        else frozenset(values)
+                        for name, values in domains.items()}
+
+        # the tokens of all string patterns, each pattern ending with an
+        # _END token, matched as one sequence against the key's strings
+        self._tokens = []
+        self._strings = []
+        self._others = []
+        for i, pattern in enumerate((symbol,) + self.children):
+            if isinstance(pattern, str):
+                self._strings.append(i)
+                self._tokens.extend(_parse_pattern(pattern))
+                self._tokens.append(_END)
+            else:
+                self._others.append((i, pattern))
+        variables = {name for is_variable, name in self._tokens if is_variable}
+        self._literal_symbol = not _template_variables(symbol)
+        if variables != set(self.domains):
+            raise ValueError(f"Schema variables {sorted(variables)} do not match "
+                             f"domains {sorted(self.domains)}")
+        if not _template_variables(result) <= variables:
+            raise ValueError("Every variable of the result must occur in the "
+                             "children or symbol of a schema")
+
+    def match(self, key):
+        """Return the dictionary of variable values for which the schema
+        stands for a transition with the given key, of the form
+        (children_state_list, parent_symbol), or None if there is none."""
+        statelist, symbol = key
+        if len(statelist) != len(self.children):
+            return None
+        values = (symbol,) + tuple(statelist)
+        for i, pattern in self._others:
+            if values[i] != pattern:
+                return None
+        strings = [values[i] for i in self._strings]
+        if not all(isinstance(value, str) for value in strings):
+            return None
+        return next(self._bindings(0, strings, 0, 0, {}), None)
+
+    def _bindings(self, t, strings, c, pos, bindings):
+        """Yield every extension of bindings under which the tokens from t
+        on match the strings from position pos of string c on. A variable
+        is bound to each prefix of the rest of the string that belongs to
+        its domain in turn, so all ways of splitting a string between
+        adjacent variables are tried."""
+        if t == len(self._tokens):
+            yield dict(bindings)
+            return
+        s = strings[c]
+        token = self._tokens[t]
+        if token is _END:
+            if pos == len(s):
+                yield from self._bindings(t + 1, strings, c + 1, 0, bindings)
+            return
+        is_variable, text = token
+        if is_variable and text not in bindings:
+            domain = self.domains[text]
+            for end in range(pos + 1, len(s) + 1):
+                if s[pos:end] in domain:
+                    bindings[text] = s[pos:end]
+                    yield from self._bindings(t + 1, strings, c, end, bindings)
+                    del bindings[text]
+            return
+        if is_variable:
+            text = bindings[text]
+        if s.startswith(text, pos):
+            yield from self._bindings(t + 1, strings, c, pos + len(text), bindings)
+
+    def instantiate(self, bindings):
+        """Return the transition the schema stands for with the given
+        variable values, as a (key, result) pair."""
+        key = (tuple(_instantiate(q, bindings) for q in self.children),
+               _instantiate(self.symbol, bindings))
+        return key, _instantiate(self.result, bindings)
+
+    def instances(self):
+        """Iterate over all transitions the schema stands for, as (key,
+        result) pairs."""
+        names = list(self.domains)
+        for values in product(*(sorted(self.domains[name], key=str) for name in names)):
+            yield self.instantiate(dict(zip(names, values)))
+
+
+class SchemaIndex:
+    """Index of schemas by number of children and literal symbol, so that
+    a key is only matched against the schemas that may stand for it.
+    Schemas with a literal symbol take precedence over those with a symbol
+    pattern, and later schemas over earlier ones.
+
+    Parameters
+    ----------
+    schemas: sequence of RuleSchemas
+    """
+
+    def __init__(self, schemas):
+        self.schemas = list(schemas)
+        self._by_symbol = {}   # (arity, symbol) -> schemas, latest first
+        self._by_arity = {}    # arity -> schemas with a symbol pattern, latest first
+        for schema in reversed(self.schemas):
+            arity = len(schema.children)
+            if not schema._literal_symbol:
+                self._by_arity.setdefault(arity, []).append(schema)
+            else:
+                self._by_symbol.setdefault((arity, schema.symbol), []).append(schema)
+
+    def lookup(self, key):
+        """Return the result of the latest schema standing for a transition
+        with the given key. Raise KeyError if there is none."""
+        statelist, symbol = key
+        arity = len(statelist)
+        # schemas with a literal symbol are more specific, so they win
+        for candidates in (self._by_symbol.get((arity, symbol), ()),
+                           self._by_arity.get(arity, ())):
+            for schema in candidates:
+                bindings = schema.match(key)
+                if bindings is not None:
+                    return schema.instantiate(bindings)[1]
+        raise KeyError(key)
+
+
+class LazyTable(dict):
+    """Dictionary computing missing entries on first lookup.
+
+    Missing keys are passed to derive, which returns their value or raises
+    KeyError. Values are memoized; missing keys are not, so that the table
+    does not grow with every distinct key that is looked up in vain. Lookups
+    with [], get and in all see the derived entries, but iteration only
+    lists the entries computed so far.
+
+    Parameters
+    ----------
+    entries: dictionary of initial entries
+    derive: function from a missing key to its value
+    """
+
+    def __init__(self, entries, derive):
+        super().__init__(entries)
+        self._derive = derive
+
+    def __missing__(self, key):
+        value = self._derive(key)
+        self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+
+class RuleTable(LazyTable):
+    """Transition dictionary of concrete transitions and schemas, for a
+    TreeBDFA or TreeBDFT. Concrete transitions take precedence over
+    schemas.
+
+    Lookups only match the schemas against the keys actually looked up.
+    Iterating over the table, or taking its length, first expands every
+    schema over its domains, so that the methods of automata that go
+    through all their transitions, such as TreeBDFA.minimize or compile,
+    see the whole table. Once expanded, the table is a plain dictionary.
+    Truth tests do not expand the table: it is true if it has concrete
+    transitions or a schema whose domains are all non-empty.
+
+    Parameters
+    ----------
+    transitions: dictionary of concrete transitions, keyed by
+      (children_state_list, parent_symbol)
+    schemas: sequence of RuleSchemas
+    """
+
+    def __init__(self, transitions, schemas):
+        self.index = SchemaIndex(schemas)
+        self.concrete = dict(transitions)
+        self.expanded = False
+        super().__init__(self.concrete, self.index.lookup)
+
+    def materialize(self):
+        """Return a dictionary of all transitions of the table."""
+        transitions = {}
+        # in increasing order of precedence, as in SchemaIndex.lookup
+        for schema in self.index.schemas:
+            if not schema._literal_symbol:
+                transitions.update(schema.instances())
+        for schema in self.index.schemas:
+            if schema._literal_symbol:
+                transitions.update(schema.instances())
+        transitions.update(self.concrete)
+        return transitions
+
+    def expand(self):
+        """Add every transition the schemas stand for to the table."""
+        if not self.expanded:
+            self.update(self.materialize())
+            self.expanded = True
+
+    def __missing__(self, key):
+        if self.expanded:
+            raise KeyError(key)
+        return super().__missing__(key)
+
+    def __iter__(self):
+        self.expand()
+        return super().__iter__()
+
+    def __len__(self):
+        self.expand()
+        return super().__len__()
+
+    def __bool__(self):
+        return (super().__len__() > 0
+                or any(all(schema.domains.values()) for schema in self.index.schemas))
+
+    def keys(self):
+        self.expand()
+        return super().keys()
+
+    def values(self):
+        self.expand()
+        return super().values()
+
+    def items(self):
+        self.expand()
+        return super().items()
+
+
+def materialize(automaton):
+    """Return a copy of a TreeBDFA or TreeBDFT whose transition table is a
+    RuleTable, with a plain dictionary of all its transitions, and their
+    states and symbols added to the states and alphabet."""
+    transitions = automaton.transitions.materialize()
+    states = set(automaton.states)
+    alphabet = set(automaton.alphabet if hasattr(automaton, 'alphabet')
+                   else automaton.alph)
+    for (statelist, symbol), result in transitions.items():
+        states.update(statelist)
+        states.add(result[0] if isinstance(result, tuple) else result)
+        alphabet.add(symbol)
+    return type(automaton)(states, alphabet, automaton.finals, transitions)
+
+
+def test():
+    import random
+    import time
+    from treebdfa import TreeBDFA
+    from bench import random_gb_tree
+
+    rng = random.Random(637)
+    for n in [7, 70, 700, 7000]:
+        categories = frozenset(f"C{i}" for i in range(n))
+        start = time.perf_counter()
+        table = RuleTable({}, [
+            RuleSchema([], '{z}', 'q{z}', z=categories),
+            RuleSchema(['q{z}'], "{z}'", 'q{z}bar', z=categories),
+            RuleSchema(['q{z}', 'qXP'], "{z}'", 'q{z}bar', z=categories),
+            RuleSchema(['q{z}bar'], '{z}P', 'qXP', z=categories),
+            RuleSchema(['qXP', 'q{z}bar'], '{z}P', 'qXP', z=categories)])
+        grammar = TreeBDFA(['qXP'], [], ['qXP'], table)
+        built = time.perf_counter() - start
+        trees = [Tree.from_list(random_gb_tree(rng, 4, [f"C{i}" for i in range(7)]))
+                 for _ in range(200)]
+        start = time.perf_counter()
+        accepted = sum(grammar.recognizes(t) for t in trees)
+        # dict.__len__ counts the memoized entries without expanding the table
+        print(f"{n:5} categories: built in {built * 1000:.2f}ms, "
+              f"{accepted}/200 accepted in {time.perf_counter() - start:.3f}s, "
+              f"{dict.__len__(table)} of {5 * n} transitions used")
+
+
+if __name__ == "__main__":
+    test()
@@ -6,13 +6,40 @@ Unit tests for Tree, TreeBDFA, TreeBDFT, GB and Minimalist grammars,
 GB to Minimalist transducer.
 """
 
+import copy
+import io
+import itertools
+import json
+import math
+import os
+import pickle
+import tempfile
 import unittest
+import weakref
+from array import array
 
-from tree import Tree
+from tree import Tree, TreePool, SharedTree, sn
 from treebdfa import TreeBDFA
-from grammars import gb_grammar, minimalist_grammar
+from treebdft import TreeBDFT
+from treearena import TreeArena
+from grammars import gb_grammar, minimalist_grammar, ss_grammar
+from grammars import gb_grammar_schematic, minimalist_grammar_schematic
 from transducer_v1 import gb_to_min as gb_to_min_v1
-from transducer_v2 import gb_to_min as gb_to_min_v2
+from transducer_v2 import gb_to_min as gb_to_min_v2, gb_to_min_schematic
+from treeio import read_trees, write_trees, parse_trees, tree_events
+from corpus import run_corpus
+from sampling import TreeSampler
+from product import ProductBDFA, intersection, union
+from compose import compose
+from incremental import TreeRun
+from gorn import GornIndex
+from treebin import write_binary, BinaryCorpus
+from tracing import StatsTracer
+from schema import RuleSchema, RuleTable, materialize
+from treebnfa import TreeBNFA
+from weighted import WeightedTreeBDFA, probability_semiring, log_semiring
+from weighted import tropical_semiring, counting_semiring
+import bench
 import test_trees as tts
 
 class TreeTest(unittest.TestCase):
@@ -36,6 +63,325 @@ class TreeTest(unittest.TestCase):
         self.assertEqual(t.get_gorn([0, 1]), st2)
         self.assertEqual(t.get_gorn([0, 1, 1]), st3)
         self.assertIsNone(t.get_gorn([0, 1, 1, 0]))
+        addr = [0, 1]
+        self.assertEqual(t.get_gorn(addr), st2)
+        self.assertEqual(addr, [0, 1])
+
+    def test_hash(self):
+        t1 = Tree.from_list(["a", ["b", "d", "e"], "c"])
+        t2 = Tree.from_list(["a", ["b", "d", "e"], "c"])
+        t3 = Tree.from_list(["a", ["b", "d", "f"], "c"])
+        self.assertEqual(hash(t1), hash(t2))
+        self.assertNotEqual(hash(t1), hash(t3))
+        self.assertEqual(len({t1, t2, t3}), 2)
+        self.assertEqual({t1: 1}[t2], 1)
+        self.assertNotEqual(t1, t3)
+        self.assertNotEqual(t1, None)
+        # the hash follows modifications through add_subtree
+        t3.get_gorn([0, 1]).add_subtree(Tree("g"))
+        t2.get_gorn([0, 1]).add_subtree(Tree("g"))
+        self.assertNotEqual(hash(t1), hash(t2))
+        self.assertNotEqual(hash(t2), hash(t3))
+        t3.get_gorn([0, 1]).data = "e"
+        self.assertEqual(Tree.from_list(bench.to_list(t3)), t2)
+        # direct modifications leave the cached hashes stale
+        self.assertNotEqual(t3, t2)
+        t3.get_gorn([0, 1])._invalidate()
+        self.assertEqual(t3, t2)
+
+    def test_gorn_index(self):
+        T = Tree
+        t = T("a", [T("b", [T("d"), T("e", [T("f"), T("g")])]), T("c")])
+        index = GornIndex(t)
+        addrs = [(), (0,), (0, 0), (0, 1), (0, 1, 0), (0, 1, 1), (1,)]
+        self.assertEqual(index.ranks(addrs), list(range(7)))
+        self.assertEqual([index.address(r) for r in range(7)], addrs)
+        self.assertEqual(index.nodes_at([[0, 1], [2], (0, 1, 1, 0)]),
+                         [t.get_gorn([0, 1]), None, None])
+        self.assertEqual(index.address_of(t.get_gorn([0, 1, 1])), (0, 1, 1))
+        self.assertEqual(index.subtree_range([0]), (1, 6))
+        self.assertEqual(list(index.parent), [-1, 0, 1, 1, 3, 3, 0])
+        self.assertTrue(index.is_ancestor((0,), (0, 1, 1)))
+        self.assertFalse(index.is_ancestor((0, 1, 1), (0,)))
+        self.assertEqual(index.lca((0, 1, 0), (0, 0)), (0,))
+        self.assertEqual(index.lca((0, 1, 0), (0, 1, 1)), (0, 1))
+        self.assertEqual(index.lca((0, 1), (0, 1, 1)), (0, 1))
+        self.assertEqual(index.lca((1,), (0, 1, 1)), ())
+        pairs = [(a, b) for a in range(7) for b in range(7)]
+        self.assertEqual(index.lca_ranks([a for a, b in pairs], [b for a, b in pairs]).tolist(),
+                         [index.lca_rank(a, b) for a, b in pairs])
+        self.assertRaises(ValueError, index.lca, (2,), ())
+        deep = GornIndex(sn(5000))
+        self.assertEqual(deep.lca((1,) * 3000 + (0,), (1,) * 4000), (1,) * 3000)
+
+    def test_cached_stats(self):
+        leaf = Tree('c')
+        inner = Tree('b', [leaf])
+        t = Tree('a', [inner, Tree('x', [inner])])
+        self.assertEqual((t.size(), t.depth(), t.width(), t.yld()), (6, 3, 2, "cc"))
+        leaf.add_subtree(Tree('d'))
+        leaf.add_subtree(Tree('e'))
+        self.assertEqual((t.size(), t.depth(), t.width(), t.yld()), (10, 4, 2, "dede"))
+        self.assertEqual((inner.size(), inner.yld()), (4, "de"))
+        t.add_subtree(Tree('f'))
+        self.assertEqual((t.size(), t.width(), t.yld()), (11, 3, "dedef"))
+        # statistics cost no per-node objects other than a parent reference
+        self.assertFalse(hasattr(leaf, '__dict__'))
+        self.assertIsInstance(leaf._parent, weakref.ref)
+        self.assertEqual(len(inner._parent), 2)
+
+    def test_pickle_copy(self):
+        t = Tree.from_list(['S', ['A', 'a'], 'b'])
+        t.children.append(t.children[0])
+        self.assertEqual(t.size(), 6)
+        original_hash = hash(t)
+        for c in [pickle.loads(pickle.dumps(t)), copy.deepcopy(t)]:
+            self.assertEqual(c, t)
+            self.assertIs(c.children[0], c.children[2])
+            self.assertIsNone(c._parent)
+            c.children[0].add_subtree(Tree('x'))
+            self.assertEqual(c.size(), 8)
+            self.assertEqual(c.yld(), "axbax")
+            self.assertNotEqual(hash(c), original_hash)
+            self.assertEqual((t.size(), hash(t)), (6, original_hash))
+        shallow = copy.copy(t)
+        shallow.add_subtree(Tree('c'))
+        self.assertEqual((shallow.size(), t.size()), (7, 6))
+        self.assertEqual(copy.deepcopy(sn(5000)), sn(5000))
+
+    def test_deep(self):
+        t = sn(20000)
+        self.assertEqual(t.size(), 60000)
+        self.assertEqual(t.depth(), 20000)
+        self.assertEqual(t.width(), 3)
+        self.assertEqual(t.yld(), "a" * 20000 + "b" * 20000)
+        self.assertEqual(t, sn(20000))
+        nodes = bench.to_list(t)
+        self.assertEqual(Tree.from_list(nodes), t)
+        # the lists are not consumed
+        self.assertEqual(Tree.from_list(nodes), t)
+
+
+class TreePoolTest(unittest.TestCase):
+
+    def test_sharing(self):
+        pool = TreePool()
+        t = pool.intern(tts.gb_simple_trans_clause)
+        self.assertIsInstance(t, SharedTree)
+        self.assertEqual(t, tts.gb_simple_trans_clause)
+        # both NP[DP[D'[D]], N'[N]] subtrees become the same object
+        self.assertIs(t.children[0], t.get_gorn([1, 1, 0, 1]))
+        self.assertIs(pool.intern(tts.gb_simple_trans_clause), t)
+        self.assertIs(pool.make("NP", [Tree("DP", [Tree("D'", [Tree("D")])]),
+                                       Tree("N'", [Tree("N")])]),
+                      t.children[0])
+        self.assertEqual(len(t.dag_postorder()), 12)
+        self.assertRaises(TypeError, t.add_subtree, Tree('a'))
+
+    def test_automata(self):
+        pool = TreePool()
+        memo_a = {}
+        memo_t = {}
+        for t in [tts.gb_np_n, tts.gb_simple_trans_clause, tts.gb_pp_comp_cp_comp,
+                  tts.min_pp_comp_cp_comp]:
+            shared = pool.intern(t)
+            self.assertEqual(gb_grammar.recognizes(shared), gb_grammar.recognizes(t))
+            self.assertEqual(gb_grammar.recognizes(shared, memo=memo_a),
+                             gb_grammar.recognizes(t))
+            self.assertEqual(gb_to_min_v2.transform(shared), gb_to_min_v2.transform(t))
+            self.assertEqual(gb_to_min_v2.transform(shared, memo=memo_t),
+                             gb_to_min_v2.transform(t))
+
+
+class TreeArenaTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for t in [Tree('a'), sn(5), tts.gb_pp_comp_cp_comp,
+                  Tree.from_list(['a', ['b', ['c', 'd'], ['e', 'f', 'g', 'h', 'i']]])]:
+            arena = TreeArena.from_tree(t)
+            self.assertEqual(len(arena), t.size())
+            self.assertEqual(arena.to_tree(), t)
+
+    def test_offsets(self):
+        arena = TreeArena.from_tree(Tree.from_list(['a', ['b', 'c', 'd'], 'e']))
+        self.assertEqual(arena.arity.tolist(), [2, 2, 0, 0, 0])
+        self.assertEqual(arena.parent.tolist(), [-1, 0, 1, 1, 0])
+        self.assertEqual(arena.first_child.tolist(), [1, 2, -1, -1, -1])
+        self.assertEqual(arena.children(0), [1, 4])
+        self.assertEqual(arena.label(4), 'e')
+
+    def test_automata(self):
+        for t in [tts.gb_np_n, tts.gb_simple_trans_clause, tts.gb_pp_comp_cp_comp,
+                  tts.min_dp_d_n]:
+            arena = TreeArena.from_tree(t)
+            self.assertEqual(gb_grammar.recognizes(arena), gb_grammar.recognizes(t))
+            self.assertEqual(gb_to_min_v2.transform(arena), gb_to_min_v2.transform(t))
+
+
+class TreeIOTest(unittest.TestCase):
+
+    trees = [tts.gb_pp_comp_cp_comp, tts.min_xp_w_spec_no_comp, Tree('a'), sn(4)]
+
+    def test_round_trip(self):
+        for fmt in ['bracket', 'penn']:
+            sink = io.StringIO()
+            self.assertEqual(write_trees(self.trees, sink, fmt), len(self.trees))
+            for chunk_size in [1, 5, 1 << 16]:
+                source = io.StringIO(sink.getvalue())
+                self.assertEqual(list(read_trees(source, chunk_size=chunk_size)),
+                                 self.trees)
+
+    def test_formats(self):
+        sink = io.StringIO()
+        write_trees(self.trees, sink)
+        self.assertEqual(sink.getvalue().splitlines(), [str(t) for t in self.trees])
+        self.assertEqual(parse_trees("( (S (NP a) (VP (b) c)))", 'penn'),
+                         [Tree.from_list(['S', ['NP', 'a'], ['VP', 'b', 'c']])])
+        self.assertEqual(parse_trees("a S[a, b]\nS[a,S[a,b],b]"), [Tree('a'), sn(1), sn(2)])
+        self.assertRaises(ValueError, parse_trees, "S[a, b")
+
+    def test_missing_trees(self):
+        trees = [None, Tree('a'), None, sn(1), None]
+        for fmt in ['bracket', 'penn']:
+            sink = io.StringIO()
+            write_trees(trees, sink, fmt)
+            self.assertEqual(sink.getvalue().splitlines()[0],
+                             "[]" if fmt == 'bracket' else "()")
+            for chunk_size in [1, 2, 1 << 16]:
+                source = io.StringIO(sink.getvalue())
+                self.assertEqual(list(read_trees(source, chunk_size=chunk_size)), trees)
+        self.assertRaises(ValueError, parse_trees, "S[a, []]")
+        self.assertRaises(ValueError, parse_trees, "(S () a)")
+
+    def test_pipeline(self):
+        source = io.StringIO("NP[N'[N]]\nDP[D, NP]\n" + str(tts.gb_simple_trans_clause))
+        self.assertEqual([gb_grammar.recognizes(t) for t in read_trees(source)],
+                         [True, False, True])
+
+
+class BinaryCorpusTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        # labels and arities of 128 and more take several bytes
+        wide = Tree('S', [Tree(f"w{i}") for i in range(300)])
+        trees = TreeIOTest.trees + [wide, TreeArena.from_tree(tts.gb_np_n)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'corpus.bin')
+            self.assertEqual(write_binary(trees, path), len(trees))
+            with BinaryCorpus(path) as corpus:
+                self.assertEqual(len(corpus), len(trees))
+                self.assertEqual(corpus.tree(4), wide)
+                self.assertEqual(corpus.tree(-1), tts.gb_np_n)
+                self.assertEqual(list(corpus.trees())[:4], TreeIOTest.trees)
+                arena = corpus[0]
+                self.assertEqual(arena.end.tolist(),
+                                 TreeArena.from_tree(tts.gb_pp_comp_cp_comp).end.tolist())
+                self.assertEqual([gb_grammar.recognizes(a) for a in corpus],
+                                 [gb_grammar.recognizes(TreeArena.from_tree(t))
+                                  if isinstance(t, Tree) else True for t in trees])
+                self.assertRaises(IndexError, corpus.__getitem__, len(trees))
+                # the labels of the corpus are translated once, not per arena
+                compiled = gb_grammar.compile()
+                self.assertEqual([compiled.recognizes(a) for a in corpus],
+                                 [gb_grammar.recognizes(a) for a in corpus])
+                self.assertIs(compiled._arena_symbols[0], corpus.symbols)
+                self.assertEqual(compiled.recognizes_many(list(corpus)).tolist(),
+                                 [gb_grammar.recognizes(a) for a in corpus])
+                # one-byte blocks are views of the map, which outlive close
+                self.assertIsInstance(arena.labels, memoryview)
+                self.assertIsInstance(corpus[4].arity, array)
+            self.assertEqual(arena.to_tree(), tts.gb_pp_comp_cp_comp)
+            del arena
+            with open(path, 'w') as f:
+                f.write("S[a, b]")
+            self.assertRaises(ValueError, BinaryCorpus, path)
+
+
+class CorpusTest(unittest.TestCase):
+
+    def test_run_corpus(self):
+        trees = [tts.gb_np_n, tts.min_dp_d_n, tts.gb_simple_trans_clause] * 5
+        text = ''.join(f"{t}\n" for t in trees)
+        for workers in [0, 2]:
+            sink = io.StringIO()
+            stats = run_corpus('recognize', 'grammars:gb_grammar', io.StringIO(text),
+                               sink, workers=workers, chunk_size=4)
+            self.assertEqual(stats['trees'], len(trees))
+            self.assertEqual(sink.getvalue().split(),
+                             [str(gb_grammar.recognizes(t)) for t in trees])
+            sink = io.StringIO()
+            run_corpus('transform', 'transducer_v2:gb_to_min', io.StringIO(text),
+                       sink, workers=workers, chunk_size=4)
+            self.assertEqual(list(read_trees(io.StringIO(sink.getvalue()))),
+                             [gb_to_min_v2.transform(t) for t in trees])
+            # the output, with [] for rejected trees, can be fed back in
+            source = io.StringIO(sink.getvalue())
+            sink = io.StringIO()
+            run_corpus('recognize', 'grammars:minimalist_grammar', source, sink,
+                       workers=workers, chunk_size=4)
+            self.assertEqual(sink.getvalue().split(), ['True', 'False', 'True'] * 5)
+            sink = io.StringIO()
+            run_corpus('transform', 'transducer_v2:gb_to_min',
+                       io.StringIO("NP[N'[N]]\n[]\nDP[D, NP]\n"), sink, workers=workers)
+            self.assertEqual(sink.getvalue().splitlines(),
+                             [str(gb_to_min_v2.transform(tts.gb_np_n)), "[]", "[]"])
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_workloads(self):
+        loads = bench.workloads(1)
+        self.assertTrue(all(gb_grammar.recognizes(t) for t in loads['random_gb']))
+        self.assertTrue(all(minimalist_grammar.recognizes(t)
+                            for t in loads['random_min']))
+        self.assertEqual(Tree.from_list(bench.to_list(loads['sn_ladder'][0])),
+                         loads['sn_ladder'][0])
+
+    def test_run(self):
+        run = bench.run_benchmarks(scale=1, repeat=1, select='transform', out=None)
+        self.assertEqual([r['benchmark'] for r in run['results']],
+                         ['transducer_v1.transform', 'transducer_v2.transform'])
+        self.assertTrue(all(r['nodes_per_second'] > 0 for r in run['results']))
+        # runs too fast to time have no rate, shown as "-"
+        untimed = dict(run, results=[dict(r, seconds=0.0, nodes_per_second=None)
+                                     for r in run['results']])
+        for before, after in [(run, untimed), (untimed, run), (untimed, untimed)]:
+            rows = bench.table(after, before).rows
+            self.assertEqual(len(rows), 2)
+            self.assertTrue(all(row[-1] == "-" for row in rows))
+
+
+class TreeSamplerTest(unittest.TestCase):
+
+    def test_counts(self):
+        sampler = TreeSampler(gb_grammar)
+        self.assertEqual([sampler.count(n) for n in range(1, 10)],
+                         [0, 0, 7, 0, 0, 98, 0, 0, 1715])
+        self.assertEqual(sampler.count(1, 9), 1820)
+        for n in (3, 6):
+            trees = list(sampler.enumerate_trees(n))
+            self.assertEqual(len(trees), sampler.count(n))
+            self.assertEqual(len(set(map(str, trees))), len(trees))
+            self.assertTrue(all(gb_grammar.recognizes(t) and t.size() == n
+                                for t in trees))
+        self.assertEqual(sampler.count_depth(2), 7)
+        self.assertEqual(sum(sampler.count_depth(d) for d in range(4)),
+                         sampler.count_depth(0, 3))
+
+    def test_sample(self):
+        for bdfa in (gb_grammar, minimalist_grammar):
+            sampler = TreeSampler(bdfa, seed=637)
+            for t in sampler.sample_many(50, 30, 60):
+                self.assertTrue(bdfa.recognizes(t))
+                self.assertTrue(30 <= t.size() <= 60)
+            for _ in range(20):
+                t = sampler.sample_depth(3, 4)
+                self.assertTrue(bdfa.recognizes(t))
+                self.assertIn(t.depth(), (3, 4))
+        # all 7 trees of size 3 should turn up
+        sampler = TreeSampler(gb_grammar, seed=637)
+        self.assertEqual(len({str(sampler.sample(3)) for _ in range(200)}), 7)
+        self.assertRaises(ValueError, sampler.sample, 4)
 
 
 class TreeBDFATest(unittest.TestCase):
@@ -67,6 +413,408 @@ class TreeBDFATest(unittest.TestCase):
         self.assertTrue(anbn.recognizes(t2))
         self.assertTrue(anbn.recognizes(t3))
         self.assertFalse(anbn.recognizes(t3x))
+        self.assertTrue(anbn.recognizes(sn(20000)))
+
+    def test_find_failure(self):
+        anbn = TreeBDFA(['qa', 'qb', 'qS'], ['a', 'b', 'S'], ['qS'],
+                        [([], 'a', 'qa'), ([], 'b', 'qb'),
+                         (['qa', 'qb'], 'S', 'qS'), (['qa', 'qS', 'qb'], 'S', 'qS')])
+        stuck = Tree('S', [Tree('a'), Tree('S', [Tree('a'), Tree('c')]), Tree('b')])
+        cases = [(sn(3), None),
+                 (stuck, ((1, 1), 'c', (), None)),
+                 (Tree('S', [Tree('a'), Tree('S', [Tree('b'), Tree('b')]), Tree('b')]),
+                  ((1,), 'S', ('qb', 'qb'), None)),
+                 (Tree('a'), ((), 'a', (), 'qa'))]
+        for tree, failure in cases:
+            self.assertEqual(anbn.find_failure(tree), failure)
+            self.assertEqual(anbn.find_failure(TreeArena.from_tree(tree)), failure)
+            self.assertEqual(anbn.recognizes(tree), failure is None)
+
+    def test_minimize(self):
+        # qa2 duplicates qa, qU is unreachable and qX useless
+        qs = ['qa', 'qa2', 'qb', 'qS', 'qX', 'qU']
+        xs = ['a', 'c', 'b', 'S', 'X']
+        fs = ['qS']
+        ts = [([], 'a', 'qa'),
+              ([], 'c', 'qa2'),
+              ([], 'b', 'qb'),
+              ([], 'X', 'qX'),
+              (['qa', 'qb'], 'S', 'qS'),
+              (['qa2', 'qb'], 'S', 'qS'),
+              (['qa', 'qS', 'qb'], 'S', 'qS'),
+              (['qa2', 'qS', 'qb'], 'S', 'qS'),
+              (['qU'], 'X', 'qS')]
+        bdfa = TreeBDFA(qs, xs, fs, ts)
+        minimal, report = bdfa.minimize()
+        self.assertEqual(minimal.states, {'qa', 'qb', 'qS'})
+        self.assertEqual(len(minimal.transitions), 5)
+        self.assertEqual((report['unreachable'], report['useless'], report['merged']),
+                         (1, 1, 1))
+        for t in [Tree.from_list(['S', 'c', ['S', 'a', 'b'], 'b']),
+                  Tree.from_list(['S', 'c', 'b', 'b']), Tree('X'), sn(5)]:
+            self.assertEqual(minimal.recognizes(t), bdfa.recognizes(t))
+        self.assertTrue(minimal.equivalent(bdfa))
+        for grammar in [ss_grammar, gb_grammar, minimalist_grammar]:
+            minimal, report = grammar.minimize()
+            self.assertEqual(minimal.transitions, grammar.transitions)
+
+    def test_decisions(self):
+        self.assertEqual(str(gb_grammar.witness()), "NP[N'[N]]")
+        self.assertFalse(gb_grammar.is_empty())
+        self.assertTrue(intersection(gb_grammar, minimalist_grammar).is_empty())
+        either = union(gb_grammar, ss_grammar)
+        self.assertTrue(gb_grammar.is_subset(either))
+        self.assertTrue(either.includes(ss_grammar))
+        self.assertFalse(either.is_subset(gb_grammar))
+        self.assertEqual(str(either.counterexample(gb_grammar)), "VP[V]")
+        self.assertTrue(either.equivalent(union(ss_grammar, gb_grammar)))
+        # the transducers disagree on bare nouns
+        domain_v1 = gb_to_min_v1.domain()
+        domain_v2 = gb_to_min_v2.domain()
+        t = domain_v1.counterexample(domain_v2)
+        self.assertEqual(str(t), "NP[N]")
+        self.assertIsNone(gb_to_min_v1.transform(t))
+        self.assertIsNotNone(gb_to_min_v2.transform(t))
+
+
+class TreeRunTest(unittest.TestCase):
+
+    def test_bdfa(self):
+        tree = Tree.from_list(bench.to_list(tts.gb_pp_comp_cp_comp))
+        run = TreeRun(gb_grammar, tree)
+        self.assertTrue(run.accepted())
+        self.assertEqual(run.state_at([1]), 'qIbar')
+        old = run.tree
+        self.assertEqual(run.relabel([1], "VP"), None)
+        self.assertFalse(run.accepted())
+        self.assertTrue(gb_grammar.recognizes(old))
+        self.assertIs(run.tree.children[0], old.children[0])
+        run.relabel([1], "I'")
+        self.assertTrue(run.accepted())
+        run.replace([1, 1], Tree.from_list(['VP', ["V'", 'V']]))
+        self.assertTrue(run.accepted())
+        self.assertEqual(str(run.tree),
+                         "IP[NP[DP[D'[D]], N'[N, PP[P'[P, NP[N'[N]]]]]], I'[I, VP[V'[V]]]]")
+        self.assertRaises(ValueError, run.relabel, [5], 'X')
+        # the recorded states always match a full run
+        for addr, label in [([0, 1, 0], 'V'), ([0, 1, 0], 'N'), ([0], 'NP')]:
+            run.relabel(addr, label)
+            self.assertEqual(run.state(), gb_grammar._process(run.tree))
+
+    def test_bdft(self):
+        run = TreeRun(gb_to_min_v2, tts.gb_np_n)
+        self.assertEqual(run.output(), tts.min_dp_d_n)
+        run.replace([0], tts.gb_np_d_n.children[1])
+        self.assertEqual(run.output(), tts.min_dp_d_n)
+        run.relabel([0, 0], 'D')
+        self.assertIsNone(run.output())
+
+
+class ProductBDFATest(unittest.TestCase):
+
+    grammars = [ss_grammar, gb_grammar, minimalist_grammar]
+    trees = [tts.gb_np_n, tts.gb_simple_trans_clause, tts.min_dp_d_n,
+             tts.min_xp_w_spec_no_comp, sn(3),
+             Tree.from_list(['S', ['NP', 'Det', 'N'], ['VP', 'V']])]
+
+    def test_verdicts(self):
+        grammars = ProductBDFA(self.grammars)
+        for t in self.trees:
+            verdicts = tuple(g.recognizes(t) for g in self.grammars)
+            self.assertEqual(grammars.verdicts(t), verdicts)
+            self.assertEqual(grammars.verdicts(TreeArena.from_tree(t)), verdicts)
+
+    def test_intersection_union(self):
+        both = intersection(gb_grammar, minimalist_grammar)
+        either = union(*self.grammars)
+        self.assertEqual(TreeSampler(both).count(1, 20), 0)
+        for t in self.trees + TreeSampler(either, seed=637).sample_many(50, 1, 30):
+            self.assertFalse(both.recognizes(t))
+            self.assertEqual(either.recognizes(t),
+                             any(g.recognizes(t) for g in self.grammars))
+
+
+class StatsTracerTest(unittest.TestCase):
+
+    def test_stats(self):
+        tracer = StatsTracer()
+        t = tts.gb_np_d_n
+        bad = Tree('NP', [Tree('D')])
+        for tree in [t, TreeArena.from_tree(t), bad]:
+            self.assertEqual(gb_grammar.recognizes(tree, tracer=tracer),
+                             gb_grammar.recognizes(tree))
+        self.assertEqual(gb_to_min_v2.transform(t, memo={}, tracer=tracer),
+                         gb_to_min_v2.transform(t))
+        n = len(list(t.postorder()))
+        self.assertEqual(tracer.nodes, {n: 3, 2: 1})
+        self.assertEqual(tracer.transitions[((), 'D')], 4)
+        self.assertEqual(tracer.misses, {(('qD',), 'NP'): 1})
+        self.assertEqual(tracer.phases['recognize'][0], 3)
+        self.assertEqual(tracer.phases['transform'][0], 1)
+        self.assertIn(((), 'V'), tracer.dead_rules(gb_grammar))
+        stats = json.loads(tracer.to_json())
+        self.assertEqual(stats['misses'],
+                         [{'children': ['qD'], 'symbol': 'NP', 'count': 1}])
+
+
+class RuleSchemaTest(unittest.TestCase):
+
+    def test_schematic_grammars(self):
+        workloads = bench.workloads(2)
+        trees = workloads['random_gb'] + workloads['random_min']
+        for grammar, schematic in [(gb_grammar, gb_grammar_schematic),
+                                   (minimalist_grammar, minimalist_grammar_schematic),
+                                   (gb_to_min_v2, gb_to_min_schematic)]:
+            concrete = materialize(schematic)
+            self.assertEqual(concrete.transitions, grammar.transitions)
+            self.assertEqual(set(concrete.states), set(grammar.states))
+            if isinstance(grammar, TreeBDFA):
+                self.assertEqual(schematic.states, grammar.states)
+                self.assertEqual(schematic.alphabet, grammar.alphabet)
+            for t in trees:
+                if isinstance(grammar, TreeBDFT):
+                    self.assertEqual(schematic.transform(t), grammar.transform(t))
+                else:
+                    self.assertEqual(schematic.recognizes(t), grammar.recognizes(t))
+
+    def test_schematic_whole_table(self):
+        # methods going through all transitions expand the schemas, whatever
+        # has been looked up before
+        workloads = bench.workloads(2)
+        trees = workloads['random_gb'] + workloads['random_min']
+        for grammar, schematic in [(gb_grammar, gb_grammar_schematic),
+                                   (minimalist_grammar, minimalist_grammar_schematic)]:
+            table = schematic.transitions
+            fresh = lambda: TreeBDFA(schematic.states, schematic.alphabet,
+                                     schematic.finals,
+                                     RuleTable(table.concrete, table.index.schemas))
+            self.assertEqual(fresh().recognizes_many(trees).tolist(),
+                             grammar.recognizes_many(trees).tolist())
+            self.assertTrue(fresh().is_valid())
+            self.assertFalse(fresh().is_empty())
+            self.assertEqual(fresh().minimize()[1], grammar.minimize()[1])
+            self.assertTrue(fresh().equivalent(grammar))
+            self.assertEqual([TreeSampler(fresh()).count(n) for n in range(1, 8)],
+                             [TreeSampler(grammar).count(n) for n in range(1, 8)])
+        transducer = TreeBDFT(gb_to_min_schematic.states, gb_to_min_schematic.alph,
+                              gb_to_min_schematic.finals,
+                              RuleTable(gb_to_min_schematic.transitions.concrete,
+                                        gb_to_min_schematic.transitions.index.schemas))
+        self.assertTrue(transducer.domain().equivalent(gb_to_min_v2.domain()))
+
+    def test_rule_table(self):
+        tags = frozenset(f"T{i}" for i in range(10000))
+        table = RuleTable({((), 'T3'): 'q3'}, [
+            RuleSchema([], '{z}', 'q{z}', z=tags),
+            RuleSchema(['q{x}', 'q{y}'], '{x}{y}', 'q{x}{y}', x=tags, y="ab"),
+            RuleSchema(['q{x}', 'q{x}'], 'Same', 'qSame', x=tags)])
+        self.assertEqual(table[((), 'T42')], 'qT42')
+        self.assertEqual(table[((), 'T3')], 'q3')
+        self.assertEqual(table.get(((), 'X')), None)
+        self.assertNotIn(((), 'T10000'), table)
+        self.assertEqual(table.get((('qT1', 'qa'), 'T1a')), 'qT1a')
+        self.assertEqual(table.get((('qT1', 'qc'), 'T1c')), None)
+        self.assertEqual(table.get((('qT1', 'qT1'), 'Same')), 'qSame')
+        self.assertEqual(table.get((('qT1', 'qT2'), 'Same')), None)
+        # adjacent variables are split in every way allowed by their domains
+        split = RuleSchema([], '{x}{y}', 'q', x={'A', 'AB'}, y={'C', 'BC', 'D'})
+        self.assertEqual(split.match(((), 'ABC')), {'x': 'A', 'y': 'BC'})
+        self.assertEqual(split.match(((), 'ABD')), {'x': 'AB', 'y': 'D'})
+        self.assertIsNone(split.match(((), 'ABBD')))
+        # only the transitions looked up are memoized, until the table is
+        # iterated over, which expands all schemas
+        self.assertEqual(dict.__len__(table), 4)
+        self.assertTrue(table)
+        self.assertEqual(dict.__len__(table), 4)
+        self.assertFalse(RuleTable({}, [RuleSchema([], '{z}', 'q', z=())]))
+        # building an automaton does not expand the table, reading its
+        # states or alphabet does
+        bdfa = TreeBDFA([], [], [], table)
+        self.assertEqual(dict.__len__(table), 4)
+        self.assertIn('qT9999', bdfa.states)
+        self.assertEqual(len(bdfa.alphabet), 30001)
+        self.assertEqual(len(table), 40000)
+        self.assertEqual(table[((), 'T3')], 'q3')
+        self.assertEqual(table.get(((), 'X')), None)
+        self.assertRaises(ValueError, RuleSchema, [], '{z}', 'q{y}', z=tags)
+        self.assertRaises(ValueError, RuleSchema, [], '{z}', 'q', y=tags)
+
+
+class TreeBNFATest(unittest.TestCase):
+
+    # trees with a b leaf at depth 2 below the root
+    nfa = TreeBNFA(['q', 'q0', 'q1', 'q2'], ['f', 'a', 'b'], ['q2'],
+                   [([], 'a', 'q'), ([], 'b', 'q'), ([], 'b', 'q0'),
+                    (['q', 'q'], 'f', 'q'),
+                    (['q0', 'q'], 'f', 'q1'), (['q', 'q0'], 'f', 'q1'),
+                    (['q1', 'q'], 'f', 'q2'), (['q', 'q1'], 'f', 'q2')])
+
+    def test_recognizes(self):
+        t = Tree.from_list(['f', ['f', 'a', 'b'], 'a'])
+        self.assertEqual(self.nfa.run(t), {'q', 'q2'})
+        self.assertTrue(self.nfa.recognizes(TreeArena.from_tree(t)))
+        self.assertFalse(self.nfa.recognizes(Tree.from_list(['f', 'b', 'b'])))
+        self.assertEqual(self.nfa.run(Tree.from_list(['f', 'c', 'b'])), set())
+        self.assertFalse(self.nfa.is_deterministic())
+
+        gb = TreeBNFA(gb_grammar.states, gb_grammar.alphabet, gb_grammar.finals,
+                      [(q, x, r) for (q, x), r in gb_grammar.transitions.items()])
+        self.assertTrue(gb.is_deterministic())
+        for t in bench.workloads(2)['random_gb'] + [tts.min_dp_d_n]:
+            self.assertEqual(gb.recognizes(t), gb_grammar.recognizes(t))
+
+    def test_determinize(self):
+        dfa = self.nfa.determinize()
+        counts = [TreeSampler(dfa).count(n) for n in range(1, 10)]
+        self.assertEqual(counts, [0, 0, 0, 0, 12, 0, 47, 0, 240])
+        for t in TreeSampler(dfa, seed=637).enumerate_trees(7):
+            self.assertTrue(self.nfa.recognizes(t))
+        self.assertRaises(ValueError, self.nfa.determinize, max_states=3)
+        # every transition between reachable subsets is found
+        states = list(dfa.states)
+        expected = {}
+        for symbol, n in [('a', 0), ('b', 0), ('f', 2)]:
+            for statelist in itertools.product(states, repeat=n):
+                reached = frozenset().union(*(
+                    nextstates for (qs, x), nextstates in self.nfa.transitions.items()
+                    if x == symbol and all(q in subset for q, subset in zip(qs, statelist))))
+                if reached:
+                    expected[(statelist, symbol)] = reached
+        self.assertEqual(dfa.transitions, expected)
+
+
+class WeightedTreeBDFATest(unittest.TestCase):
+
+    probabilities = {key: 0.5 if len(key[0]) == 2 else 0.9
+                     for key in gb_grammar.transitions}
+
+    def test_weight(self):
+        wgb = WeightedTreeBDFA(gb_grammar, self.probabilities,
+                               final_weights={'qXP': 0.8})
+        t = tts.gb_np_n   # NP[N'[N]]: three transitions of one child or none
+        self.assertAlmostEqual(wgb.weight(t), 0.9 ** 3 * 0.8)
+        self.assertAlmostEqual(wgb.weight(TreeArena.from_tree(t)), 0.9 ** 3 * 0.8)
+        self.assertEqual(wgb.weight(tts.min_dp_d_n), 0.0)
+        self.assertRaises(ValueError, WeightedTreeBDFA, gb_grammar, {((), 'X'): 1.0})
+
+        trees = bench.workloads(2)['random_gb'][:20] + [tts.min_dp_d_n]
+        logs = {key: math.log(p) for key, p in self.probabilities.items()}
+        weights = [wgb.weight(t) for t in trees]
+        log_wgb = WeightedTreeBDFA(gb_grammar, logs, log_semiring, {'qXP': math.log(0.8)})
+        best = WeightedTreeBDFA(gb_grammar, logs, tropical_semiring)
+        self.assertAlmostEqual(math.exp(log_wgb.total(trees)), sum(weights))
+        self.assertAlmostEqual(math.exp(best.total(trees)), max(weights) / 0.8)
+        self.assertEqual(WeightedTreeBDFA(gb_grammar, semiring=counting_semiring)
+                         .total(trees), len(trees) - 1)
+
+    def test_many(self):
+        trees = bench.workloads(2)['random_gb'][:30] + [tts.min_dp_d_n]
+        trees[::2] = [TreeArena.from_tree(t) for t in trees[::2]]
+        for semiring, weights in [
+                (probability_semiring, self.probabilities),
+                (log_semiring, {k: math.log(p) for k, p in self.probabilities.items()})]:
+            wgb = WeightedTreeBDFA(gb_grammar, weights, semiring)
+            single = [wgb.weight(t) for t in trees]
+            for w, x in zip(single, wgb.weights_many(trees)):
+                self.assertAlmostEqual(w, x)
+            ranking = wgb.rank(trees)
+            self.assertEqual(sorted(ranking), list(range(len(trees))))
+            self.assertEqual(ranking[-1], len(trees) - 1)
+            ranked = [single[i] for i in ranking]
+            for w, x in zip(ranked, sorted(single, reverse=True)):
+                self.assertAlmostEqual(w, x)
+
+
+class CompiledTreeBDFATest(unittest.TestCase):
+
+    trees = [tts.gb_np_n, tts.gb_np_d_n, tts.gb_simple_trans_clause,
+             tts.gb_pp_comp_cp_comp, tts.min_dp_d, tts.min_dp_d_n,
+             tts.min_simple_trans_clause, tts.min_pp_comp_cp_comp,
+             tts.min_xp_w_spec_no_comp, sn(3)]
+
+    def test_agrees(self):
+        for bdfa in [ss_grammar, gb_grammar, minimalist_grammar]:
+            for compiled in [bdfa.compile(), bdfa.compile(max_dense=0)]:
+                for t in self.trees:
+                    self.assertEqual(compiled.recognizes(t), bdfa.recognizes(t))
+                    self.assertEqual(compiled.recognizes(TreeArena.from_tree(t)),
+                                     bdfa.recognizes(t))
+                    self.assertEqual(compiled.run(t), bdfa._process(t))
+
+    def test_tables(self):
+        compiled = gb_grammar.compile()
+        self.assertEqual(compiled.tables[2].shape,
+                         (len(compiled.symbols),) + (len(compiled.states),) * 2)
+        self.assertIsInstance(gb_grammar.compile(max_dense=0).tables[2], dict)
+        # a final state that no transition reaches is interned as well
+        bdfa = TreeBDFA(['qa'], ['a'], ['qa', 'qz'], {((), 'a'): 'qa'})
+        compiled = bdfa.compile()
+        self.assertEqual(len(compiled.finals), len(compiled.states))
+        self.assertTrue(compiled.recognizes(Tree('a')))
+        self.assertEqual(TreeBDFA(['qa'], ['a'], [], {((), 'a'): 'qa'}).compile()
+                         .recognizes_many([Tree('a')]).tolist(), [False])
+
+    def test_recognizes_many(self):
+        trees = self.trees + [Tree('N'), Tree('?', [Tree('N')])]
+        batch = trees + [TreeArena.from_tree(t) for t in reversed(trees)]
+        for bdfa in [ss_grammar, gb_grammar, minimalist_grammar]:
+            expected = [bdfa.recognizes(t) for t in trees]
+            expected += expected[::-1]
+            self.assertEqual(bdfa.recognizes_many(batch).tolist(), expected)
+            self.assertEqual(bdfa.compile(max_dense=0).recognizes_many(batch).tolist(),
+                             expected)
+        self.assertEqual(gb_grammar.recognizes_many([]).shape, (0,))
+        # the automaton is compiled once, on the first batch
+        compiled = gb_grammar._compiled
+        gb_grammar.recognizes_many(trees)
+        self.assertIs(gb_grammar._compiled, compiled)
+
+
+class TreeBDFTTest(unittest.TestCase):
+
+    def test_templates(self):
+        template = Tree.from_list(["?P", 0, ["?'", "?", ["T'", "T"]]])
+        bdft = TreeBDFT(['q'], ['a', 'b'], ['q'],
+                        [([], 'a', 'q', Tree('a')),
+                         (['q'], 'b', 'q', template)])
+        state, plan = bdft._plans[(('q',), 'b')]
+        self.assertEqual([op for op, arg, n in plan], [0, 1, 2])
+        out1 = bdft.transform(Tree('b', [Tree('a')]))
+        out2 = bdft.transform(Tree('b', [Tree('a')]))
+        self.assertEqual(out1, Tree.from_list(["?P", "a", ["?'", "?", ["T'", "T"]]]))
+        self.assertIsNot(out1, out2)
+        self.assertIs(out1.children[1], out2.children[1])
+        # shared fragments are immutable; copies of the output are not
+        self.assertIsInstance(out1.children[1], SharedTree)
+        self.assertRaises(TypeError, out1.children[1].add_subtree, Tree('x'))
+        copy = out1.copy()
+        self.assertEqual(copy, out1)
+        copy.children[1].add_subtree(Tree('x'))
+        self.assertNotEqual(copy, out1)
+        self.assertEqual(out2, out1)
+        self.assertFalse(any(isinstance(node, SharedTree)
+                             for node in copy.postorder()))
+
+    def test_events(self):
+        trees = bench.workloads(1)['random_gb'] + [tts.gb_pp_comp_cp_comp, sn(3)]
+        for transducer in (gb_to_min_v1, gb_to_min_v2):
+            for t in trees:
+                out = transducer.transform(t)
+                events = transducer.transform_events(t)
+                if out is None:
+                    self.assertIsNone(events)
+                else:
+                    self.assertEqual(list(events), list(tree_events(out)))
+                for fmt in ('bracket', 'penn'):
+                    expected = io.StringIO()
+                    write_trees([out], expected, fmt)
+                    sink = io.StringIO()
+                    written = transducer.transform_to(TreeArena.from_tree(t), sink, fmt)
+                    sink.write("\n")
+                    self.assertEqual(written, out is not None)
+                    self.assertEqual(sink.getvalue(), expected.getvalue())
+                    self.assertEqual(list(read_trees(io.StringIO(sink.getvalue()))),
+                                     [out])
 
 
 class GBToMinGramTransTest(unittest.TestCase):
@@ -101,6 +849,19 @@ class GBToMinGramTransTest(unittest.TestCase):
         self.assertEqual(gb_to_min_v2.transform(tts.gb_pp_comp_cp_comp),
                          tts.min_pp_comp_cp_comp)
 
+    def test_compose(self):
+        trees = bench.workloads(1)['random_gb'] + [tts.gb_pp_comp_cp_comp]
+        for transducer in (gb_to_min_v1, gb_to_min_v2):
+            fused = compose(transducer, minimalist_grammar)
+            acceptor = fused.to_bdfa()
+            for t in trees:
+                out = transducer.transform(t)
+                accepted = out is not None and minimalist_grammar.recognizes(out)
+                self.assertEqual(fused.recognizes(t), accepted)
+                self.assertEqual(fused.recognizes(TreeArena.from_tree(t)), accepted)
+                self.assertEqual(acceptor.recognizes(t), accepted)
+                self.assertEqual(str(fused.transform(t)), str(out if accepted else None))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tracing and profiling hooks for runs of tree automata.
+
+A tracer is passed to TreeBDFA.recognizes or TreeBDFT.transform (or their
+_process methods) and is told about every transition lookup, every tree
+processed and the time spent in each phase. Without a tracer, the automata
+run their usual loops unchanged, so tracing costs nothing when it is off.
+"""
+
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+_MISSING = object()
+
+
+class Tracer:
+    """Base class of tracers, whose hooks all do nothing. Transition keys
+    have the form (children_state_list, parent_symbol)."""
+
+    def transition(self, key):
+        """Called when the transition with the given key fires."""
+
+    def miss(self, key):
+        """Called when there is no transition with the given key."""
+
+    def tree(self, nodes):
+        """Called after processing a tree, with the number of nodes that
+        were evaluated."""
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager wrapping a phase of processing, such as
+        'recognize' or 'transform'."""
+        yield
+
+
+class PrintTracer(Tracer):
+    """Tracer printing every transition lookup, as done with debug=True."""
+
+    def transition(self, key):
+        print(*key)
+
+    def miss(self, key):
+        print(*key, "(no transition)")
+
+
+class StatsTracer(Tracer):
+    """Tracer collecting statistics over any number of runs.
+
+    Attributes
+    ----------
+    transitions: Counter of the number of times each transition fired
+    misses: Counter of the number of failed lookups for each key
+    nodes: Counter of the number of trees by number of evaluated nodes
+    phases: dictionary of {phase_name: [number_of_calls, total_seconds]}
+    """
+
+    def __init__(self):
+        self.transitions = Counter()
+        self.misses = Counter()
+        self.nodes = Counter()
+        self.phases = {}
+
+    def transition(self, key):
+        self.transitions[key] += 1
+
+    def miss(self, key):
+        self.misses[key] += 1
+
+    def tree(self, nodes):
+        self.nodes[nodes] += 1
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = self.phases.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def hot_rules(self, k=10):
+        """Return the k most frequently fired transition keys, with their
+        counts, most frequent first."""
+        return self.transitions.most_common(k)
+
+    def dead_rules(self, automaton):
+        """Return the list of keys of the automaton's transitions that never
+        fired."""
+        return [key for key in automaton.transitions if key not in self.transitions]
+
+    def to_dict(self):
+        """Return the statistics as a dictionary of lists, numbers and
+        strings, as used by to_json."""
+        def rules(counter):
+            return [{'children': list(statelist), 'symbol': symbol, 'count': n}
+                    for (statelist, symbol), n in counter.most_common()]
+        return {
+            'transitions': rules(self.transitions),
+            'misses': rules(self.misses),
+            'nodes': {str(n): count for n, count in sorted(self.nodes.items())},
+            'phases': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.phases.items()},
+        }
+
+    def to_json(self, indent=None):
+        """Return the statistics as a JSON string. States and symbols that
+        are not JSON values are written as strings."""
+        return json.dumps(self.to_dict(), indent=indent, default=str)
+
+
+class _TracedTable:
+    """Read-only view of a transition table reporting every lookup to a
+    tracer and counting them."""
+
+    __slots__ = ('table', 'tracer', 'lookups')
+
+    def __init__(self, table, tracer):
+        self.table = table
+        self.tracer = tracer
+        self.lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        value = self.table.get(key, _MISSING)
+        if value is _MISSING:
+            self.tracer.miss(key)
+            return default
+        self.tracer.transition(key)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+
+def traced(table, tracer):
+    """Return the transition table to use for a run: the table itself
+    without a tracer, else a view of it reporting lookups to the tracer."""
+    return table if tracer is None else _TracedTable(table, tracer)
+
+
+def finish(table, tracer):
+    """Report the number of nodes evaluated through a table returned by
+    traced to the tracer, if any."""
+    if tracer is not None:
+        tracer.tree(table.lookups)
+
+
+def test():
+    from grammars import gb_grammar
+    from transducer_v2 import gb_to_min
+    from bench import workloads
+
+    trees = workloads(10)['random_gb']
+    tracer = StatsTracer()
+    for t in trees:
+        gb_grammar.recognizes(t, tracer=tracer)
+        gb_to_min.transform(t, tracer=tracer)
+    print(f"{sum(tracer.transitions.values())} transitions fired, "
+          f"{sum(tracer.misses.values())} misses")
+    print("hot rules:")
+    for key, n in tracer.hot_rules(5):
+        print(f"  {n:6} {key}")
+    dead = tracer.dead_rules(gb_to_min)
+    print(f"{len(dead)} of {len(gb_to_min.transitions)} gb_to_min rules never fired")
+    print({name: f"{calls} calls, {seconds:.3f}s"
+           for name, (calls, seconds) in tracer.phases.items()})
+
+
+if __name__ == "__main__":
+    test()
@@ -9,6 +9,7 @@ sets of transitions for each lexical category.
 
 from tree import Tree
 from treebdft import TreeBDFT
+from schema import RuleSchema, RuleTable
 import test_trees as tts
 
 #
@@ -54,6 +55,8 @@ for z in "XYZNAVPDIC":
         ([QXP, qz], zp, QXP, Tree.from_list([UNKP, 0, [UNKBAR, UNK, zp]]))
     ])
 
+n_basic = len(trans)
+
 
 #
 # transitions for NP -> DP conversion
@@ -121,6 +124,32 @@ trans.extend([
 
 gb_to_min = TreeBDFT(states, alph, finals, trans)
 
+#
+# schematic variant
+#
+# the basic X-bar transitions are written once as schemas over the
+#  categories instead of once per category, and the NP -> DP and IP -> TP
+#  transitions are kept as concrete transitions, which take precedence over
+#  the schemas; see schema.py
+#
+
+categories = frozenset("XYZNAVPDIC")
+gb_to_min_schematic = TreeBDFT(
+    states, alph, finals,
+    RuleTable({(tuple(qs), x): (q, tree) for qs, x, q, tree in trans[n_basic:]}, [
+        RuleSchema([], "{z}", ("q{z}", Tree('')), z=categories),
+        RuleSchema(["q{z}"], "{z}'", ("q{z}", Tree('')), z=categories),
+        RuleSchema(["q{z}"], "{z}P", (QXP, Tree("{z}P")), z=categories),
+        RuleSchema(["q{z}", QXP], "{z}'", ("q{z}bar", Tree(1)), z=categories),
+        RuleSchema(["q{z}bar"], "{z}P",
+                   (QXP, Tree.from_list(["{z}P", "{z}", 0])), z=categories),
+        RuleSchema([QXP, "q{z}bar"], "{z}P",
+                   (QXP, Tree.from_list(["{z}P", 0, ["{z}'", "{z}", 1]])),
+                   z=categories),
+        RuleSchema([QXP, "q{z}"], "{z}P",
+                   (QXP, Tree.from_list([UNKP, 0, [UNKBAR, UNK, "{z}P"]])),
+                   z=categories)]))
+
 
 #
 # testing
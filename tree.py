@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import copy
+import weakref
+
 from prettytable import PrettyTable
 
 
 class Tree:
+    # Cached statistics. _stats holds (size, depth, width) once computed,
+    # _yld the yield once requested and _hash the structural hash once
+    # requested; all are cleared along the ancestor path when add_subtree
+    # modifies the tree. _parent holds a weak reference to the parent whose
+    # statistics were computed from this node, or, for a node with several
+    # such parents, a dictionary of weak references keyed by id. Trees whose
+    # children lists are modified directly must not rely on the cache.
+    __slots__ = ('data', 'children', '_stats', '_yld', '_hash', '_parent',
+                 '__weakref__')
+
     def __init__(self, data, children=None):
         """
         Construct a tree consisting of a single node with the given data,
@@ -15,37 +28,116 @@ class Tree:
         if children is None:
             children = []
         self.children = children
+        self._stats = None
+        self._yld = None
+        self._hash = None
+        self._parent = None
+
+    def __getstate__(self):
+        # cached statistics, and the weak parent references they rely on,
+        # are left out of pickles and copies and recomputed when needed
+        return self.data, self.children
+
+    def __setstate__(self, state):
+        self.data, self.children = state
+        self._stats = None
+        self._yld = None
+        self._hash = None
+        self._parent = None
+
+    def __copy__(self):
+        return type(self)(self.data, list(self.children))
+
+    def __deepcopy__(self, memo):
+        # copied bottom-up without recursion, so that deep trees can be
+        # copied; subtrees shared by several parents stay shared
+        for node in self.dag_postorder(memo):
+            memo[id(node)] = type(node)(copy.deepcopy(node.data, memo),
+                                        [memo[id(c)] for c in node.children])
+        return memo[id(self)]
 
     @staticmethod
     def from_list(nodes):
         """
         Construct tree from list of form [label, child1, child2, ...].
         Brackets around terminal nodes may be omitted, similar to LISP
-        S-expressions.
-        """
-        if not isinstance(nodes, list):
-            nodes = [nodes]
-        if len(nodes) < 1:
-            raise ValueError("Tree level cannot be empty.")
-        elif len(nodes) == 1:
-            return Tree(nodes[0])
-        else:
-            parent = nodes.pop(0)
-
-            return Tree(parent, [Tree.from_list(n) for n in nodes])
+        S-expressions. The lists are read with an explicit stack, so
+        arbitrarily deep trees can be built, and are left unchanged.
+        """
+        # trees built so far, whose parents are not built yet
+        built = []
+        stack = [(nodes, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if not isinstance(item, list):
+                built.append(Tree(item))
+            elif len(item) < 1:
+                raise ValueError("Tree level cannot be empty.")
+            elif expanded:
+                n = len(built) - (len(item) - 1)
+                children = built[n:]
+                del built[n:]
+                built.append(Tree(item[0], children))
+            else:
+                stack.append((item, True))
+                stack.extend((c, False) for c in reversed(item[1:]))
+        return built.pop()
 
     def __str__(self):
-        if len(self.children) > 0:
-            return "{}[{}]".format(self.data, ', '.join(str(c) for c in self.children))
-        else:
-            return str(self.data)
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            elif len(node.children) > 0:
+                parts.append("{}[".format(node.data))
+                stack.append("]")
+                for i in range(len(node.children) - 1, -1, -1):
+                    stack.append(node.children[i])
+                    if i > 0:
+                        stack.append(", ")
+            else:
+                parts.append(str(node.data))
+        return ''.join(parts)
 
     __repr__ = __str__
 
     def __eq__(self, other):
-        return (self.data == other.data
-                and len(self.children) == len(other.children)
-                and all(c == d for c, d in zip(self.children, other.children)))
+        """
+        Return True if both trees have the same labels and structure. Cached
+        structural hashes are used to reject unequal subtrees early, so a
+        tree whose labels or children lists were modified directly after its
+        hash was computed, rather than through add_subtree, may compare
+        unequal to an equal tree until _invalidate is called on the
+        modified node.
+        """
+        if not isinstance(other, Tree):
+            return NotImplemented
+        # identical subtrees are skipped, and subtrees whose cached hashes
+        # differ are rejected without being traversed
+        stack = [(self, other)]
+        while stack:
+            s, o = stack.pop()
+            if s is o:
+                continue
+            if ((s._hash is not None and o._hash is not None and s._hash != o._hash)
+                    or s.data != o.data
+                    or len(s.children) != len(o.children)):
+                return False
+            stack.extend(zip(s.children, o.children))
+        return True
+
+    def __hash__(self):
+        """
+        Return a structural hash of the tree, computed from the label of the
+        root and the hashes of its children, so that equal trees have equal
+        hashes. Hashes are cached with the other statistics of the tree, so
+        a tree must not be modified while it is used as a dictionary key.
+        """
+        if self._hash is None:
+            self._compute_stats()
+        return self._hash
 
     # def pformat(self):
     #     if len(self.children) > 0:
@@ -58,19 +150,154 @@ class Tree:
         Add given subtree as the last child of this tree.
         """
         self.children.append(subtree)
+        self._invalidate()
+
+    def _invalidate(self):
+        """
+        Clear the cached statistics of this node and of all its ancestors.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            # a node without statistics has no ancestors with statistics
+            if node._stats is None:
+                continue
+            node._stats = None
+            node._yld = None
+            node._hash = None
+            parent = node._parent
+            if type(parent) is dict:
+                stack.extend(p for p in (ref() for ref in parent.values())
+                             if p is not None)
+            elif parent is not None:
+                p = parent()
+                if p is not None:
+                    stack.append(p)
+
+    def _register_parent(self, parent):
+        ref = self._parent
+        if ref is None:
+            self._parent = weakref.ref(parent)
+            return
+        if type(ref) is not dict:
+            other = ref()
+            if other is parent:
+                return
+            if other is None:
+                self._parent = weakref.ref(parent)
+                return
+            # a node shared by several parents
+            ref = self._parent = {id(other): ref}
+        old = ref.get(id(parent))
+        if old is not None and old() is parent:
+            return
+        ref[id(parent)] = weakref.ref(parent)
+        # drop references to dead parents whenever the table doubles in size
+        n = len(ref)
+        if n >= 64 and n & (n - 1) == 0:
+            for key in [key for key, r in ref.items() if r() is None]:
+                del ref[key]
+
+    def _compute_stats(self):
+        """
+        Return (size, depth, width) of the tree, computing and caching them,
+        together with the structural hash, in one pass for every node whose
+        statistics are not cached yet.
+        """
+        if self._stats is not None:
+            return self._stats
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not expanded:
+                if node._stats is None:
+                    stack.append((node, True))
+                    stack.extend((c, False) for c in node.children)
+                continue
+            if node._stats is not None:
+                continue  # a subtree shared by several parents
+            size = 1
+            depth = 0
+            width = len(node.children)
+            for c in node.children:
+                c_size, c_depth, c_width = c._stats
+                size += c_size
+                depth = max(depth, c_depth + 1)
+                width = max(width, c_width)
+                if not isinstance(c, SharedTree):
+                    c._register_parent(node)
+            node._stats = (size, depth, width)
+            node._hash = hash((node.data, tuple([c._hash for c in node.children])))
+        return self._stats
+
+    def copy(self):
+        """
+        Return a copy of the tree made of new, modifiable Tree nodes, shared
+        subtrees included, so that it can be extended with add_subtree.
+        """
+        copies = []
+        for node in self.postorder():
+            n = len(node.children)
+            children = copies[len(copies) - n:]
+            del copies[len(copies) - n:]
+            copies.append(Tree(node.data, children))
+        return copies.pop()
+
+    def postorder(self):
+        """
+        Return an iterator over the nodes of the tree in post-order (children
+        left to right, then the parent). The nodes are collected with an
+        explicit stack, so arbitrarily deep trees do not exhaust the
+        interpreter's recursion limit.
+        """
+        # pushing children left to right yields the preorder of the mirrored
+        # tree, whose reversal is the post-order of the tree itself
+        order = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children)
+        return reversed(order)
+
+    def dag_postorder(self, done=()):
+        """
+        Return a list of the distinct node objects of the tree, each listed
+        once with its children before it. Subtrees shared between several
+        parents, as in the trees built by a TreePool, are only visited once.
+        Nodes whose id is in done, and their subtrees, are left out.
+        """
+        seen = set()
+        order = []
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+            elif id(node) not in seen and id(node) not in done:
+                seen.add(id(node))
+                stack.append((node, True))
+                stack.extend((c, False) for c in reversed(node.children))
+        return order
 
     def size(self):
         """
         Return the number of nodes contained in the tree.
         """
-        return 1 + sum(c.size() for c in self.children)
+        return self._compute_stats()[0]
 
     def yld(self):
         """
         Return the string formed by concatenating all leaf nodes in the tree.
         """
         if len(self.children) > 0:
-            return ''.join(c.yld() for c in self.children)
+            if self._yld is None:
+                # computing the statistics registers the parent links needed
+                # to invalidate the cached yield
+                self._compute_stats()
+                self._yld = ''.join(node.data for node in self.postorder()
+                                    if len(node.children) == 0)
+            return self._yld
         else:
             return self.data
 
@@ -79,34 +306,110 @@ class Tree:
         Return the depth of the tree, where a single root node has depth 0
         and each additional level adds 1 to the depth.
         """
-        if len(self.children) > 0:
-            return 1 + max(c.depth() for c in self.children)
-        else:
-            return 0
+        return self._compute_stats()[1]
 
     def width(self):
         """
         Return width of the tree, defined as the largest number of children
         of any node in the tree, or 0 in the case of a single root node.
         """
-        if len(self.children) > 0:
-            return max(len(self.children), max(c.width() for c in self.children))
-        else:
-            return 0
+        return self._compute_stats()[2]
 
     def get_gorn(self, addr):
         """
-        Return subtree at given gorn address, given as a list of non-negative
-        integers. Return None if address not found.
+        Return subtree at given gorn address, given as a sequence of
+        non-negative integers, which is left unchanged. Return None if
+        address not found. See gorn.GornIndex for repeated lookups.
         """
-        if len(addr) > 0:
-            i = addr.pop(0)
-            if i in range(len(self.children)):
-                return self.children[i].get_gorn(addr)
+        node = self
+        for i in addr:
+            if 0 <= i < len(node.children):
+                node = node.children[i]
             else:
                 return None
-        else:
-            return self
+        return node
+
+
+class SharedTree(Tree):
+    """
+    Node of a hash-consed tree built by a TreePool. Structurally identical
+    subtrees are represented by the same object, so shared trees must not
+    be modified. Automata evaluate every distinct node of a shared tree
+    only once.
+    """
+
+    __slots__ = ()
+
+    def add_subtree(self, subtree):
+        raise TypeError("shared trees cannot be modified")
+
+
+class TreePool:
+    """
+    Hash-consing pool of trees. Trees built or interned through the same
+    pool share one SharedTree node per distinct subtree, turning a tree
+    with repeated subtrees into a DAG.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _owns(self, node):
+        return (isinstance(node, SharedTree)
+                and self._nodes.get(self._key(node.data, node.children)) is node)
+
+    @staticmethod
+    def _key(data, children):
+        # children are pooled, and kept alive by the pool, so their ids
+        # identify them
+        return (data, tuple(id(c) for c in children))
+
+    def make(self, data, children=None):
+        """
+        Return the pooled node with the given data and children, creating
+        it if necessary. Children that do not belong to the pool are
+        interned first.
+        """
+        if children is None:
+            children = []
+        children = [c if self._owns(c) else self.intern(c) for c in children]
+        key = self._key(data, children)
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = SharedTree(data, children)
+        return node
+
+    def intern(self, tree):
+        """
+        Return the pooled tree structurally identical to the given tree.
+        """
+        if self._owns(tree):
+            return tree
+        nodes = self._nodes
+        stack = []
+        for node in tree.postorder():
+            n = len(node.children)
+            if n == 0:
+                children = []
+            else:
+                children = stack[-n:]
+                del stack[-n:]
+            key = self._key(node.data, children)
+            shared = nodes.get(key)
+            if shared is None:
+                shared = nodes[key] = SharedTree(node.data, children)
+            stack.append(shared)
+        return stack.pop()
+
+    def from_list(self, nodes):
+        """
+        Construct a pooled tree from a list of form [label, child1, ...],
+        as Tree.from_list does.
+        """
+        return self.intern(Tree.from_list(nodes))
 
 
 # TESTING
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact, array-backed representation of trees.
+"""
+
+from array import array
+
+from tree import Tree
+
+
+class TreeArena:
+    """Tree stored as flat, preorder-ordered parallel arrays.
+
+    Node i is the i-th node of a preorder traversal, so node 0 is the root
+    and every subtree occupies a contiguous range of indices. Labels are
+    interned: each distinct label is stored once in `symbols` and nodes
+    refer to it by index.
+
+    Parameters
+    ----------
+    labels: label ID of each node, an index into `symbols`
+    arity: number of children of each node
+    parent: index of each node's parent, -1 for the root
+    first_child: index of each node's first child, -1 for leaves
+    end: index one past the last node of each node's subtree
+    symbols: list of distinct labels, indexed by label ID
+
+    Since children follow their parent in preorder, scanning the arrays in
+    reverse visits every child before its parent, which is how automata
+    evaluate an arena without building any per-node objects. As they only
+    need labels and arity, parent, first_child and end may be given as
+    None, in which case they are derived from arity when first used.
+    """
+
+    def __init__(self, labels, arity, parent, first_child, end, symbols,
+                 symbol_ids=None):
+        self.labels = labels
+        self.arity = arity
+        self._parent = parent
+        self._first_child = first_child
+        self._end = end
+        self.symbols = symbols
+        if symbol_ids is None:
+            symbol_ids = {s: i for i, s in enumerate(symbols)}
+        self.symbol_ids = symbol_ids
+
+    @staticmethod
+    def from_tree(tree):
+        """
+        Construct an arena holding a copy of the given tree.
+        """
+        labels = array('i')
+        arity = array('i')
+        symbols = []
+        symbol_ids = {}
+
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            label_id = symbol_ids.get(node.data)
+            if label_id is None:
+                label_id = symbol_ids[node.data] = len(symbols)
+                symbols.append(node.data)
+            labels.append(label_id)
+            arity.append(len(node.children))
+            stack.extend(reversed(node.children))
+        return TreeArena.from_preorder(labels, arity, symbols, symbol_ids)
+
+    @staticmethod
+    def from_preorder(labels, arity, symbols, symbol_ids=None):
+        """
+        Construct an arena from the label IDs and arities of the nodes of a
+        tree in preorder. The other arrays are derived when first used.
+        """
+        return TreeArena(labels, arity, None, None, None, symbols, symbol_ids)
+
+    def _derive(self):
+        """
+        Compute parent, first_child and end from arity in one reverse scan.
+        """
+        arity = self.arity
+        n = len(arity)
+        parent = array('i', [-1]) * n
+        first_child = array('i', [-1]) * n
+        end = array('i', [0]) * n
+        # indices of the roots of the subtrees scanned so far, last first
+        roots = []
+        for i in range(n - 1, -1, -1):
+            k = arity[i]
+            if k == 0:
+                end[i] = i + 1
+            else:
+                first_child[i] = i + 1
+                end[i] = end[roots[-k]]
+                for c in roots[-k:]:
+                    parent[c] = i
+                del roots[-k:]
+            roots.append(i)
+        self._parent = parent
+        self._first_child = first_child
+        self._end = end
+
+    @property
+    def parent(self):
+        if self._parent is None:
+            self._derive()
+        return self._parent
+
+    @property
+    def first_child(self):
+        if self._first_child is None:
+            self._derive()
+        return self._first_child
+
+    @property
+    def end(self):
+        if self._end is None:
+            self._derive()
+        return self._end
+
+    def to_tree(self):
+        """
+        Return the tree stored in the arena as a Tree.
+        """
+        labels = self.labels
+        arity = self.arity
+        symbols = self.symbols
+        stack = []
+        for i in range(len(labels) - 1, -1, -1):
+            k = arity[i]
+            if k == 0:
+                stack.append(Tree(symbols[labels[i]]))
+            else:
+                children = stack[:-k - 1:-1]
+                del stack[-k:]
+                stack.append(Tree(symbols[labels[i]], children))
+        return stack.pop()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __str__(self):
+        return str(self.to_tree())
+
+    __repr__ = __str__
+
+    def label(self, i):
+        """
+        Return the label of node i.
+        """
+        return self.symbols[self.labels[i]]
+
+    def children(self, i):
+        """
+        Return the indices of the children of node i, left to right.
+        """
+        result = []
+        j = self.first_child[i]
+        for _ in range(self.arity[i]):
+            result.append(j)
+            j = self.end[j]
+        return result
+
+    def address(self, i):
+        """
+        Return the Gorn address of node i, as a tuple of child positions
+        counted from 0. Only the arities of the nodes before i are read.
+        """
+        arity = self.arity
+        addr = []   # position of each node on the path to the next node
+        left = []   # number of children of each such node not yet passed
+        for j in range(i):
+            if arity[j] > 0:
+                addr.append(0)
+                left.append(arity[j])
+            else:
+                while left and left[-1] == 1:
+                    addr.pop()
+                    left.pop()
+                if left:
+                    left[-1] -= 1
+                    addr[-1] += 1
+        return tuple(addr)
+
+    def nbytes(self):
+        """
+        Return the number of bytes used by the node arrays.
+        """
+        return sum(a.itemsize * len(a) for a in
+                   (self.labels, self.arity, self.parent,
+                    self.first_child, self.end))
+
+
+def test():
+    t = Tree.from_list(['a', ['b', ['c', 'd'], ['e', 'f', 'g', 'h', 'i']]])
+    arena = TreeArena.from_tree(t)
+    print(t)
+    print(arena)
+    print(f"labels: {arena.labels.tolist()}")
+    print(f"arity: {arena.arity.tolist()}")
+    print(f"parent: {arena.parent.tolist()}")
+    print(f"first_child: {arena.first_child.tolist()}")
+    print(f"end: {arena.end.tolist()}")
+    print(f"symbols: {arena.symbols}")
+    print(f"round trip equal: {arena.to_tree() == t}")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import heapq
+from itertools import count
 from pprint import pformat
 
-from tree import Tree
+from tree import Tree, SharedTree
+from treearena import TreeArena
+from schema import RuleTable
+from tracing import PrintTracer, traced, finish
 
 
 class TreeBDFA:
@@ -22,17 +27,56 @@ class TreeBDFA:
     All sets may be alternatively provided as lists, in which case they will
     be converted automatically. The transition dictionary may likewise be
     provided as a set or list of tuples.
+    It may also be a schema.RuleTable, to define transitions by schemas
+    over categories. The states and alphabet then only need to list what
+    the schemas do not stand for: the states and symbols of the schemas are
+    added the first time the states or alphabet are read, which expands
+    the table, so that building the automaton does not depend on the
+    number of categories.
     """
 
     def __init__(self, states, alphabet, finals, transitions):
-        self.states = set(states)
-        self.alphabet = set(alphabet)
+        self._states = set(states)
+        self._alphabet = set(alphabet)
         self.finals = set(finals)
 
         if type(transitions) in (set, list):
             self.transitions = self._delta_dict(transitions)
-        elif type(transitions) == dict:
+        elif isinstance(transitions, dict):
             self.transitions = transitions
+        # whether the states and symbols of a RuleTable remain to be added
+        self._derive = isinstance(self.transitions, RuleTable)
+        # CompiledTreeBDFA used by recognizes_many, compiled on first use
+        self._compiled = None
+
+    def _add_table_states(self):
+        """Add the states and symbols of the transitions of a RuleTable to
+        the states and alphabet, expanding the table."""
+        self._derive = False
+        for (statelist, symbol), nextstate in self.transitions.items():
+            self._states.update(statelist)
+            self._states.add(nextstate)
+            self._alphabet.add(symbol)
+
+    @property
+    def states(self):
+        if self._derive:
+            self._add_table_states()
+        return self._states
+
+    @states.setter
+    def states(self, states):
+        self._states = states
+
+    @property
+    def alphabet(self):
+        if self._derive:
+            self._add_table_states()
+        return self._alphabet
+
+    @alphabet.setter
+    def alphabet(self, alphabet):
+        self._alphabet = alphabet
 
     def __str__(self):
         return ("<TreeBDFA>\n"
@@ -55,21 +99,349 @@ class TreeBDFA:
                    and nextstate in self.states
                    for (state_list, symbol), nextstate in self.transitions.items())
 
-    def _process(self, subtree, debug=False):
+    def _reachable(self):
+        """Return the set of states reached by some tree."""
+        reachable = set()
+        changed = True
+        while changed:
+            changed = False
+            for (statelist, symbol), nextstate in self.transitions.items():
+                if nextstate not in reachable and all(q in reachable for q in statelist):
+                    reachable.add(nextstate)
+                    changed = True
+        return reachable
+
+    def minimize(self):
+        """Return an equivalent TreeBDFA with the fewest states, and a report
+        of how much the automaton shrank.
+
+        Unreachable states, which no tree reaches, and useless states, from
+        which no final state can be reached, are removed first, along with
+        their transitions. The remaining states are then merged by partition
+        refinement: starting from final and non-final states, states stay in
+        the same block as long as, for every transition context (symbol,
+        position and the other children's states), they lead to the same
+        block or are both rejected. Each block is named after its first
+        state in sorted order.
+
+        The report is a dictionary with the number of states and
+        transitions before and after, and the numbers of unreachable,
+        useless and merged states."""
+        reachable = self._reachable()
+        transitions = {(statelist, symbol): nextstate
+                       for (statelist, symbol), nextstate in self.transitions.items()
+                       if all(q in reachable for q in statelist)}
+
+        useful = self.finals & reachable
+        changed = True
+        while changed:
+            changed = False
+            for (statelist, symbol), nextstate in transitions.items():
+                if nextstate in useful:
+                    for q in statelist:
+                        if q not in useful:
+                            useful.add(q)
+                            changed = True
+        transitions = {(statelist, symbol): nextstate
+                       for (statelist, symbol), nextstate in transitions.items()
+                       if nextstate in useful and all(q in useful for q in statelist)}
+
+        # contexts[q]: (symbol, position, other children, next state) for
+        # every transition with q among its children
+        contexts = {q: [] for q in useful}
+        for (statelist, symbol), nextstate in transitions.items():
+            for i, q in enumerate(statelist):
+                contexts[q].append(((symbol, i, statelist[:i] + statelist[i + 1:]),
+                                    nextstate))
+        block = {q: int(q in self.finals) for q in useful}
+        n_blocks = len(set(block.values()))
+        while True:
+            signatures = {q: (block[q], frozenset((context, block[nextstate])
+                                                  for context, nextstate in contexts[q]))
+                          for q in useful}
+            ids = {}
+            block = {q: ids.setdefault(signature, len(ids))
+                     for q, signature in signatures.items()}
+            if len(ids) == n_blocks:
+                break
+            n_blocks = len(ids)
+
+        members = {}
+        for q in sorted(useful, key=str):
+            members.setdefault(block[q], []).append(q)
+        name = {q: qs[0] for qs in members.values() for q in qs}
+        minimal = TreeBDFA({name[q] for q in useful},
+                           self.alphabet,
+                           {name[q] for q in useful & self.finals},
+                           {(tuple(name[q] for q in statelist), symbol): name[nextstate]
+                            for (statelist, symbol), nextstate in transitions.items()})
+
+        states = self.states | reachable
+        report = {'states_before': len(states),
+                  'states_after': len(minimal.states),
+                  'transitions_before': len(self.transitions),
+                  'transitions_after': len(minimal.transitions),
+                  'unreachable': len(states - reachable),
+                  'useless': len(reachable - useful),
+                  'merged': len(useful) - len(minimal.states)}
+        return minimal, report
+
+    def witness(self):
+        """Return a smallest tree accepted by the automaton, if any, None
+        otherwise."""
+        return _smallest_tree([self], lambda state: state[0] in self.finals, live=[0])
+
+    def is_empty(self):
+        """Return True if the automaton accepts no tree, False otherwise."""
+        return self.witness() is None
+
+    def includes(self, other):
+        """Return True if every tree accepted by other is accepted by this
+        automaton, False otherwise."""
+        return other.is_subset(self)
+
+    def is_subset(self, other):
+        """Return True if every tree accepted by this automaton is accepted
+        by other, False otherwise."""
+        return _smallest_tree(
+            [self, other],
+            lambda state: state[0] in self.finals and state[1] not in other.finals,
+            live=[0]) is None
+
+    def counterexample(self, other):
+        """Return a smallest tree accepted by exactly one of this automaton
+        and other, if any, None if they accept the same trees."""
+        return _smallest_tree(
+            [self, other],
+            lambda state: (state[0] in self.finals) != (state[1] in other.finals))
+
+    def equivalent(self, other):
+        """Return True if this automaton and other accept the same trees,
+        False otherwise."""
+        return self.counterexample(other) is None
+
+    def compile(self, max_dense=1 << 20):
+        """Return a CompiledTreeBDFA accepting the same trees, which interns
+        states and symbols to integers and looks transitions up in dense
+        NumPy tables. Compile once, then recognize many trees."""
+        from compiledbdfa import CompiledTreeBDFA
+        return CompiledTreeBDFA(self, max_dense=max_dense)
+
+    def recognizes_many(self, trees):
+        """Processes a sequence of trees and returns a NumPy boolean array
+        that is True where a final state is reached; see
+        CompiledTreeBDFA.recognizes_many. The automaton is compiled on the
+        first call and the result reused, so its transitions should not be
+        modified afterwards."""
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled.recognizes_many(trees)
+
+    def _process(self, subtree, debug=False, memo=None, tracer=None):
         """Return the state reached by processing the given tree, if any,
-        None otherwise."""
-        if len(subtree.children) == 0:
-            statelist = ()
+        None otherwise.
+
+        Nodes are visited in post-order; the states of already processed
+        children are kept on an explicit stack, so the depth of the tree
+        is not limited by the recursion limit. Processing stops at the
+        first node without a transition, since none of its ancestors can
+        have one, so rejections only cost the work done up to the failure;
+        see find_failure to locate it. Shared trees, or any tree
+        when a memo dictionary is given, are processed with memoization
+        instead. Transition lookups are reported to the tracer, if any, see
+        tracing; debug=True traces them with a PrintTracer."""
+        if debug and tracer is None:
+            tracer = PrintTracer()
+        transitions = traced(self.transitions, tracer)
+        if isinstance(subtree, TreeArena):
+            state = self._process_arena(subtree, transitions)
+        elif memo is not None or isinstance(subtree, SharedTree):
+            state = self._process_shared(subtree, memo, transitions)
         else:
-            statelist = tuple(self._process(c, debug=debug) for c in subtree.children)
-        if debug:
-            print(statelist)
-        return self.transitions.get((statelist, subtree.data), None)
+            states = []
+            for node in subtree.postorder():
+                n = len(node.children)
+                if n == 0:
+                    statelist = ()
+                else:
+                    statelist = tuple(states[-n:])
+                    del states[-n:]
+                state = transitions.get((statelist, node.data), None)
+                if state is None:
+                    # stuck: no ancestor can have a transition either
+                    break
+                states.append(state)
+        finish(transitions, tracer)
+        return state
 
-    def recognizes(self, tree, debug=False):
-        """Processes a tree and returns True if a final state is reached,
-        False otherwise."""
-        return self._process(tree, debug) in self.finals
+    def _process_shared(self, subtree, memo=None, transitions=None):
+        """Return the state reached by processing the given tree, if any,
+        None otherwise, processing each distinct node object only once.
+
+        States are recorded in memo, a dictionary keyed by node id, which
+        may be reused across calls as long as the nodes it refers to are
+        kept alive and unmodified, e.g. for trees from the same TreePool."""
+        if memo is None:
+            memo = {}
+        if transitions is None:
+            transitions = self.transitions
+        for node in subtree.dag_postorder(memo):
+            statelist = tuple([memo[id(c)] for c in node.children])
+            memo[id(node)] = transitions.get((statelist, node.data), None)
+        return memo[id(subtree)]
+
+    def _process_arena(self, arena, transitions=None):
+        """Return the state reached by processing the tree stored in the
+        given arena, if any, None otherwise.
+
+        The arena is scanned in reverse preorder, which visits children
+        before their parent, so the child states of a node are the top
+        entries of the state stack in reverse order. As in _process, the
+        scan stops at the first node without a transition."""
+        if transitions is None:
+            transitions = self.transitions
+        labels = arena.labels
+        arity = arena.arity
+        symbols = arena.symbols
+        states = []
+        for i in range(len(labels) - 1, -1, -1):
+            n = arity[i]
+            if n == 0:
+                statelist = ()
+            else:
+                statelist = tuple(states[:-n - 1:-1])
+                del states[-n:]
+            state = transitions.get((statelist, symbols[labels[i]]), None)
+            if state is None:
+                return None
+            states.append(state)
+        return states.pop()
+
+    def recognizes(self, tree, debug=False, memo=None, tracer=None):
+        """Processes a tree, given as a Tree or a TreeArena, and returns True
+        if a final state is reached, False otherwise. See _process_shared
+        for the optional memo dictionary, and _process for the tracer."""
+        if tracer is None and not debug:
+            return self._process(tree, memo=memo) in self.finals
+        if tracer is None:
+            tracer = PrintTracer()
+        with tracer.phase('recognize'):
+            return self._process(tree, memo=memo, tracer=tracer) in self.finals
+
+    def find_failure(self, tree):
+        """Processes a tree, given as a Tree or a TreeArena, and returns None
+        if a final state is reached. Otherwise, return a tuple (address,
+        symbol, child_states, state) describing where the run failed: for
+        the first node without a transition, in post-order for a Tree and
+        reverse preorder for a TreeArena, its Gorn address, its symbol, the
+        states of its children and None; if every node has one but the root
+        state is not final, the empty address, the root symbol and child
+        states, and the non-final root state. Processing stops at the
+        failing node."""
+        transitions = self.transitions
+        if isinstance(tree, TreeArena):
+            labels = tree.labels
+            arity = tree.arity
+            symbols = tree.symbols
+            states = []
+            for i in range(len(labels) - 1, -1, -1):
+                n = arity[i]
+                if n == 0:
+                    statelist = ()
+                else:
+                    statelist = tuple(states[:-n - 1:-1])
+                    del states[-n:]
+                symbol = symbols[labels[i]]
+                state = transitions.get((statelist, symbol), None)
+                if state is None:
+                    return tree.address(i), symbol, statelist, None
+                states.append(state)
+        else:
+            # post-order traversal keeping the path to the current node,
+            # as [node, number of children entered] entries
+            states = []
+            path = [[tree, 0]]
+            while path:
+                entry = path[-1]
+                node, i = entry
+                children = node.children
+                if i < len(children):
+                    entry[1] = i + 1
+                    path.append([children[i], 0])
+                    continue
+                path.pop()
+                n = len(children)
+                if n == 0:
+                    statelist = ()
+                else:
+                    statelist = tuple(states[-n:])
+                    del states[-n:]
+                symbol = node.data
+                state = transitions.get((statelist, symbol), None)
+                if state is None:
+                    address = tuple(i - 1 for _, i in path)
+                    return address, symbol, statelist, None
+                states.append(state)
+        if state in self.finals:
+            return None
+        return (), symbol, statelist, state
+
+
+def _smallest_tree(bdfas, goal, live=()):
+    """Return a smallest tree on which the given automata, run side by side,
+    reach a tuple of states satisfying goal, if any, None otherwise.
+
+    This is Knuth's generalization of Dijkstra's algorithm to the product
+    of the automata: state tuples are settled in order of the size of their
+    smallest tree, and a product transition is tried once all its children
+    are settled, driven by the transitions of the components. Components
+    may be in state None, except those listed in live, so a tree rejected
+    by some automata can still be extended. Settled tuples are added to a
+    product.ProductIndex, so that each transition is only combined with
+    children it can actually move on."""
+    from product import ProductIndex
+    index = ProductIndex([bdfa.transitions for bdfa in bdfas])
+    settled = {}  # state tuple -> (size, symbol, children state tuples)
+    tried = set()
+    heap = []
+    tiebreak = count()
+
+    def fire(keys):
+        for children, symbol in keys:
+            if (children, symbol) in tried:
+                continue
+            tried.add((children, symbol))
+            state = tuple(bdfa.transitions.get(
+                              (tuple([c[i] for c in children]), symbol), None)
+                          for i, bdfa in enumerate(bdfas))
+            if all(q is None for q in state) or any(state[i] is None for i in live):
+                continue
+            if state not in settled:
+                size = 1 + sum(settled[c][0] for c in children)
+                heapq.heappush(heap, (size, next(tiebreak), state, symbol, children))
+
+    fire(index.leaves())
+    while heap:
+        size, _, state, symbol, children = heapq.heappop(heap)
+        if state in settled:
+            continue
+        settled[state] = (size, symbol, children)
+        if goal(state):
+            return _build_tree(state, settled)
+        fire(index.add(state))
+    return None
+
+
+def _build_tree(state, settled):
+    """Return the tree recorded for a settled state tuple by _smallest_tree."""
+    root = Tree(None)
+    stack = [(state, root)]
+    while stack:
+        state, node = stack.pop()
+        _, node.data, children = settled[state]
+        node.children = [Tree(None) for _ in children]
+        stack.extend(zip(children, node.children))
+    return root
 
 
 def test():
@@ -109,6 +481,7 @@ def test():
     print(f"anbn recognizes t2: {anbn.recognizes(t2)}")
     print(f"anbn recognizes t3: {anbn.recognizes(t3)}")
     print(f"anbn recognizes t3x: {anbn.recognizes(t3x)}")
+    print(f"anbn fails on t3x at: {anbn.find_failure(t3x)}")
     print()
 
 
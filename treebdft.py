@@ -2,7 +2,17 @@
 # -*- coding: utf-8 -*-
 
 from pprint import pformat
-from tree import Tree
+from tree import Tree, SharedTree, TreePool
+from treearena import TreeArena
+from treebdfa import TreeBDFA
+from treeio import tree_events, write_events, _EMPTY
+from tracing import PrintTracer, traced, finish
+from schema import LazyTable, RuleTable
+
+# operations of compiled output templates, see TreeBDFT._compile_template
+_VAR = 0
+_CONST = 1
+_NODE = 2
 
 
 class TreeBDFT:
@@ -15,6 +25,14 @@ class TreeBDFT:
     finals: set of final states
     transitions: dictionary of the form
       {(children_state_list, parent_symbol): (parent_state, var_leafed_tree)}
+
+    Output templates are compiled into substitution plans when the
+    transducer is constructed, so the transition dictionary should not be
+    modified afterwards. If it is a schema.RuleTable, they are compiled
+    when each transition is first used instead. Variable-free parts of the
+    templates are shared between all output trees as immutable SharedTrees,
+    so output trees cannot be extended with add_subtree where they contain
+    such parts; Tree.copy returns a modifiable copy.
     """
 
     def __init__(self,
@@ -28,9 +46,18 @@ class TreeBDFT:
 
         if type(transitions) in (set, list):
             self.transitions = self._delta_dict(transitions)
-        elif type(transitions) == dict:
+        elif isinstance(transitions, dict):
             self.transitions = transitions
 
+        self._fragments = TreePool()
+        if isinstance(self.transitions, RuleTable):
+            # plans for schematic transitions are compiled on first use
+            self._plans = LazyTable({}, self._plan)
+            self._programs = LazyTable({}, self._program)
+        else:
+            self._plans = {key: self._plan(key) for key in self.transitions}
+            self._programs = {key: self._program(key) for key in self._plans}
+
     def __str__(self):
         return ("<TreeBDFT>\n"
                 f"states: {self.states}\n"
@@ -38,51 +65,323 @@ class TreeBDFT:
                 f"finals: {self.finals}\n"
                 f"transitions:\n{pformat(self.transitions)}")
 
+    def _plan(self, key):
+        """Return the next state and compiled output template of the
+        transition with the given key."""
+        nextstate, varleaftree = self.transitions[key]
+        return nextstate, self._compile_template(varleaftree, self._fragments)
+
+    def _program(self, key):
+        """Return the next state, event program and shortcut reference of
+        the transition with the given key, see _process_events."""
+        nextstate, plan = self._plans[key]
+        program = self._event_program(plan)
+        if len(plan) == 1 and plan[0][0] == _VAR:
+            shortcut = plan[0][1]
+        elif all(op != _VAR for op, arg, n in plan):
+            shortcut = (program, ())
+        else:
+            shortcut = None
+        return nextstate, program, shortcut
+
     def _delta_dict(self, transitions):
         """Convert transition list of form (state_list, symbol, nextstate)
         to dictionary of form {(state_list, symbol): nextstate}."""
         return {(tuple(statelist), symbol): (nextstate, varleaftree)
                 for (statelist, symbol, nextstate, varleaftree) in transitions}
 
+    def domain(self):
+        """Return a TreeBDFA accepting exactly the trees that the
+        transducer transforms."""
+        return TreeBDFA(self.states, self.alph, self.finals,
+                        {key: nextstate
+                         for key, (nextstate, varleaftree) in self.transitions.items()})
+
+    @staticmethod
+    def _compile_template(varleaftree, fragments):
+        """Compile a variably leafed tree into a substitution plan, a tuple of
+        (operation, argument, arity) triples listed in post-order:
+        (_VAR, i, 0) stands for the output tree of the i-th child,
+        (_CONST, tree, 0) for a variable-free subtree, interned in the
+        fragments pool and reused as is, and (_NODE, label, n) for a new
+        node whose children are the last n results. Only the nodes above
+        variables need to be rebuilt when the plan is applied."""
+        has_var = {}
+        for node in varleaftree.postorder():
+            has_var[id(node)] = (isinstance(node.data, int)
+                                 or any(has_var[id(c)] for c in node.children))
+
+        plan = []
+        stack = [(varleaftree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if isinstance(node.data, int):
+                plan.append((_VAR, node.data, 0))
+            elif not has_var[id(node)]:
+                plan.append((_CONST, fragments.intern(node), 0))
+            elif expanded:
+                plan.append((_NODE, node.data, len(node.children)))
+            else:
+                stack.append((node, True))
+                stack.extend((c, False) for c in reversed(node.children))
+        return tuple(plan)
+
     @staticmethod
-    def _sub_variables(varleaftree, trees):
-        """Replace variables in variably leafed tree with trees with the
+    def _sub_variables(plan, trees):
+        """Replace variables in a compiled variably leafed tree with the
         output subtrees of a node's children."""
-        if isinstance(varleaftree.data, int):
-            return trees[varleaftree.data]
-        elif varleaftree.depth() == 0:
-            return varleaftree
+        if len(plan) == 1:
+            op, arg, n = plan[0]
+            return trees[arg] if op == _VAR else arg
+        outputs = []
+        for op, arg, n in plan:
+            if op == _VAR:
+                outputs.append(trees[arg])
+            elif op == _CONST:
+                outputs.append(arg)
+            else:
+                children = outputs[-n:]
+                del outputs[-n:]
+                outputs.append(Tree(arg, children))
+        return outputs.pop()
+
+    @staticmethod
+    def _event_program(plan):
+        """Convert a substitution plan into the sequence of events it writes,
+        in output order: ('open', label), ('leaf', label) and
+        ('close', label) as produced by treeio.tree_events, (_VAR, i) for
+        the output of the i-th child and (_CONST, tree) for a constant
+        fragment."""
+        programs = []
+        for op, arg, n in plan:
+            if op == _VAR or op == _CONST:
+                programs.append([(op, arg)])
+            elif n == 0:
+                programs.append([('leaf', arg)])
+            else:
+                children = programs[-n:]
+                del programs[-n:]
+                program = [('open', arg)]
+                for child in children:
+                    program.extend(child)
+                program.append(('close', arg))
+                programs.append(program)
+        return tuple(programs.pop())
+
+    def _process_events(self, intree):
+        """Return the current state and a reference to the output of the
+        given input tree, given as a Tree or a TreeArena, if any, else None.
+
+        The reference is a pair of the event program of the transition taken
+        at the root and the references of the children, so no output tree
+        is built and the outputs of children are never copied. Like
+        _sub_variables, a template that is a single variable reuses the
+        reference of that child, and a variable-free template the same
+        reference every time."""
+        programs = self._programs
+        states = []
+        refs = []
+        if isinstance(intree, TreeArena):
+            labels = intree.labels
+            arity = intree.arity
+            symbols = intree.symbols
+            nodes = ((arity[i], symbols[labels[i]])
+                     for i in range(len(labels) - 1, -1, -1))
+            reverse = True
         else:
-            return Tree(varleaftree.data,
-                        [TreeBDFT._sub_variables(c, trees)
-                         for c in varleaftree.children])
+            nodes = ((len(node.children), node.data) for node in intree.postorder())
+            reverse = False
+        for n, symbol in nodes:
+            if n == 0:
+                child_states = ()
+                child_refs = ()
+            else:
+                if reverse:
+                    child_states = tuple(states[:-n - 1:-1])
+                    child_refs = tuple(refs[:-n - 1:-1])
+                else:
+                    child_states = tuple(states[-n:])
+                    child_refs = tuple(refs[-n:])
+                del states[-n:]
+                del refs[-n:]
+            try:
+                next_state, program, shortcut = programs[(child_states, symbol)]
+            except KeyError:
+                next_state, ref = None, None
+            else:
+                if shortcut is None:
+                    ref = (program, child_refs)
+                elif type(shortcut) is int:
+                    ref = child_refs[shortcut]
+                else:
+                    ref = shortcut
+            states.append(next_state)
+            refs.append(ref)
+        return states.pop(), refs.pop()
+
+    @staticmethod
+    def _events(ref):
+        """Yield the events of the output tree a reference stands for,
+        keeping only the path from the root to the current node on the
+        stack."""
+        stack = [(ref[0], ref[1], 0)]
+        while stack:
+            program, child_refs, i = stack.pop()
+            if i == len(program):
+                continue
+            stack.append((program, child_refs, i + 1))
+            op, arg = program[i]
+            if op == _VAR:
+                child_program, grandchild_refs = child_refs[arg]
+                stack.append((child_program, grandchild_refs, 0))
+            elif op == _CONST:
+                yield from tree_events(arg)
+            else:
+                yield op, arg
+
+    def transform_events(self, intree):
+        """Return an iterator over the events of the output tree for an input
+        tree, as produced by treeio.tree_events, if the resulting state is a
+        valid final state, else None. Output trees are never built: the
+        events are produced directly from the compiled templates."""
+        state, ref = self._process_events(intree)
+        if state not in self.finals:
+            return None
+        return self._events(ref)
 
-    def _process(self, intree, debug=False):
+    def transform_to(self, intree, sink, fmt='bracket'):
+        """Write the output tree for an input tree to a text file-like
+        object in the given format of treeio, or empty brackets, which
+        treeio.read_trees reads back as None, if the resulting state is not
+        a valid final state. Return True if an output tree was written,
+        False otherwise."""
+        events = self.transform_events(intree)
+        if events is None:
+            sink.write(_EMPTY[fmt])
+            return False
+        write_events(events, sink, fmt)
+        return True
+
+    def _process(self, intree, debug=False, memo=None, tracer=None):
         """Return the current state and output tree for the given input tree,
-        if any, else None."""
-        if intree.depth == 0:
-            child_states = ()
-            child_trees = ()
+        if any, else None.
+
+        Nodes are visited in post-order with the (state, output) pairs of
+        processed children kept on an explicit stack. Shared trees, or any
+        tree when a memo dictionary is given, are processed with
+        memoization instead. Transition lookups are reported to the tracer,
+        if any, see tracing; debug=True traces them with a PrintTracer."""
+        if debug and tracer is None:
+            tracer = PrintTracer()
+        plans = traced(self._plans, tracer)
+        if isinstance(intree, TreeArena):
+            result = self._process_arena(intree, plans)
+        elif memo is not None or isinstance(intree, SharedTree):
+            result = self._process_shared(intree, memo, plans)
         else:
-            child_states_trees = [self._process(c, debug=debug) for c in intree.children]
+            states = []
+            trees = []
+            for node in intree.postorder():
+                n = len(node.children)
+                if n == 0:
+                    child_states = ()
+                    child_trees = ()
+                else:
+                    child_states = tuple(states[-n:])
+                    child_trees = tuple(trees[-n:])
+                    del states[-n:]
+                    del trees[-n:]
+
+                try:
+                    next_state, plan = plans[(child_states, node.data)]
+                except KeyError:
+                    next_state, outtree = None, None
+                else:
+                    outtree = self._sub_variables(plan, child_trees)
+                states.append(next_state)
+                trees.append(outtree)
+            result = states.pop(), trees.pop()
+        finish(plans, tracer)
+        return result
+
+    def _process_shared(self, intree, memo=None, plans=None):
+        """Return the current state and output tree for the given input tree,
+        if any, else None, processing each distinct node object only once.
+
+        Results are recorded in memo, a dictionary keyed by node id, which
+        may be reused across calls as long as the nodes it refers to are
+        kept alive and unmodified, e.g. for trees from the same TreePool.
+        Output trees of shared input nodes are shared as well."""
+        if memo is None:
+            memo = {}
+        if plans is None:
+            plans = self._plans
+        for node in intree.dag_postorder(memo):
+            child_states_trees = [memo[id(c)] for c in node.children]
             child_states = tuple(state for state, tree in child_states_trees)
             child_trees = tuple(tree for state, tree in child_states_trees)
 
-        if debug:
-            print(child_states, intree.data)
+            try:
+                next_state, plan = plans[(child_states, node.data)]
+            except KeyError:
+                memo[id(node)] = (None, None)
+            else:
+                memo[id(node)] = (next_state,
+                                  self._sub_variables(plan, child_trees))
+        return memo[id(intree)]
 
-        try:
-            next_state, varleaftree = self.transitions[(child_states, intree.data)]
-        except KeyError:
-            return None, None
+    def _process_arena(self, arena, plans=None):
+        """Return the current state and output tree for the input tree stored
+        in the given arena, if any, else None.
 
-        outtree = self._sub_variables(varleaftree, child_trees)
-        return next_state, outtree
+        The arena is scanned in reverse preorder, so the results for the
+        children of a node are the top entries of the stacks in reverse
+        order."""
+        if plans is None:
+            plans = self._plans
+        labels = arena.labels
+        arity = arena.arity
+        symbols = arena.symbols
+        states = []
+        trees = []
+        for i in range(len(labels) - 1, -1, -1):
+            n = arity[i]
+            if n == 0:
+                child_states = ()
+                child_trees = ()
+            else:
+                child_states = tuple(states[:-n - 1:-1])
+                child_trees = tuple(trees[:-n - 1:-1])
+                del states[-n:]
+                del trees[-n:]
+            symbol = symbols[labels[i]]
 
-    def transform(self, intree, debug=False):
-        """Return the resulting value of processing an input tree if the
-        resulting state is a valid final state, else None."""
-        state, outtree = self._process(intree, debug)
+            try:
+                next_state, plan = plans[(child_states, symbol)]
+            except KeyError:
+                next_state, outtree = None, None
+            else:
+                outtree = self._sub_variables(plan, child_trees)
+            states.append(next_state)
+            trees.append(outtree)
+        return states.pop(), trees.pop()
+
+    def transform(self, intree, debug=False, memo=None, tracer=None):
+        """Return the resulting value of processing an input tree, given as a
+        Tree or a TreeArena, if the resulting state is a valid final state,
+        else None. See _process_shared for the optional memo dictionary,
+        and _process for the tracer.
+
+        The output tree shares the variable-free parts of the templates with
+        other output trees, as SharedTrees that must not be modified; use
+        its copy method to get a tree that can be modified."""
+        if tracer is None and not debug:
+            state, outtree = self._process(intree, memo=memo)
+        else:
+            if tracer is None:
+                tracer = PrintTracer()
+            with tracer.phase('transform'):
+                state, outtree = self._process(intree, memo=memo, tracer=tracer)
         return outtree if state in self.finals else None
 
 
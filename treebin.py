@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact binary corpus format with memory-mapped random access.
+
+File layout, all integers little-endian:
+
+  header: magic b'TREEBIN1', number of trees, offset of the label table and
+    offset of the index, as unsigned 64-bit integers
+  records: one per tree, holding the number of nodes n and the size in
+    bytes of the label block as varints, followed by the label block, the
+    varint label IDs of the nodes in preorder, and the arity block, the
+    varint arities of the nodes in preorder
+  label table: the number of labels, then the length in bytes and UTF-8
+    encoding of every label, as varints and bytes
+  index: the offset of every record, and the end of the last one, as
+    unsigned 64-bit integers
+
+Varints store 7 bits per byte, least significant first, with the high bit
+set on every byte but the last. Label IDs and arities below 128 take one
+byte each, and a block made only of such values is used directly from the
+mapped file, without parsing or copying.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+from treearena import TreeArena
+
+MAGIC = b'TREEBIN1'
+_HEADER = struct.Struct('<8sQQQ')
+
+
+def _encode_varints(values, out):
+    """Append the varint encodings of non-negative integers to a
+    bytearray."""
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7f) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def _decode_varints(buf, pos, count):
+    """Return an array of count varints decoded from buf starting at pos,
+    and the position after them."""
+    values = array('i')
+    for _ in range(count):
+        v = 0
+        shift = 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            v |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        values.append(v)
+    return values, pos
+
+
+def _decode_block(block, count):
+    """Return an array of the count varints stored in a block of bytes, a
+    memoryview."""
+    if len(block) == count:
+        # every value fits in a single byte: the block is the array
+        return block
+    values, _ = _decode_varints(block, 0, count)
+    return values
+
+
+def write_binary(trees, path):
+    """Write trees, given as Trees or TreeArenas, to a binary corpus file.
+    Labels must be strings. Return the number of trees written."""
+    symbols = []
+    symbol_ids = {}
+    offsets = array('Q')
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, 0, 0, 0))
+        pos = _HEADER.size
+        for tree in trees:
+            if not isinstance(tree, TreeArena):
+                tree = TreeArena.from_tree(tree)
+            ids = []
+            for label in tree.symbols:
+                label_id = symbol_ids.get(label)
+                if label_id is None:
+                    if not isinstance(label, str):
+                        raise TypeError(f"Labels must be strings, got {label!r}")
+                    label_id = symbol_ids[label] = len(symbols)
+                    symbols.append(label)
+                ids.append(label_id)
+            label_block = bytearray()
+            _encode_varints((ids[i] for i in tree.labels), label_block)
+            record = bytearray()
+            _encode_varints([len(tree), len(label_block)], record)
+            record += label_block
+            _encode_varints(tree.arity, record)
+            offsets.append(pos)
+            f.write(record)
+            pos += len(record)
+        offsets.append(pos)
+
+        labels_offset = pos
+        table = bytearray()
+        _encode_varints([len(symbols)], table)
+        for label in symbols:
+            encoded = label.encode('utf-8')
+            _encode_varints([len(encoded)], table)
+            table += encoded
+        f.write(table)
+        pos += len(table)
+        # align the index for zero-copy access
+        padding = -pos % 8
+        f.write(b'\0' * padding)
+        index_offset = pos + padding
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        f.write(offsets.tobytes())
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(offsets) - 1, labels_offset, index_offset))
+    return len(offsets) - 1
+
+
+class BinaryCorpus:
+    """Read-only, memory-mapped binary corpus, as written by write_binary.
+
+    Trees are decoded on demand into TreeArenas sharing one label table, so
+    only the records actually accessed are read from disk. The arrays of
+    arenas whose label IDs or arities all fit in one byte are views of the
+    memory map rather than copies, so the file stays mapped as long as
+    such arenas are alive, even after close. Can be used as a context
+    manager to close the file when done.
+
+    Parameters
+    ----------
+    path: path of the corpus file
+    """
+
+    def __init__(self, path):
+        self._index = None
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if len(self._map) < _HEADER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a binary tree corpus: {path}")
+        _, n, labels_offset, index_offset = _HEADER.unpack_from(self._map, 0)
+        self._n = n
+        index = self._view[index_offset:index_offset + 8 * (n + 1)]
+        if sys.byteorder == 'little':
+            self._index = index.cast('Q')
+        else:
+            self._index = array('Q', index)
+            self._index.byteswap()
+
+        (count,), pos = _decode_varints(self._map, labels_offset, 1)
+        self.symbols = []
+        for _ in range(count):
+            (length,), pos = _decode_varints(self._map, pos, 1)
+            self.symbols.append(bytes(self._view[pos:pos + length]).decode('utf-8'))
+            pos += length
+        self.symbol_ids = {s: i for i, s in enumerate(self.symbols)}
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        """Return the i-th tree of the corpus as a TreeArena."""
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("corpus index out of range")
+        start = self._index[i]
+        end = self._index[i + 1]
+        view = self._view
+        (n, label_bytes), pos = _decode_varints(view, start, 2)
+        labels = _decode_block(view[pos:pos + label_bytes], n)
+        arity = _decode_block(view[pos + label_bytes:end], n)
+        return TreeArena.from_preorder(labels, arity, self.symbols, self.symbol_ids)
+
+    def __iter__(self):
+        """Iterate over the trees of the corpus as TreeArenas."""
+        for i in range(self._n):
+            yield self[i]
+
+    def tree(self, i):
+        """Return the i-th tree of the corpus as a Tree."""
+        return self[i].to_tree()
+
+    def trees(self):
+        """Iterate over the trees of the corpus as Trees."""
+        for arena in self:
+            yield arena.to_tree()
+
+    def close(self):
+        """Release the memory map and close the file. The map is unmapped
+        when the last arena viewing it is garbage collected, if any."""
+        if self._map is not None:
+            if isinstance(self._index, memoryview):
+                self._index.release()
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                pass    # arenas still view the map
+            self._file.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test():
+    import os
+    import tempfile
+    import time
+    from grammars import gb_grammar
+    from bench import workloads
+    from treeio import write_trees, read_trees
+
+    trees = workloads(10)['random_gb']
+    with tempfile.TemporaryDirectory() as tmp:
+        text = os.path.join(tmp, 'corpus.txt')
+        binary = os.path.join(tmp, 'corpus.bin')
+        write_trees(trees, text)
+        write_binary(trees, binary)
+        print(f"{len(trees)} trees: {os.path.getsize(text)} bytes as text, "
+              f"{os.path.getsize(binary)} bytes as binary")
+
+        start = time.perf_counter()
+        text_results = [gb_grammar.recognizes(t) for t in read_trees(text)]
+        print(f"text: {time.perf_counter() - start:.3f}s")
+        with BinaryCorpus(binary) as corpus:
+            start = time.perf_counter()
+            binary_results = [gb_grammar.recognizes(t) for t in corpus]
+            print(f"binary: {time.perf_counter() - start:.3f}s")
+            print(f"same results: {text_results == binary_results}")
+            print(f"tree 42: {corpus.tree(42)}")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bottom-up nondeterministic finite-state acceptors for trees, run on sets of
+states and determinized on the fly.
+"""
+
+from itertools import product
+from pprint import pformat
+
+from treebdfa import TreeBDFA
+from treearena import TreeArena
+
+
+class TreeBNFA:
+    """Bottom-up nondeterministic finite-state acceptor for trees.
+
+    Every transition is kept, so a node may reach several states. Trees are
+    evaluated with the set of states reachable at each node, which is
+    interned as an integer ID; the subset reached from given child subsets
+    and symbol is computed on first use and cached, so a run over
+    configurations seen before costs one dictionary lookup per node, as
+    for a TreeBDFA.
+
+    Parameters
+    ----------
+    states: set of states
+    alphabet: set of symbols
+    finals: set of final states
+    transitions: set or list of tuples (children_state_list, parent_symbol,
+      parent_state), or dictionary of the form
+      {(children_state_list, parent_symbol): set_of_parent_states}
+    """
+
+    def __init__(self, states, alphabet, finals, transitions):
+        self.states = set(states)
+        self.alphabet = set(alphabet)
+        self.finals = set(finals)
+
+        if isinstance(transitions, dict):
+            self.transitions = {(tuple(statelist), symbol): frozenset(nextstates)
+                                for (statelist, symbol), nextstates in transitions.items()}
+        else:
+            self.transitions = self._delta_dict(transitions)
+
+        # (arity, symbol) -> transitions with that symbol, as
+        # (children_state_list, parent_states) pairs
+        self._rules = {}
+        for (statelist, symbol), nextstates in self.transitions.items():
+            self._rules.setdefault((len(statelist), symbol), []).append(
+                (statelist, nextstates))
+
+        # interned subsets of states; ID 0 is the empty subset
+        self.subsets = [frozenset()]
+        self._subset_ids = {frozenset(): 0}
+        self._accepting = [False]
+        # cache of {(children_subset_id_list, parent_symbol): subset_id}
+        self.cache = {}
+
+    def __str__(self):
+        return ("<TreeBNFA>\n"
+                f"states: {self.states}\n"
+                f"alphabet: {self.alphabet}\n"
+                f"finals: {self.finals}\n"
+                f"transitions:\n{pformat(self.transitions)}")
+
+    def _delta_dict(self, transitions):
+        """Convert transition list of form (state_list, symbol, nextstate)
+        to dictionary of form {(state_list, symbol): set_of_nextstates}."""
+        delta = {}
+        for (statelist, symbol, nextstate) in transitions:
+            delta.setdefault((tuple(statelist), symbol), set()).add(nextstate)
+        return {key: frozenset(nextstates) for key, nextstates in delta.items()}
+
+    def is_deterministic(self):
+        """Return True if no two transitions share children states and
+        symbol, False otherwise."""
+        return all(len(nextstates) == 1 for nextstates in self.transitions.values())
+
+    def _intern(self, subset):
+        """Return the ID of a subset of states, interning it if needed."""
+        subset_id = self._subset_ids.get(subset)
+        if subset_id is None:
+            subset_id = self._subset_ids[subset] = len(self.subsets)
+            self.subsets.append(subset)
+            self._accepting.append(not self.finals.isdisjoint(subset))
+        return subset_id
+
+    def _step(self, idlist, symbol):
+        """Compute, cache and return the ID of the subset of states reached
+        from children with the given subset IDs and symbol."""
+        subsets = [self.subsets[i] for i in idlist]
+        reached = set()
+        for statelist, nextstates in self._rules.get((len(idlist), symbol), ()):
+            if all(q in subset for q, subset in zip(statelist, subsets)):
+                reached |= nextstates
+        subset_id = self._intern(frozenset(reached))
+        self.cache[(idlist, symbol)] = subset_id
+        return subset_id
+
+    def _process(self, subtree):
+        """Return the ID of the subset of states reached by processing the
+        given tree, given as a Tree or a TreeArena, 0 if it is empty.
+
+        Like TreeBDFA._process, processing stops at the first node reaching
+        the empty subset."""
+        cache = self.cache
+        step = self._step
+        ids = []
+        if isinstance(subtree, TreeArena):
+            labels = subtree.labels
+            arity = subtree.arity
+            symbols = subtree.symbols
+            for i in range(len(labels) - 1, -1, -1):
+                n = arity[i]
+                if n == 0:
+                    idlist = ()
+                else:
+                    # reverse preorder, see TreeBDFA._process_arena
+                    idlist = tuple(ids[:-n - 1:-1])
+                    del ids[-n:]
+                key = (idlist, symbols[labels[i]])
+                subset_id = cache.get(key)
+                if subset_id is None:
+                    subset_id = step(*key)
+                if subset_id == 0:
+                    return 0
+                ids.append(subset_id)
+            return ids.pop()
+        for node in subtree.postorder():
+            n = len(node.children)
+            if n == 0:
+                idlist = ()
+            else:
+                idlist = tuple(ids[-n:])
+                del ids[-n:]
+            key = (idlist, node.data)
+            subset_id = cache.get(key)
+            if subset_id is None:
+                subset_id = step(*key)
+            if subset_id == 0:
+                return 0
+            ids.append(subset_id)
+        return ids.pop()
+
+    def run(self, tree):
+        """Return the set of states reachable at the root of a tree, given as
+        a Tree or a TreeArena."""
+        return self.subsets[self._process(tree)]
+
+    def recognizes(self, tree):
+        """Processes a tree, given as a Tree or a TreeArena, and returns True
+        if some final state is reachable, False otherwise."""
+        return self._accepting[self._process(tree)]
+
+    def determinize(self, max_states=None):
+        """Return an equivalent TreeBDFA by the subset construction, built
+        eagerly over the reachable non-empty subsets of states, which are
+        the states of the TreeBDFA. Raise ValueError if there are more than
+        max_states of them.
+
+        Subsets are processed from a worklist as they are found: the child
+        subset tuples tried for a new subset are those holding it, with the
+        subsets processed before it at the positions left of its first
+        occurrence, so every tuple is tried exactly once. Tuples with a
+        subset that no transition can move on at its position are skipped,
+        as they reach the empty subset."""
+        processed = []      # reachable subset IDs whose tuples were tried
+        pending = []        # reachable subset IDs not processed yet
+        seen = {0}
+        transitions = {}
+        subsets = self.subsets
+        # required[(n, symbol)][j]: the states that transitions with that
+        # arity and symbol expect at child position j
+        required = {(n, symbol): [{statelist[j] for statelist, _ in rules}
+                                  for j in range(n)]
+                    for (n, symbol), rules in self._rules.items()}
+
+        def reach(idlist, symbol):
+            subset_id = self.cache.get((idlist, symbol))
+            if subset_id is None:
+                subset_id = self._step(idlist, symbol)
+            transitions[(idlist, symbol)] = subset_id
+            if subset_id not in seen:
+                seen.add(subset_id)
+                pending.append(subset_id)
+                if max_states is not None and len(seen) - 1 > max_states:
+                    raise ValueError("The determinized automaton has more "
+                                     f"than {max_states} states.")
+
+        for (n, symbol) in self._rules:
+            if n == 0:
+                reach((), symbol)
+        while pending:
+            new = pending.pop()
+            before = list(processed)
+            processed.append(new)
+            for (n, symbol), expected in required.items():
+                for j in range(n):
+                    if expected[j].isdisjoint(subsets[new]):
+                        continue
+                    positions = [[i for i in (before if k < j else processed)
+                                  if not expected[k].isdisjoint(subsets[i])]
+                                 for k in range(n)]
+                    positions[j] = [new]
+                    for idlist in product(*positions):
+                        reach(idlist, symbol)
+        return TreeBDFA({subsets[i] for i in processed},
+                        self.alphabet,
+                        {subsets[i] for i in processed if self._accepting[i]},
+                        {(tuple(subsets[i] for i in idlist), symbol): subsets[j]
+                         for (idlist, symbol), j in transitions.items() if j != 0})
+
+
+def test():
+    from tree import Tree
+    from sampling import TreeSampler
+    import transducer_v2
+
+    # trees over f/2, a and b with a b leaf at depth 2 below the root, found
+    # by guessing the path to it
+    nfa = TreeBNFA(['q', 'q0', 'q1', 'q2'], ['f', 'a', 'b'], ['q2'],
+                   [([], 'a', 'q'), ([], 'b', 'q'), ([], 'b', 'q0'),
+                    (['q', 'q'], 'f', 'q'),
+                    (['q0', 'q'], 'f', 'q1'), (['q', 'q0'], 'f', 'q1'),
+                    (['q1', 'q'], 'f', 'q2'), (['q', 'q1'], 'f', 'q2')])
+    t = Tree.from_list(['f', ['f', 'a', 'b'], 'a'])
+    print(t, nfa.run(t), nfa.recognizes(t))
+    dfa = nfa.determinize()
+    print(f"determinized: {len(dfa.states)} states, "
+          f"{len(dfa.transitions)} transitions")
+    sampler = TreeSampler(dfa, seed=637)
+    print(f"accepted trees of sizes 1-9: {[sampler.count(n) for n in range(1, 10)]}")
+
+    # the domain of gb_to_min, keeping the transitions overridden in the
+    # dictionary of the transducer
+    domain = TreeBNFA(transducer_v2.states, transducer_v2.alph, transducer_v2.finals,
+                      [(q, x, r) for q, x, r, out in transducer_v2.trans])
+    print(f"gb_to_min domain: deterministic: {domain.is_deterministic()}, "
+          f"{len(domain.determinize(max_states=100).states)} subset states")
+
+
+if __name__ == "__main__":
+    test()
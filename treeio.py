@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Streaming reading and writing of bracketed treebank files.
+
+Two formats are supported:
+
+  bracket: the format of Tree.__str__, e.g. S[a, b]
+  penn: Penn Treebank style s-expressions, e.g. (S (a) (b)) or (S a b)
+
+Files may hold any number of trees separated by whitespace. A missing tree,
+such as the output of a transducer for a rejected input, is written as
+empty brackets, [] or (), and read back as None. Trees are read
+in fixed-size chunks and yielded one at a time, so memory use is bounded by
+the largest tree rather than by the size of the file. Labels are read as
+strings and may not contain whitespace or the delimiters of their format.
+"""
+
+import io
+import re
+
+from tree import Tree
+
+_TOKENS = {
+    'bracket': re.compile(r"\[\]|\[|\]|,|[^\[\],\s]+"),
+    'penn': re.compile(r"\(|\)|[^()\s]+"),
+}
+_DELIMITERS = {
+    'bracket': "[],",
+    'penn': "()",
+}
+# text standing for a missing tree
+_EMPTY = {
+    'bracket': "[]",
+    'penn': "()",
+}
+
+
+def _open(source, mode):
+    """Return a file object for a path or file-like object and whether it
+    has to be closed by the caller."""
+    if isinstance(source, str):
+        return open(source, mode, encoding='utf-8'), True
+    return source, False
+
+
+def _tokens(f, fmt, chunk_size):
+    """Yield the tokens of a file, reading it in chunks. A label or '['
+    touching the end of a chunk is held back until the next chunk, since it
+    may continue there."""
+    pattern = _TOKENS[fmt]
+    delimiters = _DELIMITERS[fmt]
+    carry = ''
+    while True:
+        chunk = f.read(chunk_size)
+        text = carry + chunk
+        tokens = pattern.findall(text)
+        carry = ''
+        if chunk and tokens and (text[-1] == '[' or not text[-1].isspace()
+                                 and text[-1] not in delimiters):
+            carry = tokens.pop()
+        yield from tokens
+        if not chunk:
+            return
+
+
+def _detect(f, chunk_size):
+    """Return the format of a file and a file object reading it from the
+    start, given that f may not be seekable."""
+    head = f.read(chunk_size)
+    while head.strip() == '' and head:
+        more = f.read(chunk_size)
+        if not more:
+            break
+        head += more
+    fmt = 'penn' if head.lstrip().startswith('(') else 'bracket'
+    return fmt, _Prefixed(head, f)
+
+
+class _Prefixed:
+    """File-like object reading a string before the rest of a file."""
+
+    def __init__(self, head, f):
+        self.head = head
+        self.f = f
+
+    def read(self, size):
+        if self.head:
+            text, self.head = self.head[:size], self.head[size:]
+            return text
+        return self.f.read(size)
+
+
+def _parse_bracket(tokens):
+    stack = []
+    pending = None
+    for token in tokens:
+        if token == '[]':
+            if stack:
+                raise ValueError("Unexpected '[]' inside a tree.")
+            if pending is not None:
+                yield Tree(pending)
+                pending = None
+            yield None
+            continue
+        if token == '[':
+            if pending is None:
+                raise ValueError("Expected a label before '['.")
+            stack.append(Tree(pending))
+            pending = None
+            continue
+        if pending is not None:
+            leaf = Tree(pending)
+            pending = None
+            if stack:
+                stack[-1].children.append(leaf)
+            else:
+                yield leaf
+        if token == ',':
+            if not stack:
+                raise ValueError("Unexpected ',' outside of brackets.")
+        elif token == ']':
+            if not stack:
+                raise ValueError("Unbalanced ']'.")
+            node = stack.pop()
+            if stack:
+                stack[-1].children.append(node)
+            else:
+                yield node
+        else:
+            pending = token
+    if stack:
+        raise ValueError("Unexpected end of input inside a tree.")
+    if pending is not None:
+        yield Tree(pending)
+
+
+def _parse_penn(tokens):
+    # stack of [label, children] for the open brackets
+    stack = []
+    for token in tokens:
+        if token == '(':
+            stack.append([None, []])
+        elif token == ')':
+            if not stack:
+                raise ValueError("Unbalanced ')'.")
+            label, children = stack.pop()
+            if label is None and not children and not stack:
+                yield None
+                continue
+            if label is None:
+                # unlabeled outer brackets, as used in the Penn Treebank
+                if len(children) != 1:
+                    raise ValueError("Unlabeled brackets must hold one tree.")
+                node = children[0]
+            else:
+                node = Tree(label, children)
+            if stack:
+                stack[-1][1].append(node)
+            else:
+                yield node
+        elif not stack:
+            yield Tree(token)
+        elif stack[-1][0] is None and not stack[-1][1]:
+            stack[-1][0] = token
+        else:
+            stack[-1][1].append(Tree(token))
+    if stack:
+        raise ValueError("Unexpected end of input inside a tree.")
+
+
+def read_trees(source, fmt='auto', chunk_size=1 << 16):
+    """Lazily yield the trees stored in a file.
+
+    source is a path or a text file-like object, fmt one of 'bracket',
+    'penn' or 'auto', in which case the format is guessed from the first
+    non-blank character. The file is read chunk_size characters at a time.
+    Empty brackets, [] or (), are read as None.
+    """
+    f, close = _open(source, 'r')
+    try:
+        if fmt == 'auto':
+            fmt, f_in = _detect(f, chunk_size)
+        else:
+            f_in = f
+        tokens = _tokens(f_in, fmt, chunk_size)
+        if fmt == 'bracket':
+            yield from _parse_bracket(tokens)
+        elif fmt == 'penn':
+            yield from _parse_penn(tokens)
+        else:
+            raise ValueError(f"Unknown tree format: {fmt}")
+    finally:
+        if close:
+            f.close()
+
+
+def parse_trees(text, fmt='auto'):
+    """Return the list of trees stored in a string."""
+    return list(read_trees(io.StringIO(text), fmt))
+
+
+def tree_events(tree):
+    """Yield the events of a depth-first walk of a tree: ('open', label)
+    and ('close', label) around the children of an inner node, and
+    ('leaf', label) for a leaf."""
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield ('close', node.data)
+        elif len(node.children) == 0:
+            yield ('leaf', node.data)
+        else:
+            yield ('open', node.data)
+            stack.append((node, True))
+            stack.extend((c, False) for c in reversed(node.children))
+
+
+def write_events(events, sink, fmt='bracket'):
+    """Write the tree described by a sequence of events, as produced by
+    tree_events, to a text file-like object in the given format."""
+    write = sink.write
+    depth = 0
+    need_sep = False  # whether the next sibling needs a separator
+    if fmt == 'bracket':
+        for kind, label in events:
+            if kind == 'close':
+                write("]")
+                depth -= 1
+                need_sep = depth > 0
+                continue
+            if need_sep:
+                write(", ")
+            if kind == 'open':
+                write(f"{label}[")
+                depth += 1
+                need_sep = False
+            else:
+                write(str(label))
+                need_sep = depth > 0
+    elif fmt == 'penn':
+        for kind, label in events:
+            if kind == 'close':
+                write(")")
+                depth -= 1
+                continue
+            if depth > 0:
+                write(" ")
+            if kind == 'open':
+                write(f"({label}")
+                depth += 1
+            else:
+                write(f"({label})")
+    else:
+        raise ValueError(f"Unknown tree format: {fmt}")
+
+
+def write_trees(trees, sink, fmt='bracket'):
+    """Write trees one per line to a path or text file-like object, without
+    holding more than one tree in memory. None is written as empty
+    brackets, which read_trees reads back as None. Return the number of
+    trees written."""
+    f, close = _open(sink, 'w')
+    n = 0
+    try:
+        for tree in trees:
+            if tree is None:
+                f.write(_EMPTY[fmt])
+            else:
+                write_events(tree_events(tree), f, fmt)
+            f.write("\n")
+            n += 1
+    finally:
+        if close:
+            f.close()
+    return n
+
+
+def test():
+    from grammars import gb_grammar
+    import test_trees as tts
+
+    text = io.StringIO()
+    write_trees([tts.gb_np_n, tts.gb_np_d_n, tts.gb_simple_trans_clause], text, 'penn')
+    print(text.getvalue())
+    for t in read_trees(io.StringIO(text.getvalue()), chunk_size=7):
+        print(t, gb_grammar.recognizes(t))
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Weighted TreeBDFAs, scoring trees in a semiring, one at a time or in
+batches with NumPy.
+"""
+
+import math
+
+import numpy as np
+
+from treearena import TreeArena
+
+
+def _logaddexp(x, y):
+    """Return log(exp(x) + exp(y)) without leaving log space."""
+    if x == -math.inf:
+        return y
+    if y == -math.inf:
+        return x
+    return max(x, y) + math.log1p(math.exp(-abs(x - y)))
+
+
+def _log(w):
+    return math.log(w) if w > 0 else -math.inf
+
+
+class Semiring:
+    """Semiring of weights.
+
+    The weight of a tree is the product (times) of the weights of the
+    transitions of its run and of its final state, and the weight of a set
+    of trees the sum (plus) of their weights. Weights are also mapped to
+    log space, where times is addition, for batched scoring.
+
+    Parameters
+    ----------
+    name: name of the semiring
+    zero: identity of plus, the weight of rejected trees
+    one: identity of times, the default weight of transitions
+    plus: function adding two weights
+    times: function multiplying two weights
+    to_log: function from a weight to its logarithm in log space
+    from_log: inverse of to_log
+    """
+
+    def __init__(self, name, zero, one, plus, times, to_log, from_log):
+        self.name = name
+        self.zero = zero
+        self.one = one
+        self.plus = plus
+        self.times = times
+        self.to_log = to_log
+        self.from_log = from_log
+
+    def __str__(self):
+        return f"<Semiring {self.name}>"
+
+
+def _identity(w):
+    return w
+
+
+# probabilities, multiplied along a run and added across trees
+probability_semiring = Semiring('probability', 0.0, 1.0,
+                                lambda x, y: x + y, lambda x, y: x * y,
+                                _log, math.exp)
+
+# log probabilities, which do not underflow on large trees
+log_semiring = Semiring('log', -math.inf, 0.0,
+                        _logaddexp, lambda x, y: x + y,
+                        _identity, _identity)
+
+# log probabilities, where the weight of a set of trees is that of its best
+# tree (Viterbi)
+tropical_semiring = Semiring('tropical', -math.inf, 0.0,
+                             max, lambda x, y: x + y,
+                             _identity, _identity)
+
+# natural numbers, e.g. the number of accepted trees of a set with weights of 1
+counting_semiring = Semiring('counting', 0, 1,
+                             lambda x, y: x + y, lambda x, y: x * y,
+                             _log, lambda x: round(math.exp(x)))
+
+
+class WeightedTreeBDFA:
+    """TreeBDFA whose transitions and final states carry weights.
+
+    Weights are keyed like the transitions of the TreeBDFA, so any TreeBDFA
+    can be weighted as it is. The TreeBDFA and the weights should not be
+    modified afterwards.
+
+    Parameters
+    ----------
+    bdfa: the TreeBDFA
+    weights: dictionary of the form
+      {(children_state_list, parent_symbol): weight}; transitions that are
+      not listed have weight semiring.one
+    semiring: the Semiring of the weights
+    final_weights: dictionary of the form {final_state: weight}; final
+      states that are not listed have weight semiring.one
+    """
+
+    def __init__(self, bdfa, weights=None, semiring=probability_semiring,
+                 final_weights=None):
+        self.bdfa = bdfa
+        self.semiring = semiring
+        self.weights = dict(weights or {})
+        unknown = [key for key in self.weights if key not in bdfa.transitions]
+        if unknown:
+            raise ValueError(f"Weights given for missing transitions: {unknown}")
+        self.final_weights = {q: semiring.one for q in bdfa.finals}
+        for q, w in (final_weights or {}).items():
+            if q not in bdfa.finals:
+                raise ValueError(f"Final weight given for non-final state {q!r}.")
+            self.final_weights[q] = w
+        # {(children_state_list, parent_symbol): (parent_state, weight)}
+        self._table = {key: (nextstate, self.weights.get(key, semiring.one))
+                       for key, nextstate in bdfa.transitions.items()}
+        self._compiled = None
+
+    def __str__(self):
+        return (f"<WeightedTreeBDFA over the {self.semiring.name} semiring, "
+                f"{len(self.weights)} weighted transitions>")
+
+    def weight(self, tree):
+        """Return the weight of a tree, given as a Tree or a TreeArena:
+        the product of the weights of the transitions of its run and of its
+        final state, or semiring.zero if it is not accepted."""
+        table = self._table
+        times = self.semiring.times
+        zero = self.semiring.zero
+        w = self.semiring.one
+        states = []
+        if isinstance(tree, TreeArena):
+            labels = tree.labels
+            arity = tree.arity
+            symbols = tree.symbols
+            for i in range(len(labels) - 1, -1, -1):
+                n = arity[i]
+                if n == 0:
+                    statelist = ()
+                else:
+                    # reverse preorder, see TreeBDFA._process_arena
+                    statelist = tuple(states[:-n - 1:-1])
+                    del states[-n:]
+                entry = table.get((statelist, symbols[labels[i]]))
+                if entry is None:
+                    return zero
+                states.append(entry[0])
+                w = times(w, entry[1])
+        else:
+            for node in tree.postorder():
+                n = len(node.children)
+                if n == 0:
+                    statelist = ()
+                else:
+                    statelist = tuple(states[-n:])
+                    del states[-n:]
+                entry = table.get((statelist, node.data))
+                if entry is None:
+                    return zero
+                states.append(entry[0])
+                w = times(w, entry[1])
+        final = self.final_weights.get(states.pop())
+        return zero if final is None else times(w, final)
+
+    def total(self, trees):
+        """Return the sum of the weights of a sequence of trees."""
+        plus = self.semiring.plus
+        total = self.semiring.zero
+        for tree in trees:
+            total = plus(total, self.weight(tree))
+        return total
+
+    def _log_tables(self):
+        """Compile the TreeBDFA on first use and return it with the log
+        weights of its transitions and states, indexed by transition and
+        state ID, -inf standing for rejection."""
+        if self._compiled is None:
+            compiled = self.bdfa.compile()
+            to_log = self.semiring.to_log
+            one = to_log(self.semiring.one)
+            log_weights = np.full(len(compiled.keys), -np.inf)
+            for tid in range(1, len(compiled.keys)):
+                w = self.weights.get(compiled.keys[tid])
+                log_weights[tid] = one if w is None else to_log(w)
+            log_finals = np.full(len(compiled.states), -np.inf)
+            for q, w in self.final_weights.items():
+                log_finals[compiled.state_ids[q]] = to_log(w)
+            self._compiled = compiled, log_weights, log_finals
+        return self._compiled
+
+    def log_weights_many(self, trees):
+        """Return a NumPy array of the weights of a sequence of trees, given
+        as Trees or TreeArenas, in log space, -inf for rejected trees.
+
+        The batch is evaluated level by level like
+        CompiledTreeBDFA.recognizes_many. The log weights of the transitions
+        fired at each level are then added up per tree, the tree of every
+        node being that of its parent repeated once per child."""
+        trees = list(trees)
+        result = np.full(len(trees), -np.inf)
+        if len(trees) == 0:
+            return result
+        compiled, log_weights, log_finals = self._log_tables()
+        levels, order = compiled._pack(trees)
+        tids = compiled._transitions_many(levels)
+        owners = np.array(order, dtype=np.int64)
+        totals = np.zeros(len(trees))
+        for (symbols, arity), level_tids in zip(levels, tids):
+            totals += np.bincount(owners, weights=log_weights[level_tids],
+                                  minlength=len(trees))
+            owners = np.repeat(owners, arity)
+        roots = np.array(order, dtype=np.int64)
+        result[roots] = totals[roots] + log_finals[compiled.targets[tids[0]]]
+        return result
+
+    def weights_many(self, trees):
+        """Return the list of the weights of a sequence of trees, computed
+        in a batch by log_weights_many."""
+        from_log = self.semiring.from_log
+        return [from_log(float(x)) for x in self.log_weights_many(trees)]
+
+    def rank(self, trees):
+        """Return the indices of a sequence of trees sorted by decreasing
+        weight, ties keeping their order, computed in a batch."""
+        return np.argsort(-self.log_weights_many(trees), kind='stable').tolist()
+
+
+def test():
+    import time
+    from grammars import gb_grammar
+    from bench import workloads
+
+    # prefer phrases without complements or specifiers
+    probabilities = {key: 0.5 if len(key[0]) == 2 else 0.9
+                     for key in gb_grammar.transitions}
+    log_probabilities = {key: math.log(p) for key, p in probabilities.items()}
+    trees = workloads(10)['random_gb'][:5]
+    for semiring, weights in [(probability_semiring, probabilities),
+                              (log_semiring, log_probabilities),
+                              (tropical_semiring, log_probabilities)]:
+        wgb = WeightedTreeBDFA(gb_grammar, weights, semiring)
+        print(wgb)
+        print("  weights:", [f"{wgb.weight(t):.4g}" for t in trees])
+        print(f"  total: {wgb.total(trees):.4g}, ranking: {wgb.rank(trees)}")
+
+    trees = workloads(50)['random_gb'] + workloads(50)['random_min']
+    counter = WeightedTreeBDFA(gb_grammar, semiring=counting_semiring)
+    print(f"{counter.total(trees)} of {len(trees)} trees accepted")
+
+    wgb = WeightedTreeBDFA(gb_grammar, log_probabilities, log_semiring)
+    start = time.perf_counter()
+    one = [wgb.weight(t) for t in trees]
+    middle = time.perf_counter()
+    many = wgb.log_weights_many(trees)
+    end = time.perf_counter()
+    print(f"one at a time: {middle - start:.3f}s, batched: {end - middle:.3f}s, "
+          f"same: {np.allclose(one, many)}")
+
+
+if __name__ == "__main__":
+    test()